@@ -0,0 +1,245 @@
+import binascii
+import mmap
+import struct
+import sys
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Mapping as MappingTipo
+
+from hash_utils import Hashing
+from merkle_binario import DIMENSIONE_DIGEST, MerkleTreeBinario
+from merkle_tree import MerkleTree, PathCompatto
+
+"""
+Artefatto "livelli dell'albero": il Merkle Tree serializzato con ogni nodo memorizzato una sola volta
+(2n-1 nodi), da cui il Merkle Path di qualsiasi foglia viene derivato su richiesta in O(log n).
+Sostituisce il file con tutti i path materializzati (O(n log n) hash). Interi little-endian.
+
+  HEADER (16 byte)
+    magic              4 byte   b"MKTL"
+    versione           u8       VERSIONE_LIVELLI_ALBERO
+    riservato          u8 + u16 0
+    numero_foglie      u32
+    numero_nodi        u32      nodi totali di tutti i livelli (controllo di coerenza)
+  TABELLA ID FOGLIE    numero_foglie x u64 in ordine strettamente crescente (ricerca binaria)
+  LIVELLI              digest grezzi da 32 byte, livello per livello dalle foglie alla radice;
+                       il livello l+1 ha ceil(len(l) / 2) nodi (regola di promozione del nodo dispari)
+
+Il file può essere aperto con mmap (AlberoLivelli.da_file): vengono letti solo i nodi
+del path richiesto.
+"""
+MAGIC_LIVELLI_ALBERO = b"MKTL"
+VERSIONE_LIVELLI_ALBERO = 1
+_HEADER = struct.Struct("<4sBBHII")
+
+
+def e_livelli_albero(dati: bytes) -> bool:
+    """True se i dati iniziano con il magic dell'artefatto dei livelli dell'albero."""
+    return bytes(dati[:len(MAGIC_LIVELLI_ALBERO)]) == MAGIC_LIVELLI_ALBERO
+
+
+def _dimensioni_livelli(numero_foglie: int) -> List[int]:
+    dimensioni = [numero_foglie]
+    while dimensioni[-1] > 1:
+        dimensioni.append((dimensioni[-1] + 1) // 2)
+    return dimensioni
+
+
+def scrivi_livelli_albero(mappa_id: List[int], livelli: List[bytes]) -> bytes:
+    """
+    Serializza i livelli dell'albero (MerkleTreeBinario.livelli, già costruiti)
+    insieme agli ID logici delle foglie, che devono essere in ordine strettamente crescente.
+    """
+    numero_foglie = len(livelli[0]) // DIMENSIONE_DIGEST
+    if len(mappa_id) != numero_foglie:
+        raise ValueError("La lunghezza di mappa_id deve essere uguale al numero di foglie")
+    if any(a >= b for a, b in zip(mappa_id, mappa_id[1:])):
+        raise ValueError("Gli ID delle foglie devono essere in ordine strettamente crescente")
+    dimensioni = _dimensioni_livelli(numero_foglie)
+    if [len(livello) // DIMENSIONE_DIGEST for livello in livelli] != dimensioni:
+        raise ValueError("Livelli dell'albero incompleti: costruisci prima l'albero")
+    return b"".join([
+        _HEADER.pack(MAGIC_LIVELLI_ALBERO, VERSIONE_LIVELLI_ALBERO, 0, 0, numero_foglie, sum(dimensioni)),
+        struct.pack(f"<{numero_foglie}Q", *mappa_id),
+        *livelli,
+    ])
+
+
+class AlberoLivelli(Mapping):
+    """
+    Vista in sola lettura di un artefatto dei livelli dell'albero (bytes, memoryview o mmap).
+    Si comporta come un dizionario {id_foglia: PathCompatto} in cui ogni path viene calcolato
+    solo quando richiesto, in O(log n), leggendo un nodo per livello: può quindi essere usato
+    al posto del dizionario dei path restituito da carica_paths_da_bytes.
+    """
+    def __init__(self, dati) -> None:
+        self._mmap: mmap.mmap | None = dati if isinstance(dati, mmap.mmap) else None
+        self._dati = memoryview(dati)
+        try:
+            magic, versione, _, _, numero_foglie, numero_nodi = _HEADER.unpack_from(self._dati, 0)
+        except struct.error as e:
+            raise ValueError(f"Artefatto dei livelli troncato: {e}")
+        if magic != MAGIC_LIVELLI_ALBERO:
+            raise ValueError("Magic dell'artefatto dei livelli non valido")
+        if versione != VERSIONE_LIVELLI_ALBERO:
+            raise ValueError(f"Versione {versione} dell'artefatto dei livelli non supportata")
+        if numero_foglie == 0:
+            raise ValueError("Artefatto dei livelli senza foglie")
+        self._dimensioni = _dimensioni_livelli(numero_foglie)
+        if sum(self._dimensioni) != numero_nodi:
+            raise ValueError("Numero di nodi incoerente con il numero di foglie")
+        inizio_id = _HEADER.size
+        inizio_livelli = inizio_id + 8 * numero_foglie
+        if len(self._dati) != inizio_livelli + numero_nodi * DIMENSIONE_DIGEST:
+            raise ValueError("Dimensione dell'artefatto dei livelli non valida")
+        tabella_id = self._dati[inizio_id:inizio_livelli]
+        # la tabella degli ID resta nel buffer (mmap): nessuna copia se l'ordine dei byte è little-endian
+        self._id_foglie = tabella_id.cast("Q") if sys.byteorder == "little" \
+            else struct.unpack(f"<{numero_foglie}Q", tabella_id)
+        # posizione in byte del primo nodo di ogni livello
+        self._inizio_livello = []
+        offset = inizio_livelli
+        for dimensione in self._dimensioni:
+            self._inizio_livello.append(offset)
+            offset += dimensione * DIMENSIONE_DIGEST
+
+    @classmethod
+    def da_file(cls, percorso: str) -> "AlberoLivelli":
+        """Apre l'artefatto da file mappandolo in memoria (vengono letti solo i nodi usati)."""
+        with open(percorso, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def chiudi(self) -> None:
+        if isinstance(self._id_foglie, memoryview):
+            self._id_foglie.release()
+        self._dati.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    @property
+    def numero_livelli(self) -> int:
+        return len(self._dimensioni)
+
+    def numero_nodi_livello(self, livello: int) -> int:
+        return self._dimensioni[livello]
+
+    def nodo(self, livello: int, indice: int) -> bytes:
+        """Digest grezzo del nodo `indice` del livello `livello` (0 = foglie)."""
+        if not 0 <= indice < self._dimensioni[livello]:
+            raise IndexError(f"Nodo {indice} inesistente nel livello {livello}")
+        inizio = self._inizio_livello[livello] + indice * DIMENSIONE_DIGEST
+        return bytes(self._dati[inizio:inizio + DIMENSIONE_DIGEST])
+
+    def radice_esadecimale(self) -> str:
+        return self.nodo(self.numero_livelli - 1, 0).hex()
+
+    def indice_foglia(self, id_foglia: int) -> int:
+        """Posizione della foglia nell'albero (ricerca binaria sulla tabella degli ID)."""
+        indice = bisect_left(self._id_foglie, id_foglia)
+        if indice == len(self._id_foglie) or self._id_foglie[indice] != id_foglia:
+            raise KeyError(id_foglia)
+        return indice
+
+    def ottieni_path(self, id_foglia: int) -> PathCompatto:
+        """Merkle Path della foglia con ID logico `id_foglia`, derivato dai livelli in O(log n)."""
+        posizione = self.indice_foglia(id_foglia)
+        direzione = []
+        fratelli = []
+        for livello in range(self.numero_livelli - 1):
+            fratello = posizione ^ 1
+            # nessun fratello: il nodo è promosso e il livello non compare nel path
+            if fratello < self._dimensioni[livello]:
+                direzione.append("1" if posizione & 1 else "0")
+                inizio = self._inizio_livello[livello] + fratello * DIMENSIONE_DIGEST
+                fratelli.append(binascii.hexlify(self._dati[inizio:inizio + DIMENSIONE_DIGEST]).decode("ascii"))
+            posizione >>= 1
+        path = PathCompatto()
+        path.set_direzione("".join(direzione))
+        path.hash_fratelli = fratelli
+        return path
+
+    def verifica_foglie(self, mappa_id_hash: MappingTipo[int, str], root_attesa: str) -> Dict[int, bool]:
+        """
+        Verifica le foglie del batch confrontando l'albero ricalcolato dai dati con i livelli
+        memorizzati, dall'alto verso il basso (bisezione).
+        Restituisce {id_foglia: esito} per ogni foglia presente sia nei dati sia nell'albero.
+        1. L'albero viene ricalcolato dai dati (n-1 hash sui digest grezzi): se la radice coincide
+           con root_attesa tutte le foglie sono integre e i livelli memorizzati non servono.
+        2. Altrimenti si scende dalla radice memorizzata (che deve coincidere con root_attesa)
+           solo nei sottoalberi in cui nodo ricalcolato e nodo memorizzato differiscono.
+           Ogni nodo memorizzato visitato viene autenticato rispetto al padre (un hash per nodo),
+           quindi un sottoalbero il cui nodo ricalcolato coincide con quello memorizzato è integro.
+        Localizzare k foglie alterate costa O(k log n) oltre al ricalcolo.
+        Se i livelli memorizzati non sono coerenti (radice diversa da root_attesa o nodo non
+        autenticato) le foglie del sottoalbero interessato vengono verificate con i Merkle Path
+        derivati dai livelli (MerkleTree.verifica_batch), con lo stesso esito della verifica per foglia.
+        """
+        numero_foglie = len(self)
+        lista_id = list(self._id_foglie)
+        # foglie nell'ordine dell'albero: se manca il dato si usa la foglia memorizzata
+        # (l'assenza è segnalata dalla verifica di struttura del Verificatore)
+        foglie = b"".join(
+            bytes.fromhex(mappa_id_hash[id_foglia]) if id_foglia in mappa_id_hash else self.nodo(0, indice)
+            for indice, id_foglia in enumerate(lista_id)
+        )
+        ricalcolato = MerkleTreeBinario(foglie)
+        ricalcolato.costruisci()
+        if ricalcolato.radice_esadecimale() == root_attesa:
+            return {id_foglia: True for id_foglia in lista_id if id_foglia in mappa_id_hash}
+
+        esiti: Dict[int, bool] = {}
+
+        def nodo_ricalcolato(livello: int, indice: int) -> bytes:
+            return ricalcolato.livelli[livello][indice * DIMENSIONE_DIGEST:(indice + 1) * DIMENSIONE_DIGEST]
+
+        def imposta_sottoalbero(livello: int, indice: int, esito: bool | None) -> None:
+            # esito None: livelli non coerenti, le foglie vengono verificate con i path derivati
+            inizio, fine = indice << livello, min((indice + 1) << livello, numero_foglie)
+            ids = [id_foglia for id_foglia in lista_id[inizio:fine] if id_foglia in mappa_id_hash]
+            if esito is None:
+                esiti.update(MerkleTree.verifica_batch({i: mappa_id_hash[i] for i in ids}, self, root_attesa))
+            else:
+                esiti.update(dict.fromkeys(ids, esito))
+
+        livello_radice = self.numero_livelli - 1
+        if self.radice_esadecimale() != root_attesa:
+            imposta_sottoalbero(livello_radice, 0, None)
+            return esiti
+        # nodi memorizzati già autenticati il cui valore ricalcolato è diverso
+        da_visitare = [(livello_radice, 0)]
+        while da_visitare:
+            livello, indice = da_visitare.pop()
+            if livello == 0:
+                imposta_sottoalbero(0, indice, False)
+                continue
+            memorizzato = self.nodo(livello, indice)
+            figli = [k for k in (2 * indice, 2 * indice + 1) if k < self._dimensioni[livello - 1]]
+            figli_memorizzati = b"".join(self.nodo(livello - 1, k) for k in figli)
+            # autenticazione dei figli memorizzati rispetto al padre (nodo promosso: copia identica)
+            autentici = (figli_memorizzati == memorizzato if len(figli) == 1
+                         else Hashing.hash_concat_digest(figli_memorizzati) == memorizzato)
+            if not autentici:
+                imposta_sottoalbero(livello, indice, None)
+                continue
+            for k in figli:
+                if nodo_ricalcolato(livello - 1, k) == self.nodo(livello - 1, k):
+                    imposta_sottoalbero(livello - 1, k, True)
+                else:
+                    da_visitare.append((livello - 1, k))
+        return esiti
+
+    def __getitem__(self, id_foglia: int) -> PathCompatto:
+        return self.ottieni_path(id_foglia)
+
+    def __contains__(self, id_foglia) -> bool:
+        try:
+            self.indice_foglia(id_foglia)
+            return True
+        except (KeyError, TypeError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._id_foglie)
+
+    def __len__(self) -> int:
+        return len(self._id_foglie)
@@ -1,87 +1,183 @@
 import json
 import logging
-from typing import List, Dict
+from json.encoder import encode_basestring_ascii
+from typing import List, Dict, Iterable, Iterator, Tuple
+
 from Classi_comuni.config.costanti_comuni import ID_BATCH_LOGICO
 from Classi_comuni.entita.modelli_dati import DatiBatch, DatiPayload, DatiMisurazione
+from hash_utils import Hashing
 
 logger = logging.getLogger(__name__)
 
+# serializzazione compatta con chiavi ordinate (encoder C): canonizza il campo dati come DatiMisurazione.to_json
+_ENCODER_COMPATTO = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def _json_indentato(valore, rientro: str) -> str:
+    """
+    Stesso testo di json.dumps(valore, sort_keys=True, separators=(",", ":"), indent=2) per un valore
+    annidato al livello `rientro`, senza l'encoder Python usato da json con indent: i contenitori sono
+    composti qui, i valori scalari serializzati dall'encoder C. Le chiavi devono essere stringhe.
+    """
+    if isinstance(valore, dict):
+        if not valore:
+            return "{}"
+        interno = rientro + "  "
+        voci = [encode_basestring_ascii(chiave) + ":" + _json_indentato(valore[chiave], interno)
+                for chiave in sorted(valore)]
+        return "{\n" + interno + (",\n" + interno).join(voci) + "\n" + rientro + "}"
+    if isinstance(valore, (list, tuple)):
+        if not valore:
+            return "[]"
+        interno = rientro + "  "
+        voci = [_json_indentato(elemento, interno) for elemento in valore]
+        return "[\n" + interno + (",\n" + interno).join(voci) + "\n" + rientro + "]"
+    return _ENCODER_COMPATTO.encode(valore)
+
+
+def _testo_misurazione(riga: Dict) -> str | None:
+    """
+    Testo canonico di una misurazione (uguale a DatiMisurazione.to_json) composto direttamente
+    dalla riga, senza costruire il modello Pydantic. Restituisce None se i tipi della riga
+    non sono quelli già validi per il modello: la riga segue allora il percorso Pydantic.
+    """
+    id_misurazione, id_batch = riga.get("id_misurazione"), riga.get("id_batch")
+    id_sensore, timestamp, dati = riga.get("id_sensore"), riga.get("timestamp"), riga.get("dati")
+    if type(id_misurazione) is not int or type(id_batch) is not int \
+            or type(id_sensore) is not str or type(timestamp) is not str:
+        return None
+    if isinstance(dati, str):
+        # JSON letto dal database: chiavi stringa e solo tipi JSON, già in forma canonica
+        try:
+            dati = json.loads(dati)
+        except ValueError:
+            return None
+        if not isinstance(dati, dict):
+            return None
+    elif type(dati) is dict:
+        dati = json.loads(_ENCODER_COMPATTO.encode(dati))
+    else:
+        return None
+    return (
+        '{\n  "dati":' + _json_indentato(dati, "  ")
+        + ',\n  "id_batch":' + int.__repr__(id_batch)
+        + ',\n  "id_misurazione":' + int.__repr__(id_misurazione)
+        + ',\n  "id_sensore":' + encode_basestring_ascii(id_sensore)
+        + ',\n  "timestamp":' + encode_basestring_ascii(timestamp)
+        + "\n}"
+    )
+
+
 class CostruttorePayload:
     """
     Classe che prepara i dati per la costruzione del Merkle Tree e del payload.
-    Primo momento (intermedio): estrae gli oggetti da una query INNER JOIN e calcola:
+    Scorre una sola volta le righe di una query INNER JOIN (batch + misurazioni, ordinate per
+    id_misurazione) e per ogni foglia produce una sola volta il testo canonico (lo stesso di to_json),
+    usato sia per l'hash sia per il payload da inviare al cloud:
       - hash di ogni singola misurazione
       - hash del batch (separatamente)
-
-    Secondo momento: costruisce il DatiPayload da inviare al cloud, includendo la Merkle Root.
+      - payload JSON composto dagli stessi testi, senza ri-serializzare i modelli
     """
     def __init__(self) -> None:
-        self.misurazioni: List[DatiMisurazione] = []
         self.batch: DatiBatch | None = None
-        self.hash_misurazioni: List[str] = []
         self.hash_batch: str | None = None
+        self.testo_batch: str | None = None
+        # una voce per misurazione, in ordine di ID
+        self.id_misurazioni: List[int] = []
+        self.testi_misurazioni: List[str] = []
+        self.hash_misurazioni: List[str] = []
 
-    def estrai_dati_da_query(self, risultati_query: List[Dict]) -> None:
+    def estrai_dati_da_query(self, risultati_query: Iterable[Dict]) -> None:
         """
-        Estrae gli oggetti Pydantic dalle righe SQL e calcola:
-        - hash per ogni misurazione
-        - hash del batch (una sola volta)
+        Calcola in un solo passaggio sulle righe SQL (nell'ordine della query):
+        - testo canonico e hash per ogni misurazione
+        - testo canonico e hash del batch (una sola volta, dalla prima riga)
+        Le righe fuori ordine vengono ordinate per id_misurazione; le righe non valide
+        per DatiMisurazione vengono scartate (registrando l'errore).
         """
-        self.misurazioni.clear()
+        self.id_misurazioni.clear()
+        self.testi_misurazioni.clear()
         self.hash_misurazioni.clear()
-        #Ordina esplicitamente i risultati per id_misurazione
-        #Ordina usando il valore del campo id_misurazione come chiave di confronto".
-        risultati_ordinati = sorted(risultati_query, key=lambda r: r["id_misurazione"])
-        # Batch viene preso dalla prima riga (già ordinata)
-        prima_riga = risultati_ordinati[0]
-        self.batch = DatiBatch(
-            id_batch=prima_riga["id_batch"],
-            timestamp_creazione=prima_riga["timestamp_creazione"],
-            numero_misurazioni=prima_riga["numero_misurazioni"],
-            #merkle_root=""
-        )
-        self.hash_batch = self.batch.to_hash()
-
-        for riga in risultati_ordinati:
-            try:
-                if isinstance(riga["dati"], str):
-                    riga["dati"] = json.loads(riga["dati"])
-
-                mis = DatiMisurazione(
-                    id_misurazione=riga["id_misurazione"],
-                    id_sensore=riga["id_sensore"],
-                    timestamp=riga["timestamp"],
-                    dati=riga["dati"]
+        self.batch = None
+
+        ordinate = True
+        for riga in risultati_query:
+            if self.batch is None:
+                # Batch viene preso dalla prima riga
+                self.batch = DatiBatch(
+                    id_batch=riga["id_batch"],
+                    timestamp_creazione=riga["timestamp_creazione"],
+                    numero_misurazioni=riga["numero_misurazioni"],
                 )
-                self.misurazioni.append(mis)
-            except Exception as e:
-                logger.error(f"[ERRORE] Errore durante la creazione della misurazione: {e}")
-        # Alla fine di estrai_dati_da_query
-        self.misurazioni.sort(key=lambda m: m.id_misurazione)
-        self.hash_misurazioni = [m.to_hash() for m in self.misurazioni]
+                self.testo_batch = self.batch.to_json()
+                self.hash_batch = Hashing.calcola_hash(self.testo_batch)
+            testo = _testo_misurazione(riga)
+            if testo is None:
+                # tipi da convertire o validare: stesso risultato tramite il modello Pydantic
+                try:
+                    dati = riga["dati"]
+                    mis = DatiMisurazione(
+                        id_misurazione=riga["id_misurazione"],
+                        id_sensore=riga["id_sensore"],
+                        timestamp=riga["timestamp"],
+                        id_batch=riga["id_batch"],
+                        dati=json.loads(dati) if isinstance(dati, str) else dati
+                    )
+                except Exception as e:
+                    logger.error(f"[ERRORE] Errore durante la creazione della misurazione: {e}")
+                    continue
+                testo = mis.to_json()
+                id_misurazione = mis.id_misurazione
+            else:
+                id_misurazione = riga["id_misurazione"]
+            if self.id_misurazioni and id_misurazione < self.id_misurazioni[-1]:
+                ordinate = False
+            self.id_misurazioni.append(id_misurazione)
+            self.testi_misurazioni.append(testo)
+            self.hash_misurazioni.append(Hashing.calcola_hash(testo))
 
-    def costruisci_payload(self) -> DatiPayload:
+        if self.batch is None:
+            raise ValueError("Nessuna riga ricevuta dalla query.")
+        if not ordinate:
+            # ordinamento stabile, come il sort per id_misurazione delle misurazioni
+            ordine = sorted(range(len(self.id_misurazioni)), key=self.id_misurazioni.__getitem__)
+            self.id_misurazioni[:] = [self.id_misurazioni[i] for i in ordine]
+            self.testi_misurazioni[:] = [self.testi_misurazioni[i] for i in ordine]
+            self.hash_misurazioni[:] = [self.hash_misurazioni[i] for i in ordine]
+
+    def itera_foglie(self) -> Iterator[Tuple[int, str]]:
+        """Restituisce (ID logico, hash) per ogni foglia in ordine di ID: prima il batch (ID 0)."""
+        if not self.hash_batch:
+            raise ValueError("Hash del batch non calcolato. Chiama prima estrai_dati_query.")
+        yield ID_BATCH_LOGICO, self.hash_batch
+        yield from zip(self.id_misurazioni, self.hash_misurazioni)
+
+    def itera_payload_json(self) -> Iterator[str]:
         """
-        Costruisce il payload da inviare al cloud.
-        La Merkle Root può essere inserita nel batch per scopi di debug
-        I Merkle Path NON sono inclusi (vanno su IPFS separatamente).
+        Restituisce a frammenti il payload JSON da inviare al cloud ({"batch": ..., "misurazioni": [...]}),
+        composto dai testi canonici già usati per gli hash. I Merkle Path NON sono inclusi.
         """
-        if self.batch is None:
+        if self.testo_batch is None:
             raise ValueError("Batch non inizializzato. Chiama prima 'estrai_dati_query'.")
-
-        # self.misurazioni è una lista e questo controllo equivale a verificare se la
-        # lista è vuota
-        if not self.misurazioni:
+        if not self.testi_misurazioni:
             raise ValueError("Nessuna misurazione trovata. Il payload sarebbe vuoto.")
+        yield '{"batch":'
+        yield self.testo_batch
+        yield ',"misurazioni":['
+        for indice, testo in enumerate(self.testi_misurazioni):
+            yield "," + testo if indice else testo
+        yield "]}"
 
-        # Crea un nuovo oggetto DatiBatch con Merkle Root. Possibile solo per classi PYDANTIC
-        # DATIBATCH è una classe PYDANTIC
-        #batch_con_root = self.batch.model_copy(update={"merkle_root": merkle_root})
+    def ottieni_payload_json(self) -> str:
+        """Payload JSON da inviare al cloud (vedi itera_payload_json)."""
+        return "".join(self.itera_payload_json())
 
-        return DatiPayload(
-            batch=self.batch,
-            misurazioni=list(self.misurazioni)  # copia esplicita
-        )
+    def costruisci_payload(self) -> DatiPayload:
+        """
+        Costruisce il payload da inviare al cloud come modello Pydantic.
+        Per l'invio è preferibile ottieni_payload_json, che non ri-serializza le misurazioni.
+        """
+        return DatiPayload.model_validate_json(self.ottieni_payload_json())
 
     def ottieni_mappa_id_foglie(self) -> dict[int, str]:
         """
@@ -90,14 +186,10 @@ class CostruttorePayload:
         - ID 0 per il batch
         - ID della misurazione per ogni misurazione
         """
-        if not self.hash_batch:
-            raise ValueError("Hash del batch non calcolato. Chiama prima estrai_dati_query.")
         if not self.hash_misurazioni:
             raise ValueError("Hash delle misurazioni non calcolate. Chiama prima estrai_dati_query.")
-        mappa_id_hash = {ID_BATCH_LOGICO: self.batch.to_hash()}
-        for mis in self.misurazioni:
-            # 2047 --> ababhuduhjcdbjkcbkdshdcwi
-            mappa_id_hash[mis.id_misurazione] = mis.to_hash()
-
-        # Ordinamento finale del dizionario per chiave (ID)
-        return dict(sorted(mappa_id_hash.items()))
+        mappa_id_hash = dict(self.itera_foglie())
+        # le foglie sono già in ordine di ID, salvo ID di misurazione non positivi
+        if self.id_misurazioni[0] <= ID_BATCH_LOGICO:
+            return dict(sorted(mappa_id_hash.items()))
+        return mappa_id_hash
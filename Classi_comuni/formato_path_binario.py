@@ -0,0 +1,222 @@
+import binascii
+import struct
+from typing import Dict, List, Mapping, Iterable, Iterator, Tuple
+
+from merkle_binario import DIMENSIONE_DIGEST
+from merkle_tree import PathCompatto
+
+"""
+Formato binario versionato del file dei Merkle Path (alternativo al JSON indentato).
+Tutti gli interi sono little-endian.
+
+  HEADER (16 byte)
+    magic              4 byte   b"MKPB"
+    versione           u8       VERSIONE_PATH_BINARIO
+    dimensione_indice  u8       2 o 4: byte di ciascun indice nella tabella degli hash
+    riservato          u16      0
+    numero_foglie      u32
+    numero_hash        u32
+  TABELLA ID FOGLIE    numero_foglie x u64, nell'ordine delle foglie (ID logici, 0 = batch)
+  TABELLA HASH         numero_hash x 32 byte (digest SHA-256 grezzi)
+  RECORD PER FOGLIA    uno per foglia, nello stesso ordine della tabella ID:
+    lunghezza          u8       numero di fratelli nel path
+    direzioni          u64      bit i = direzione del livello i ("1" = fratello a sinistra)
+    fratelli           lunghezza x indice (u16 o u32) nella tabella hash
+
+La tabella hash contiene ogni nodo dell'albero (radice esclusa) una sola volta: un nodo è
+fratello di tutte le foglie del sottoalbero accanto al suo, quindi i record referenziano
+gli stessi hash per indice invece di ripeterli. Le tabelle precedono i record, per cui il file
+può essere letto in streaming, foglia per foglia, dopo aver letto header e tabelle.
+"""
+MAGIC_PATH_BINARIO = b"MKPB"
+VERSIONE_PATH_BINARIO = 1
+_HEADER = struct.Struct("<4sBBHII")
+_TESTA_RECORD = struct.Struct("<BQ")
+
+
+def e_formato_binario(dati: bytes) -> bool:
+    """True se i dati iniziano con il magic del formato binario dei Merkle Path."""
+    return dati[:len(MAGIC_PATH_BINARIO)] == MAGIC_PATH_BINARIO
+
+
+def scrivi_paths_binario(mappa_id: List[int], livelli: List[bytes]) -> bytes:
+    """
+    Serializza i Merkle Path di tutte le foglie a partire dai livelli dell'albero
+    (MerkleTreeBinario.livelli) e dagli ID logici delle foglie, nell'ordine delle foglie.
+    """
+    numero_foglie = len(livelli[0]) // DIMENSIONE_DIGEST
+    if len(mappa_id) != numero_foglie:
+        raise ValueError("La lunghezza di mappa_id deve essere uguale al numero di foglie")
+    livelli_path = livelli[:-1]
+    # posizione del primo nodo di ogni livello nella tabella hash
+    inizio_livello = []
+    numero_hash = 0
+    for livello in livelli_path:
+        inizio_livello.append(numero_hash)
+        numero_hash += len(livello) // DIMENSIONE_DIGEST
+    dimensione_indice = 2 if numero_hash <= 0xFFFF else 4
+    formato_indice = "H" if dimensione_indice == 2 else "I"
+    numero_nodi = [len(livello) // DIMENSIONE_DIGEST for livello in livelli_path]
+
+    record = []
+    for indice in range(numero_foglie):
+        direzioni = 0
+        fratelli = []
+        posizione = indice
+        for livello, nodi in enumerate(numero_nodi):
+            fratello = posizione ^ 1
+            # nessun fratello: il nodo è promosso e il livello non compare nel path
+            if fratello < nodi:
+                if posizione & 1:
+                    direzioni |= 1 << len(fratelli)
+                fratelli.append(inizio_livello[livello] + fratello)
+            posizione >>= 1
+        record.append(_TESTA_RECORD.pack(len(fratelli), direzioni))
+        record.append(struct.pack(f"<{len(fratelli)}{formato_indice}", *fratelli))
+
+    return b"".join([
+        _HEADER.pack(MAGIC_PATH_BINARIO, VERSIONE_PATH_BINARIO, dimensione_indice, 0, numero_foglie, numero_hash),
+        struct.pack(f"<{numero_foglie}Q", *mappa_id),
+        *livelli_path,
+        *record,
+    ])
+
+
+def scrivi_paths_compatti(paths: Mapping[int, PathCompatto]) -> bytes:
+    """
+    Serializza nel formato binario dei Merkle Path già calcolati (ad esempio letti dal JSON),
+    senza disporre dei livelli dell'albero: la tabella hash contiene gli hash fratelli distinti,
+    nell'ordine in cui compaiono. Il risultato si legge con leggi_paths_binario.
+    """
+    indice_hash: Dict[str, int] = {}
+    record = []
+    for path in paths.values():
+        fratelli = path.get_hash_fratelli()
+        direzione = path.get_direzione()
+        if len(direzione) != len(fratelli) or len(fratelli) > 64:
+            raise ValueError("Merkle Path non rappresentabile nel formato binario")
+        direzioni = sum(1 << i for i, bit in enumerate(direzione) if bit == "1")
+        record.append((len(fratelli), direzioni, [indice_hash.setdefault(h, len(indice_hash)) for h in fratelli]))
+
+    numero_hash = len(indice_hash)
+    dimensione_indice = 2 if numero_hash <= 0xFFFF else 4
+    formato_indice = "H" if dimensione_indice == 2 else "I"
+    tabella_hex = "".join(indice_hash)
+    # il formato memorizza i digest grezzi e li rilegge in esadecimale minuscolo:
+    # hash in maiuscolo cambierebbero la concatenazione hashata durante la verifica
+    if tabella_hex != tabella_hex.lower():
+        raise ValueError("Hash fratelli non in esadecimale minuscolo")
+    try:
+        tabella_hash = binascii.unhexlify(tabella_hex)
+    except binascii.Error as e:
+        raise ValueError(f"Hash fratello non esadecimale: {e}")
+    if len(tabella_hash) != numero_hash * DIMENSIONE_DIGEST:
+        raise ValueError("Hash fratello di lunghezza non valida")
+
+    parti = [
+        _HEADER.pack(MAGIC_PATH_BINARIO, VERSIONE_PATH_BINARIO, dimensione_indice, 0, len(paths), numero_hash),
+        struct.pack(f"<{len(paths)}Q", *paths.keys()),
+        tabella_hash,
+    ]
+    for lunghezza, direzioni, indici in record:
+        parti.append(_TESTA_RECORD.pack(lunghezza, direzioni))
+        parti.append(struct.pack(f"<{lunghezza}{formato_indice}", *indici))
+    return b"".join(parti)
+
+
+def leggi_paths_binario(dati: bytes) -> Dict[int, PathCompatto]:
+    """
+    Deserializza un file binario dei Merkle Path in {id_foglia: PathCompatto}
+    con hash fratelli esadecimali (stesso risultato della lettura del JSON).
+    Solleva ValueError se il file non è valido o la versione non è supportata.
+    """
+    try:
+        magic, versione, dimensione_indice, _, numero_foglie, numero_hash = _HEADER.unpack_from(dati, 0)
+        if magic != MAGIC_PATH_BINARIO:
+            raise ValueError("magic non valido")
+        if versione != VERSIONE_PATH_BINARIO:
+            raise ValueError(f"versione {versione} non supportata")
+        if dimensione_indice not in (2, 4):
+            raise ValueError(f"dimensione indice {dimensione_indice} non valida")
+        formato_indice = "H" if dimensione_indice == 2 else "I"
+        offset = _HEADER.size
+        lista_id = struct.unpack_from(f"<{numero_foglie}Q", dati, offset)
+        offset += 8 * numero_foglie
+        # la tabella hash viene convertita in esadecimale una sola volta; ogni fratello è una slice
+        fine_tabella = offset + numero_hash * DIMENSIONE_DIGEST
+        if fine_tabella > len(dati):
+            raise ValueError("tabella hash troncata")
+        tabella_hex = binascii.hexlify(dati[offset:fine_tabella]).decode("ascii")
+        offset = fine_tabella
+        larghezza = 2 * DIMENSIONE_DIGEST
+
+        paths: Dict[int, PathCompatto] = {}
+        for id_foglia in lista_id:
+            lunghezza, direzioni = _TESTA_RECORD.unpack_from(dati, offset)
+            offset += _TESTA_RECORD.size
+            indici = struct.unpack_from(f"<{lunghezza}{formato_indice}", dati, offset)
+            offset += lunghezza * dimensione_indice
+            if indici and max(indici) >= numero_hash:
+                raise ValueError(f"indice fratello fuori tabella per la foglia {id_foglia}")
+            path = PathCompatto()
+            path.set_direzione("".join("1" if direzioni >> i & 1 else "0" for i in range(lunghezza)))
+            path.hash_fratelli = [tabella_hex[k * larghezza:(k + 1) * larghezza] for k in indici]
+            paths[id_foglia] = path
+        return paths
+    except struct.error as e:
+        raise ValueError(f"Errore nella deserializzazione dei Merkle Path binari: file troncato ({e})")
+
+
+class _LettoreBlocchi:
+    """Legge quantità esatte di byte da una sequenza di blocchi (es. download in streaming)."""
+    def __init__(self, blocchi: Iterable[bytes]):
+        self._blocchi = iter(blocchi)
+        self._buffer = bytearray()
+        self._posizione = 0
+
+    def leggi(self, n: int) -> bytes:
+        while len(self._buffer) - self._posizione < n:
+            blocco = next(self._blocchi, None)
+            if blocco is None:
+                raise ValueError("Errore nella deserializzazione dei Merkle Path binari: file troncato")
+            # i byte già letti vengono scartati prima di accodare il nuovo blocco
+            del self._buffer[:self._posizione]
+            self._posizione = 0
+            self._buffer += blocco
+        dati = bytes(self._buffer[self._posizione:self._posizione + n])
+        self._posizione += n
+        return dati
+
+
+def itera_paths_binario(blocchi: Iterable[bytes]) -> Iterator[Tuple[int, PathCompatto]]:
+    """
+    Lettura incrementale del formato binario: restituisce (id_foglia, PathCompatto) per ogni
+    record man mano che i blocchi arrivano, con lo stesso risultato di leggi_paths_binario.
+    Header e tabelle precedono i record e vengono letti per primi; la tabella hash resta in
+    memoria in forma grezza (32 byte per hash) e ogni fratello è convertito in esadecimale
+    solo quando serve.
+    """
+    lettore = _LettoreBlocchi(blocchi)
+    magic, versione, dimensione_indice, _, numero_foglie, numero_hash = _HEADER.unpack(lettore.leggi(_HEADER.size))
+    if magic != MAGIC_PATH_BINARIO:
+        raise ValueError("magic non valido")
+    if versione != VERSIONE_PATH_BINARIO:
+        raise ValueError(f"versione {versione} non supportata")
+    if dimensione_indice not in (2, 4):
+        raise ValueError(f"dimensione indice {dimensione_indice} non valida")
+    formato_indice = "H" if dimensione_indice == 2 else "I"
+    lista_id = struct.unpack(f"<{numero_foglie}Q", lettore.leggi(8 * numero_foglie))
+    tabella_hash = lettore.leggi(numero_hash * DIMENSIONE_DIGEST)
+
+    for id_foglia in lista_id:
+        lunghezza, direzioni = _TESTA_RECORD.unpack(lettore.leggi(_TESTA_RECORD.size))
+        indici = struct.unpack(f"<{lunghezza}{formato_indice}", lettore.leggi(lunghezza * dimensione_indice))
+        if indici and max(indici) >= numero_hash:
+            raise ValueError(f"indice fratello fuori tabella per la foglia {id_foglia}")
+        path = PathCompatto()
+        path.set_direzione("".join("1" if direzioni >> i & 1 else "0" for i in range(lunghezza)))
+        path.hash_fratelli = [
+            binascii.hexlify(tabella_hash[k * DIMENSIONE_DIGEST:(k + 1) * DIMENSIONE_DIGEST]).decode("ascii")
+            for k in indici
+        ]
+        yield id_foglia, path
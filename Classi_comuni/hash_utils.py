@@ -1,3 +1,4 @@
+import binascii
 import hashlib
 
 class Hashing:
@@ -15,3 +16,13 @@ class Hashing:
             la concatenazione di due stringhe
             """
         return Hashing.calcola_hash(elem_sx + elem_dx)
+
+    @staticmethod
+    def hash_concat_digest(coppia: bytes | memoryview) -> bytes:
+        """
+        Calcola il digest SHA-256 (32 byte grezzi) del nodo padre a partire da due digest
+        grezzi contigui (64 byte: figlio sinistro seguito dal figlio destro).
+        Il risultato coincide con hash_concat applicato alle rispettive stringhe esadecimali,
+        ma evita la costruzione e la codifica UTF-8 della stringa di 128 caratteri.
+        """
+        return hashlib.sha256(binascii.hexlify(coppia)).digest()
@@ -0,0 +1,119 @@
+import binascii
+import logging
+from typing import List, Tuple
+
+from hash_utils import Hashing
+
+logger = logging.getLogger(__name__)
+
+# Dimensione in byte di un digest SHA-256
+DIMENSIONE_DIGEST = 32
+
+
+class MerkleTreeBinario:
+    """
+    Motore di costruzione del Merkle Tree che lavora su digest grezzi da 32 byte.
+    Ogni livello dell'albero è memorizzato in un unico buffer `bytes` contiguo:
+    il nodo i-esimo del livello occupa i byte [i*32, (i+1)*32).
+    - livelli[0] contiene le foglie
+    - livelli[-1] contiene la sola radice
+
+    La regola di hashing è identica a quella di MerkleTree (SHA-256 della concatenazione
+    delle due stringhe esadecimali dei figli), quindi radice e Merkle Path in esadecimale
+    restano compatibili con i verificatori esistenti.
+
+    Regola per i nodi dispari (PROMOZIONE): se un livello ha un numero dispari di nodi,
+    l'ultimo nodo non viene hashato con nessun fratello ma viene copiato così com'è
+    nel livello superiore. Il nodo promosso non aggiunge nulla al proprio Merkle Path
+    per quel livello. Con un numero di foglie potenza di due non avviene alcuna promozione
+    e l'albero coincide con quello costruito in precedenza.
+    """
+
+    def __init__(self, foglie: bytes) -> None:
+        if not foglie:
+            raise ValueError("L'albero non può essere costruito senza foglie.")
+        if len(foglie) % DIMENSIONE_DIGEST != 0:
+            raise ValueError("Il buffer delle foglie deve contenere digest da 32 byte.")
+        self.livelli: List[bytes] = [bytes(foglie)]
+
+    @classmethod
+    def da_hash_esadecimali(cls, foglie_hash: List[str]) -> "MerkleTreeBinario":
+        """
+        Costruisce il motore a partire dagli hash esadecimali delle foglie
+        (una sola conversione hex -> bytes per l'intero livello).
+        """
+        return cls(bytes.fromhex("".join(foglie_hash)))
+
+    @property
+    def numero_foglie(self) -> int:
+        return len(self.livelli[0]) // DIMENSIONE_DIGEST
+
+    def costruisci(self) -> bytes:
+        """
+        Costruisce tutti i livelli dell'albero dal basso verso l'alto e restituisce
+        il digest grezzo della radice.
+        """
+        del self.livelli[1:]
+        corrente = self.livelli[0]
+        while len(corrente) > DIMENSIONE_DIGEST:
+            vista = memoryview(corrente)
+            # byte occupati dalle coppie complete; l'eventuale nodo dispari resta fuori
+            fine_coppie = len(corrente) - len(corrente) % (2 * DIMENSIONE_DIGEST)
+            # ogni coppia di figli è già contigua nel buffer: 64 byte -> 1 digest padre
+            padri = [
+                Hashing.hash_concat_digest(vista[k:k + 2 * DIMENSIONE_DIGEST])
+                for k in range(0, fine_coppie, 2 * DIMENSIONE_DIGEST)
+            ]
+            if fine_coppie < len(corrente):
+                # nodo dispari: promosso senza hashing al livello superiore
+                padri.append(corrente[fine_coppie:])
+            corrente = b"".join(padri)
+            self.livelli.append(corrente)
+            logger.debug(f"Livello {len(self.livelli) - 1} costruito (len={len(corrente) // DIMENSIONE_DIGEST})")
+        return self.livelli[-1]
+
+    def radice_esadecimale(self) -> str:
+        if len(self.livelli[-1]) != DIMENSIONE_DIGEST:
+            raise ValueError("Costruisci prima l'albero e poi ottieni la radice!")
+        return self.livelli[-1].hex()
+
+    def ottieni_path(self, indice: int) -> Tuple[str, List[bytes]]:
+        """
+        Restituisce il Merkle Path della foglia in posizione `indice`:
+        - stringa delle direzioni ("0" = fratello a destra, "1" = fratello a sinistra)
+        - lista dei digest grezzi dei fratelli, dal livello delle foglie verso la radice
+        I livelli in cui il nodo viene promosso (nessun fratello) non compaiono nel path.
+        """
+        direzione = []
+        fratelli = []
+        for livello in self.livelli[:-1]:
+            fratello = indice ^ 1
+            if fratello * DIMENSIONE_DIGEST < len(livello):
+                direzione.append("1" if indice & 1 else "0")
+                fratelli.append(livello[fratello * DIMENSIONE_DIGEST:(fratello + 1) * DIMENSIONE_DIGEST])
+            indice >>= 1
+        return "".join(direzione), fratelli
+
+    def ottieni_paths_esadecimali(self) -> List[Tuple[str, List[str]]]:
+        """
+        Genera in un'unica passata i Merkle Path di tutte le foglie, nell'ordine delle foglie,
+        con i fratelli in esadecimale (formato compatibile con PathCompatto).
+        Ogni livello viene convertito in esadecimale una sola volta; i fratelli sono
+        semplici slice della stringa del livello.
+        """
+        livelli_hex = [binascii.hexlify(livello).decode("ascii") for livello in self.livelli[:-1]]
+        larghezza = 2 * DIMENSIONE_DIGEST
+        paths = []
+        for indice in range(self.numero_foglie):
+            direzione = []
+            fratelli = []
+            posizione = indice
+            for livello_hex in livelli_hex:
+                fratello = posizione ^ 1
+                # nessun fratello: il nodo è promosso e il livello non compare nel path
+                if fratello * larghezza < len(livello_hex):
+                    direzione.append("1" if posizione & 1 else "0")
+                    fratelli.append(livello_hex[fratello * larghezza:(fratello + 1) * larghezza])
+                posizione >>= 1
+            paths.append(("".join(direzione), fratelli))
+        return paths
@@ -1,8 +1,9 @@
 import json
 import logging
 from dataclasses import dataclass
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, Mapping, Iterable, Iterator
 from hash_utils import Hashing
+from merkle_binario import MerkleTreeBinario
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.CRITICAL + 1)
@@ -40,80 +41,50 @@ class PathCompatto:
         }
 
 class MerkleTree:
+    """
+    Merkle Tree costruito su un numero qualsiasi di foglie (ordinate per ID logico).
+    Se un livello ha un numero dispari di nodi, l'ultimo nodo viene PROMOSSO al livello
+    superiore senza essere hashato (nessuna duplicazione). Il Merkle Path della foglia
+    promossa non contiene né direzione né fratello per quel livello: la stessa regola
+    è quindi applicata automaticamente da verifica_singola_foglia lato Verificatore.
+    """
     def __init__(self, foglie_hash: List[str], mappa_id: List[int]):
         self.foglie_hash = foglie_hash
         self.paths: Optional[Dict[int, PathCompatto]] = None  # Merkle Path compatte per ogni foglia
         self.root: Optional[str] = None
         self.mappa_id = mappa_id
-
-    def _aggiorna_paths(self, gruppo_sx: List[int], gruppo_dx: List[int],
-                        elem_sx: str, elem_dx: str) -> None:
-        if self.paths is None:
-            return
-        for idx in gruppo_sx:
-            self.paths[idx].append_direzione("0")  # 0 = aggiungi fratello a destra
-            self.paths[idx].hash_fratelli.append(elem_dx)
-            logger.debug(f"AGGIORNAMENTO MERKLE_PATH ↳ Foglia {idx} → aggiunge fratello DESTRO {elem_dx}\n")
-        for idx in gruppo_dx:
-            self.paths[idx].append_direzione("1")  # 1 = fratello a sinistra
-            self.paths[idx].hash_fratelli.append(elem_sx)
-            logger.debug(f"AGGIORNAMENTO MERKLE_PATH ↳ Foglia {idx} → aggiunge fratello SINISTRO {elem_sx}\n")
+        # Motore su digest grezzi: contiene tutti i livelli dell'albero
+        self.motore: Optional[MerkleTreeBinario] = None
 
     def costruisci_albero(self) -> str:
         if not self.foglie_hash:
             raise ValueError("L'albero non può essere costruito senza foglie.")
-        n = len(self.foglie_hash)
-        # verifica che il numero di foglie è potenza di due
-        if not n > 0 and (n & (n - 1)) == 0:
-            raise ValueError("Il numero di foglie deve essere una potenza di due")
-
         if self.mappa_id is None:
             raise ValueError("È obbligatorio fornire una mappa_id per generare i Merkle Path.")
         if len(self.mappa_id) != len(self.foglie_hash):
             raise ValueError("La lunghezza di mappa_id deve essere uguale al numero di foglie")
 
-        # inizializzazione delle strutture dati importanti
-        self.paths = {id_logico: PathCompatto() for id_logico in self.mappa_id}
-        indici_correnti = [[id_logico] for id_logico in self.mappa_id]
-        livello_corrente = list(self.foglie_hash)
-
         logger.info("🌱 Hash delle foglie iniziali:")
         for i, h in enumerate(self.foglie_hash):
             logger.debug(f"  Foglia {i}: {h}")
 
-        #solo per debug uso la variabile livello
-        livello = 0
-        while len(livello_corrente) > 1:
-            logger.debug(f"\n🧱 Livello {livello} (len={len(livello_corrente)})")
-            logger.debug(f"  Indici correnti: {indici_correnti}")
-            nuovo_livello = []
-            nuovi_indici = []
-
-            for i in range(0, len(livello_corrente), 2):
-                elem_sx = livello_corrente[i]
-                elem_dx = livello_corrente[i + 1]
-                elem_padre = Hashing.hash_concat(elem_sx, elem_dx)
-                nuovo_livello.append(elem_padre)
-                gruppo_sx = indici_correnti[i]
-                gruppo_dx = indici_correnti[i + 1]
-
-                logger.debug(
-                    f"Hash Sinistro:   {elem_sx}\n"
-                    f"Hash Destro:     {elem_dx}\n"
-                    f"Hash Padre:      {elem_padre}\n"
-                    f"Gruppo SX:       {gruppo_sx}\n"
-                    f"Gruppo DX:       {gruppo_dx}\n"
-                )
-                self._aggiorna_paths(gruppo_sx, gruppo_dx, elem_sx, elem_dx)
-                nuovi_indici.append(gruppo_sx + gruppo_dx)
-
-            indici_correnti = list(nuovi_indici)
-            livello_corrente = nuovo_livello
-            livello += 1
-
-        self.root = livello_corrente[0]
+        # I livelli vengono costruiti su buffer contigui di digest da 32 byte.
+        # I Merkle Path non vengono più aggiornati foglia per foglia durante la costruzione:
+        # sono derivati dai livelli solo quando richiesti.
+        self.paths = None
+        self.motore = MerkleTreeBinario.da_hash_esadecimali(self.foglie_hash)
+        self.motore.costruisci()
+        self.root = self.motore.radice_esadecimale()
         return self.root
 
+    def _paths_esadecimali(self) -> Dict[int, Tuple[str, List[str]]]:
+        """
+        Restituisce {id_logico: (direzioni, hash_fratelli)} generati in un'unica passata sui livelli.
+        """
+        if self.motore is None:
+            raise ValueError("Proofs non ancora generate. Costruisci prima l'albero Merkle.")
+        return dict(zip(self.mappa_id, self.motore.ottieni_paths_esadecimali()))
+
     def ottieni_merkle_paths(self) -> dict[int, PathCompatto]:
         """
         Restituisce il dizionario completo dei Merkle Path compatti:
@@ -121,7 +92,12 @@ class MerkleTree:
         - valori: {'direzioni': str, 'hash_fratelli': list[str]}
         """
         if self.paths is None:
-            raise ValueError("Proofs non ancora generate. Costruisci prima l'albero Merkle.")
+            self.paths = {}
+            for id_logico, (direzione, hash_fratelli) in self._paths_esadecimali().items():
+                path = PathCompatto()
+                path.set_direzione(direzione)
+                path.set_hash_fratelli(hash_fratelli)
+                self.paths[id_logico] = path
         return self.paths
 
     def ottieni_merkle_paths_JSON(self) -> str:
@@ -129,18 +105,12 @@ class MerkleTree:
         Restituisce una stringa JSON formattata del dizionario dei Merkle Path compatti.
         Utile per la memorizzazione o l'invio su IPFS/Filebase.
         """
-        if self.paths is None:
-            raise ValueError("Proofs non ancora generate. Costruisci prima l'albero Merkle.")
-
-        # Converte tutte i PathCompatti in dizionari standard Python (serializzabili in JSON)
-        # self.paths è un dizionario: {id_misurazione: PathCompatti}
-        # Usando .to_dict() su ogni PathCompatto, otteniamo:
-        # {id_misurazione: {"direzione": "01", "hash_fratelli": ["abc", "def"]}, ...}
-        # chiave id_misurazione --> valore: un dizionario composto da due chiavi "dir"
-        # "hash"
+        # Costruisce direttamente i dizionari serializzabili a partire dai livelli dell'albero,
+        # senza passare per gli oggetti PathCompatto:
+        # {id_misurazione: {"dir": "01", "hash": ["abc", "def"]}, ...}
         paths_dict = {
-            id_misurazione: path.to_dict()
-            for id_misurazione, path in self.paths.items()
+            id_misurazione: {"dir": direzione, "hash": hash_fratelli}
+            for id_misurazione, (direzione, hash_fratelli) in self._paths_esadecimali().items()
         }
 
         # Serializza il dizionario finale in stringa JSON leggibile
@@ -154,6 +124,28 @@ class MerkleTree:
             indent=2
         )
 
+    def ottieni_merkle_paths_binario(self) -> bytes:
+        """
+        Restituisce i Merkle Path nel formato binario versionato (vedi formato_path_binario):
+        hash fratelli grezzi da 32 byte, ciascuno memorizzato una sola volta.
+        """
+        if self.motore is None:
+            raise ValueError("Proofs non ancora generate. Costruisci prima l'albero Merkle.")
+        # import locale: formato_path_binario dipende a sua volta da PathCompatto
+        from formato_path_binario import scrivi_paths_binario
+        return scrivi_paths_binario(self.mappa_id, self.motore.livelli)
+
+    def ottieni_livelli_albero(self) -> bytes:
+        """
+        Restituisce l'artefatto dei livelli dell'albero (vedi albero_livelli): ogni nodo
+        memorizzato una sola volta, path di qualsiasi foglia derivabile in O(log n).
+        Nessun PathCompatto viene costruito lato produttore.
+        """
+        if self.motore is None:
+            raise ValueError("Proofs non ancora generate. Costruisci prima l'albero Merkle.")
+        from albero_livelli import scrivi_livelli_albero
+        return scrivi_livelli_albero(self.mappa_id, self.motore.livelli)
+
     def ottieni_merkle_root(self) -> str:
         if self.root is None:
             raise ValueError("Costruisci prima l'albero e poi ottieni la radice!")
@@ -161,7 +153,9 @@ class MerkleTree:
 
     @staticmethod
     def verifica_singola_foglia(foglia_hash: str, path: PathCompatto, root_attesa: str) -> bool:
-        # Verifica l'integrità di una singola foglia usando il Merkle Path compatto
+        # Verifica l'integrità di una singola foglia usando il Merkle Path compatto.
+        # I livelli in cui la foglia è stata promossa non compaiono nel path,
+        # quindi non serve alcun trattamento speciale dei nodi dispari
         direzioni = path.get_direzione()
         hash_fratelli = path.get_hash_fratelli()
         h = foglia_hash
@@ -171,3 +165,112 @@ class MerkleTree:
             elif direzione == "0":  # destra
                 h = Hashing.hash_concat(h, fratello)
         return h == root_attesa
+
+    @staticmethod
+    def verifica_batch(mappa_id_hash: Mapping[int, str], paths: Mapping[int, PathCompatto],
+                       root_attesa: str) -> Dict[int, bool]:
+        """
+        Verifica in un'unica passata tutte le foglie di un batch: restituisce {id_foglia: esito}
+        per ogni foglia presente sia in mappa_id_hash sia in paths.
+        L'esito di ogni foglia coincide con quello di verifica_singola_foglia, ma i nodi interni
+        vengono calcolati una sola volta: ogni coppia (figlio sinistro, figlio destro) già hashata
+        viene riutilizzata dalle foglie successive dello stesso sottoalbero.
+        Per un batch integro servono quindi n-1 hash invece di n·log n; ogni foglia alterata
+        aggiunge al più log n hash (il suo percorso diverge da quello originale fino alla radice).
+        """
+        # (sinistro, destro) -> padre; contiene al più un elemento per nodo interno
+        # più i nodi ricalcolati sui percorsi delle foglie alterate
+        nodi_calcolati: Dict[Tuple[str, str], str] = {}
+        esiti: Dict[int, bool] = {}
+        for id_foglia, foglia_hash in mappa_id_hash.items():
+            if id_foglia not in paths:
+                continue
+            path = paths[id_foglia]
+            h = foglia_hash
+            for direzione, fratello in zip(path.get_direzione(), path.get_hash_fratelli()):
+                if direzione == "1":  # sinistra
+                    coppia = (fratello, h)
+                elif direzione == "0":  # destra
+                    coppia = (h, fratello)
+                else:
+                    continue
+                padre = nodi_calcolati.get(coppia)
+                if padre is None:
+                    padre = Hashing.hash_concat(*coppia)
+                    nodi_calcolati[coppia] = padre
+                h = padre
+            esiti[id_foglia] = h == root_attesa
+        return esiti
+
+    @staticmethod
+    def verifica_foglie_in_ordine(mappa_id_hash: Mapping[int, str],
+                                  coppie_path: Iterable[Tuple[int, PathCompatto]],
+                                  root_attesa: str) -> Iterator[Tuple[int, bool]]:
+        """
+        Variante in streaming di verifica_batch: verifica le foglie man mano che arrivano le
+        coppie (id_foglia, path), ad esempio durante lo scaricamento del file dei Merkle Path,
+        e restituisce (id_foglia, esito) per ogni foglia presente anche in mappa_id_hash.
+        Le foglie consecutive dello stesso sottoalbero condividono la parte alta del path, alla
+        stessa distanza dalla radice: per ogni distanza viene ricordato solo l'ultimo nodo
+        calcolato. Con le foglie nell'ordine dell'albero (l'ordine dei file prodotti dal fog node)
+        servono n-1 hash come in verifica_batch, con memoria O(log n) invece di O(n);
+        con un ordine diverso l'esito non cambia, ma alcuni nodi vengono ricalcolati.
+        """
+        # distanza dalla radice -> ((sinistro, destro), padre) dell'ultimo nodo calcolato
+        ultimo_nodo: Dict[int, Tuple[Tuple[str, str], str]] = {}
+        for id_foglia, path in coppie_path:
+            h = mappa_id_hash.get(id_foglia)
+            if h is None:
+                continue
+            passi = list(zip(path.get_direzione(), path.get_hash_fratelli()))
+            for posizione, (direzione, fratello) in enumerate(passi):
+                if direzione == "1":  # sinistra
+                    coppia = (fratello, h)
+                elif direzione == "0":  # destra
+                    coppia = (h, fratello)
+                else:
+                    continue
+                distanza = len(passi) - posizione
+                memorizzato = ultimo_nodo.get(distanza)
+                if memorizzato is not None and memorizzato[0] == coppia:
+                    h = memorizzato[1]
+                else:
+                    h = Hashing.hash_concat(*coppia)
+                    ultimo_nodo[distanza] = (coppia, h)
+            yield id_foglia, h == root_attesa
+
+    @staticmethod
+    def individua_sottoalberi_anomali(esiti: Mapping[int, bool], lista_id: List[int]) -> List[dict]:
+        """
+        Raggruppa le foglie alterate nei sottoalberi più grandi composti solo da foglie alterate.
+        lista_id contiene gli ID di tutte le foglie nell'ordine dell'albero (crescente).
+        Restituisce per ogni sottoalbero: livello, indice del nodo nel livello, primo e ultimo ID.
+        Un'alterazione di una singola tupla produce un sottoalbero di livello 0;
+        un intervallo contiguo di tuple alterate viene riportato come pochi sottoalberi.
+        """
+        anomale = [not esiti.get(id_foglia, True) for id_foglia in lista_id]
+        sottoalberi = []
+        indice = 0
+        numero_foglie = len(lista_id)
+        while indice < numero_foglie:
+            if not anomale[indice]:
+                indice += 1
+                continue
+            # sale di livello finché il blocco allineato resta interamente alterato
+            livello = 0
+            while True:
+                ampiezza = 1 << (livello + 1)
+                if indice % ampiezza or indice + ampiezza > numero_foglie:
+                    break
+                if not all(anomale[indice:indice + ampiezza]):
+                    break
+                livello += 1
+            fine = indice + (1 << livello)
+            sottoalberi.append({
+                "livello": livello,
+                "indice": indice >> livello,
+                "primo_id": lista_id[indice],
+                "ultimo_id": lista_id[fine - 1],
+            })
+            indice = fine
+        return sottoalberi
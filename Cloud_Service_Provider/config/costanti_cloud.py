@@ -22,6 +22,42 @@ DB_NAME = os.getenv("DB_NAME", "dati_cloud")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "admin")
 
+# === Richieste compresse (Content-Encoding: gzip) ===
+# dimensione massima in byte del corpo di una richiesta dopo la decompressione
+MAX_DIMENSIONE_CORPO_DECOMPRESSO = int(os.getenv("MAX_DIMENSIONE_CORPO_DECOMPRESSO", 64 * 1024 * 1024))
+
+# === Richiesta delle mappe ID → hash di più batch (/batch/mappa-id-hash/multipla) ===
+# numero massimo di batch per richiesta
+MAX_BATCH_PER_RICHIESTA = int(os.getenv("MAX_BATCH_PER_RICHIESTA", 2000))
+# righe lette per volta dal cursore lato server
+DIMENSIONE_BLOCCO_CURSORE = 10000
+
+# === Inserimento dei batch ricevuti ===
+# righe per statement INSERT multi-riga (un batch da 1024 foglie richiede un solo statement)
+MAX_RIGHE_PER_INSERT = 2000
+
+# === Verifica: mappa ID → hash delle foglie ===
+# audit: hash ricalcolati dalle righe salvate (autorevole, default)
+# rapida: hash salvati alla ricezione del batch, senza ricalcolo
+MODALITA_AUDIT = "audit"
+MODALITA_RAPIDA = "rapida"
+# ricalcolo periodico degli hash di tutti i batch e confronto con quelli salvati alla ricezione
+RICALCOLO_HASH_ATTIVO = os.getenv("RICALCOLO_HASH_ATTIVO", "1") == "1"
+INTERVALLO_RICALCOLO_HASH = int(os.getenv("INTERVALLO_RICALCOLO_HASH", 3600))
+# batch letti per volta durante il ricalcolo
+DIMENSIONE_BLOCCO_RICALCOLO = 100
+
+# === Pool di connessioni al database ===
+# driver usato dagli endpoint: "psycopg2" (query nel pool di thread) o "asyncpg" (driver asincrono)
+DB_BACKEND = os.getenv("DB_BACKEND", "psycopg2")
+# connessioni aperte all'avvio e numero massimo di connessioni (query concorrenti)
+DIMENSIONE_MIN_POOL_DB = int(os.getenv("DIMENSIONE_MIN_POOL_DB", 1))
+DIMENSIONE_MAX_POOL_DB = int(os.getenv("DIMENSIONE_MAX_POOL_DB", 10))
+# secondi di attesa di una connessione libera prima di rinunciare alla richiesta
+TIMEOUT_ATTESA_CONNESSIONE = float(os.getenv("TIMEOUT_ATTESA_CONNESSIONE", 10))
+# una connessione inattiva da più di questi secondi viene verificata (SELECT 1) prima dell'uso
+INTERVALLO_VERIFICA_CONNESSIONE = 30
+
 # === API Keys immutabili ===
 api_keys_raw = os.getenv("API_KEYS")
 if not api_keys_raw:
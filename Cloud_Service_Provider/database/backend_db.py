@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, TYPE_CHECKING, Union
+
+from Classi_comuni.entita.modelli_dati import DatiSensore, DatiMisurazione, DatiBatch, DatiPayload
+from Cloud_Service_Provider.config.costanti_cloud import DB_BACKEND, DIMENSIONE_MIN_POOL_DB, DIMENSIONE_MAX_POOL_DB
+from Cloud_Service_Provider.database.gestore_db import GestoreDatabase
+
+if TYPE_CHECKING:
+    # importato solo per le annotazioni: asyncpg serve solo con il backend asyncpg
+    from Cloud_Service_Provider.database.gestore_db_async import GestoreDatabaseAsync
+
+logger = logging.getLogger(__name__)
+
+BACKEND_PSYCOPG2 = "psycopg2"
+BACKEND_ASYNCPG = "asyncpg"
+
+
+"""
+Interfaccia asincrona di GestoreDatabase (psycopg2, bloccante) per gli endpoint async.
+Ogni metodo viene eseguito in un pool di thread dedicato, grande quanto il pool di connessioni:
+l'event loop non si blocca durante le query e le richieste in attesa di una connessione
+restano in coda senza occupare thread. Il backend asyncpg (GestoreDatabaseAsync) espone
+gli stessi metodi senza thread.
+"""
+class GestoreDatabaseInThread:
+    def __init__(self, gestore_db: GestoreDatabase):
+        self.gestore_db = gestore_db
+        self._esecutore = ThreadPoolExecutor(max_workers=gestore_db.pool.maxconn,
+                                             thread_name_prefix="gestore_db")
+
+    async def _esegui(self, metodo: Callable, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._esecutore, metodo, *args)
+
+    async def inserisci_sensore(self, sensore: DatiSensore) -> bool:
+        return await self._esegui(self.gestore_db.inserisci_sensore, sensore)
+
+    async def inserisci_batch(self, batch: DatiBatch) -> bool:
+        return await self._esegui(self.gestore_db.inserisci_batch, batch)
+
+    async def inserisci_misurazione(self, misurazione: DatiMisurazione, id_batch: int) -> bool:
+        return await self._esegui(self.gestore_db.inserisci_misurazione, misurazione, id_batch)
+
+    async def inserisci_payload(self, payload: DatiPayload, hash_foglie: dict[int, str] | None = None) -> bool:
+        return await self._esegui(self.gestore_db.inserisci_payload, payload, hash_foglie)
+
+    async def estrai_dati_batch_misurazioni(self, id_batch: int) -> list[dict]:
+        return await self._esegui(self.gestore_db.estrai_dati_batch_misurazioni, id_batch)
+
+    async def itera_dati_batch_misurazioni(self, lista_id: list[int]) -> AsyncIterator[tuple[int, list[dict]]]:
+        async for elemento in self._itera_in_thread(self.gestore_db.itera_dati_batch_misurazioni(lista_id)):
+            yield elemento
+
+    async def estrai_hash_foglie_batch(self, id_batch: int) -> list[dict]:
+        return await self._esegui(self.gestore_db.estrai_hash_foglie_batch, id_batch)
+
+    async def itera_hash_foglie_batch(self, lista_id: list[int]) -> AsyncIterator[tuple[int, list[dict]]]:
+        async for elemento in self._itera_in_thread(self.gestore_db.itera_hash_foglie_batch(lista_id)):
+            yield elemento
+
+    async def estrai_id_batch(self, dopo_id: int, limite: int) -> list[int]:
+        return await self._esegui(self.gestore_db.estrai_id_batch, dopo_id, limite)
+
+    async def _itera_in_thread(self, iteratore: Iterator) -> AsyncIterator:
+        """Scorre un generatore di GestoreDatabase un elemento alla volta nel pool di thread."""
+        fine = object()
+        try:
+            while (elemento := await self._esegui(next, iteratore, fine)) is not fine:
+                yield elemento
+        finally:
+            # restituisce la connessione al pool anche se l'iterazione viene interrotta
+            await self._esegui(iteratore.close)
+
+    async def estrai_metadata_misurazione(self, id_misurazione: int) -> dict:
+        return await self._esegui(self.gestore_db.estrai_metadata_misurazione, id_misurazione)
+
+    async def estrai_metadata_batch(self, id_batch: int) -> dict:
+        return await self._esegui(self.gestore_db.estrai_metadata_batch, id_batch)
+
+    async def chiudi_connessione(self):
+        await self._esegui(self.gestore_db.chiudi_connessione)
+        self._esecutore.shutdown(wait=False)
+
+
+# i due backend espongono gli stessi metodi come coroutine
+GestoreDbAsincrono = Union["GestoreDatabaseAsync", GestoreDatabaseInThread]
+
+
+async def crea_gestore_db_async(db_config: dict, backend: str = DB_BACKEND,
+                                dimensione_min_pool: int = DIMENSIONE_MIN_POOL_DB,
+                                dimensione_max_pool: int = DIMENSIONE_MAX_POOL_DB) -> GestoreDbAsincrono:
+    """
+    Crea il gestore del database per gli endpoint async secondo il backend configurato (DB_BACKEND):
+    - "psycopg2": GestoreDatabase con pool di connessioni, eseguito in un pool di thread;
+    - "asyncpg":  GestoreDatabaseAsync, driver asincrono (richiede il pacchetto asyncpg).
+    Va invocata dall'interno dell'event loop (ad esempio nel lifespan dell'applicazione).
+    """
+    logger.info(f"Backend del database: {backend}")
+    if backend == BACKEND_ASYNCPG:
+        # importato solo se selezionato: asyncpg non è necessario con il backend psycopg2
+        from Cloud_Service_Provider.database.gestore_db_async import GestoreDatabaseAsync
+        return await GestoreDatabaseAsync.crea(db_config, dimensione_min_pool, dimensione_max_pool)
+    if backend == BACKEND_PSYCOPG2:
+        gestore_db = await asyncio.get_running_loop().run_in_executor(
+            None, GestoreDatabase, db_config, dimensione_min_pool, dimensione_max_pool)
+        return GestoreDatabaseInThread(gestore_db)
+    raise ValueError(f"DB_BACKEND non valido: {backend!r} (valori ammessi: {BACKEND_PSYCOPG2}, {BACKEND_ASYNCPG})")
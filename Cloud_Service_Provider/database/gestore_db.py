@@ -1,11 +1,22 @@
 import json
 import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterator
 
-import psycopg2
-from psycopg2 import Error as Psycopg2Error
-from psycopg2.extras import RealDictCursor
+from psycopg2 import Error as Psycopg2Error, OperationalError, InterfaceError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 
-from Classi_comuni.entita.modelli_dati import DatiSensore, DatiMisurazione, DatiBatch
+from Classi_comuni.config.costanti_comuni import ID_BATCH_LOGICO
+from Classi_comuni.entita.modelli_dati import DatiSensore, DatiMisurazione, DatiBatch, DatiPayload
+from Cloud_Service_Provider.config.costanti_cloud import DIMENSIONE_BLOCCO_CURSORE, MAX_RIGHE_PER_INSERT, \
+    DIMENSIONE_MIN_POOL_DB, DIMENSIONE_MAX_POOL_DB, TIMEOUT_ATTESA_CONNESSIONE, INTERVALLO_VERIFICA_CONNESSIONE
 from Cloud_Service_Provider.database.query import (
     CREA_TABELLA_SENSORE,
     CREA_TABELLA_BATCH,
@@ -13,32 +24,106 @@ from Cloud_Service_Provider.database.query import (
     INSERISCI_SENSORE,
     INSERISCI_MISURAZIONE,
     INSERISCI_BATCH,
-    ESTRAI_DATI_BATCH_MISURAZIONI, ESTRAI_METADATA_MISURAZIONE, ESTRAI_METADATA_BATCH
+    INSERISCI_MISURAZIONI_BULK,
+    ESTRAI_DATI_BATCH_MISURAZIONI, ESTRAI_METADATA_MISURAZIONE, ESTRAI_METADATA_BATCH,
+    ESTRAI_DATI_BATCH_MISURAZIONI_MULTIPLI,
+    AGGIUNGI_COLONNA_HASH_BATCH,
+    AGGIUNGI_COLONNA_HASH_MISURAZIONE,
+    INSERISCI_BATCH_CON_HASH,
+    ESTRAI_HASH_FOGLIE_BATCH, ESTRAI_HASH_FOGLIE_BATCH_MULTIPLI, ESTRAI_ID_BATCH_SUCCESSIVI
 )
 
 logger = logging.getLogger(__name__)
 
+"""
+Accesso al database PostgreSQL del cloud provider tramite un pool di connessioni.
+Gli endpoint sincroni di FastAPI vengono eseguiti in parallelo nel thread pool del server:
+ogni operazione preleva una connessione dal pool (ThreadedConnectionPool), la usa in modo
+esclusivo con i propri cursori e la restituisce al termine. Le query di richieste diverse
+procedono quindi in parallelo fino a `dimensione_max_pool` connessioni; oltre il limite
+le richieste attendono una connessione libera per al più TIMEOUT_ATTESA_CONNESSIONE secondi.
+Una connessione inattiva da più di INTERVALLO_VERIFICA_CONNESSIONE secondi viene verificata
+(SELECT 1) prima dell'uso; le connessioni chiuse o interrotte da un errore di rete vengono
+scartate e sostituite con connessioni nuove.
+"""
 class GestoreDatabase:
-    def __init__(self, db_config: dict):
+    def __init__(self, db_config: dict, dimensione_min_pool: int = DIMENSIONE_MIN_POOL_DB,
+                 dimensione_max_pool: int = DIMENSIONE_MAX_POOL_DB):
         try:
-            self.conn = psycopg2.connect(**db_config)
-            self.conn.autocommit = True
-            self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            logger.info("Connessione a PostgreSQL stabilita.")
+            self.pool = ThreadedConnectionPool(dimensione_min_pool, dimensione_max_pool, **db_config)
+            # ThreadedConnectionPool solleva PoolError se il pool è esaurito: il semaforo fa attendere
+            self._posti_pool = threading.BoundedSemaphore(dimensione_max_pool)
+            # id(connessione) -> istante dell'ultimo utilizzo
+            self._ultimo_uso: dict[int, float] = {}
+            logger.info(f"Pool di connessioni a PostgreSQL creato ({dimensione_min_pool}-{dimensione_max_pool}).")
             self._crea_tabelle()
         except Psycopg2Error as e:
             logger.error(f"Errore di connessione al database: {e}")
             raise
 
+    def _preleva_connessione_valida(self):
+        """Preleva dal pool una connessione funzionante, scartando quelle chiuse o non raggiungibili."""
+        for _ in range(self.pool.maxconn + 1):
+            conn = self.pool.getconn()
+            if conn.closed:
+                self.pool.putconn(conn, close=True)
+                continue
+            if time.monotonic() - self._ultimo_uso.get(id(conn), 0.0) > INTERVALLO_VERIFICA_CONNESSIONE:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except (OperationalError, InterfaceError) as e:
+                    logger.warning(f"Connessione al database non valida, sostituita: {e}")
+                    self.pool.putconn(conn, close=True)
+                    continue
+            if not conn.autocommit:
+                conn.autocommit = True
+            return conn
+        raise OperationalError("Nessuna connessione valida al database")
+
+    @contextmanager
+    def _connessione(self):
+        """
+        Preleva una connessione dal pool per la durata di un'operazione e la restituisce al termine.
+        Una transazione lasciata aperta viene annullata; una connessione interrotta viene scartata.
+        """
+        if not self._posti_pool.acquire(timeout=TIMEOUT_ATTESA_CONNESSIONE):
+            raise PoolError("Nessuna connessione libera nel pool entro il tempo di attesa")
+        conn = None
+        da_scartare = False
+        try:
+            conn = self._preleva_connessione_valida()
+            yield conn
+        except (OperationalError, InterfaceError):
+            da_scartare = True
+            raise
+        finally:
+            if conn is not None:
+                if not conn.closed and not da_scartare:
+                    try:
+                        if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                            conn.rollback()
+                        conn.autocommit = True
+                    except Psycopg2Error:
+                        da_scartare = True
+                self._ultimo_uso[id(conn)] = time.monotonic()
+                self.pool.putconn(conn, close=da_scartare or bool(conn.closed))
+            self._posti_pool.release()
+
     def _crea_tabelle(self):
         """
         Metodo privato per creare le tabelle necessarie al sistema.
         Viene invocato automaticamente al momento della connessione.
         """
         try:
-            self.cursor.execute(CREA_TABELLA_SENSORE)
-            self.cursor.execute(CREA_TABELLA_BATCH)
-            self.cursor.execute(CREA_TABELLA_MISURAZIONE)
+            with self._connessione() as conn, conn.cursor() as cursor:
+                cursor.execute(CREA_TABELLA_SENSORE)
+                cursor.execute(CREA_TABELLA_BATCH)
+                cursor.execute(CREA_TABELLA_MISURAZIONE)
+                cursor.execute(AGGIUNGI_COLONNA_HASH_BATCH)
+                cursor.execute(AGGIUNGI_COLONNA_HASH_MISURAZIONE)
             logger.info("Tabelle create (se non esistenti).")
         except Psycopg2Error as e:
             logger.error(f"Errore nella creazione delle tabelle: {e}")
@@ -50,10 +135,11 @@ class GestoreDatabase:
         Inserisce un nuovo sensore nel database.
         """
         try:
-            self.cursor.execute(
-                INSERISCI_SENSORE,
-                (sensore.id_sensore, sensore.descrizione, sensore.tipo)
-            )
+            with self._connessione() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    INSERISCI_SENSORE,
+                    (sensore.id_sensore, sensore.descrizione, sensore.tipo)
+                )
             logger.info(f"Sensore inserito: {sensore.id_sensore}")
             return True
         except Psycopg2Error as e:
@@ -65,10 +151,11 @@ class GestoreDatabase:
         Inserisce un nuovo batch nel database.
         """
         try:
-            self.cursor.execute(
-                INSERISCI_BATCH,
-                (batch.id_batch, batch.timestamp_creazione, batch.numero_misurazioni)
-            )
+            with self._connessione() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    INSERISCI_BATCH,
+                    (batch.id_batch, batch.timestamp_creazione, batch.numero_misurazioni)
+                )
             logger.info(f"Batch inserito: {batch.id_batch}")
             return True
         except Psycopg2Error as e:
@@ -80,34 +167,68 @@ class GestoreDatabase:
         Inserisce una singola misurazione nel database.
         """
         try:
-            self.cursor.execute(
-                INSERISCI_MISURAZIONE,
-                (
-                    misurazione.id_misurazione,
-                    id_batch,
-                    misurazione.id_sensore,
-                    misurazione.timestamp,
-                    #misurazione.dati è un Dict (ad esempio: {"x": 10, "y": 5, "pressed": True})
-                    # json.dumps(...) lo trasforma in una stringa JSON: '{"x": 10, "y": 5, "pressed": true}'
-                    #questa stringa può essere salvata in PostgreSQL in una colonna JSON o TEXT
-                    json.dumps(misurazione.dati)
+            with self._connessione() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    INSERISCI_MISURAZIONE,
+                    (
+                        misurazione.id_misurazione,
+                        id_batch,
+                        misurazione.id_sensore,
+                        misurazione.timestamp,
+                        #misurazione.dati è un Dict (ad esempio: {"x": 10, "y": 5, "pressed": True})
+                        # json.dumps(...) lo trasforma in una stringa JSON: '{"x": 10, "y": 5, "pressed": true}'
+                        #questa stringa può essere salvata in PostgreSQL in una colonna JSON o TEXT
+                        json.dumps(misurazione.dati)
+                    )
                 )
-            )
             logger.info(f"Misurazione inserita: {misurazione.id_misurazione}")
             return True
         except Psycopg2Error as e:
             logger.error(f"Errore inserimento misurazione {misurazione.id_misurazione}: {e}")
             return False
 
+    def inserisci_payload(self, payload: DatiPayload, hash_foglie: dict[int, str] | None = None) -> bool:
+        """
+        Inserisce un batch e tutte le sue misurazioni in un'unica transazione:
+        o viene salvato l'intero batch o, in caso di errore, nessuna riga (ROLLBACK).
+        Le misurazioni sono inserite con INSERT multi-riga (execute_values), un solo round trip
+        ogni MAX_RIGHE_PER_INSERT righe invece di uno per misurazione.
+        hash_foglie (ID logico → hash, 0 = batch) viene salvato nelle colonne hash_foglia
+        per la verifica rapida; le foglie assenti restano NULL.
+        """
+        batch = payload.batch
+        hash_foglie = hash_foglie or {}
+        righe = [
+            (m.id_misurazione, batch.id_batch, m.id_sensore, m.timestamp, json.dumps(m.dati),
+             hash_foglie.get(m.id_misurazione))
+            for m in payload.misurazioni
+        ]
+        try:
+            # "with conn" apre una transazione anche con autocommit attivo (psycopg2 >= 2.9):
+            # COMMIT all'uscita, ROLLBACK se viene sollevata un'eccezione
+            with self._connessione() as conn:
+                with conn, conn.cursor() as cursor:
+                    cursor.execute(
+                        INSERISCI_BATCH_CON_HASH,
+                        (batch.id_batch, batch.timestamp_creazione, batch.numero_misurazioni,
+                         hash_foglie.get(ID_BATCH_LOGICO))
+                    )
+                    execute_values(cursor, INSERISCI_MISURAZIONI_BULK, righe, page_size=MAX_RIGHE_PER_INSERT)
+            logger.info(f"Batch inserito: {batch.id_batch} ({len(righe)} misurazioni)")
+            return True
+        except Psycopg2Error as e:
+            logger.error(f"Errore inserimento batch {batch.id_batch}, nessuna riga salvata: {e}")
+            return False
+
     def estrai_dati_batch_misurazioni(self, id_batch: int) -> list[dict]:
         """
         Estrae tutte le misurazioni associate a un batch ordinandole per ID.
         Utile per la verifica dell'integrità e la costruzione del Merkle Tree.
         """
         try:
-            cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(ESTRAI_DATI_BATCH_MISURAZIONI, (id_batch,))
-            righe = cursor.fetchall()
+            with self._connessione() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(ESTRAI_DATI_BATCH_MISURAZIONI, (id_batch,))
+                righe = cursor.fetchall()
             #.fetchall() restituisce una lista di Row, che sembrano dizionari, ma non lo sono al 100%.
             # Se ti serve una lista di dizionari veri,
             # fai righe = [dict(r) for r in cursor.fetchall()].
@@ -116,6 +237,69 @@ class GestoreDatabase:
             logger.error(f"QUERY - ESTRAZIONE DATI BATCH] {e}")
             return []
 
+    def itera_dati_batch_misurazioni(self, lista_id: list[int]) -> Iterator[tuple[int, list[dict]]]:
+        """
+        Estrae con un'unica query le misurazioni di più batch e restituisce, batch per batch
+        in ordine di ID, la coppia (id_batch, righe) con le righe nello stesso formato
+        di estrai_dati_batch_misurazioni. I batch senza misurazioni non compaiono.
+        Le righe sono lette da un cursore lato server a blocchi di DIMENSIONE_BLOCCO_CURSORE:
+        la memoria usata non dipende dal numero di batch richiesti.
+        La connessione resta prelevata dal pool finché l'iterazione non termina o non viene chiusa.
+        In caso di errore lo registra e lo rilancia (la risposta è già in corso di invio).
+        """
+        try:
+            yield from self._itera_righe_per_batch(ESTRAI_DATI_BATCH_MISURAZIONI_MULTIPLI, lista_id)
+        except Psycopg2Error as e:
+            logger.error(f"[QUERY - ESTRAZIONE DATI BATCH MULTIPLI] {e}")
+            raise
+
+    def _itera_righe_per_batch(self, query: str, lista_id: list[int]) -> Iterator[tuple[int, list[dict]]]:
+        """Esegue una query ordinata per id_batch con un cursore lato server e raggruppa le righe per batch."""
+        with self._connessione() as conn:
+            # il cursore lato server vive nella transazione, annullata alla restituzione della connessione
+            conn.autocommit = False
+            with conn.cursor(name=f"batch_multipli_{uuid.uuid4().hex}",
+                             cursor_factory=RealDictCursor) as cursor:
+                cursor.itersize = DIMENSIONE_BLOCCO_CURSORE
+                cursor.execute(query, (list(lista_id),))
+                for id_batch, righe in groupby(cursor, key=itemgetter("id_batch")):
+                    yield id_batch, [dict(riga) for riga in righe]
+
+    def estrai_hash_foglie_batch(self, id_batch: int) -> list[dict]:
+        """
+        Estrae gli hash di foglia salvati alla ricezione del batch, una riga per misurazione
+        ordinata per ID (id_batch, hash_batch, id_misurazione, hash_foglia).
+        Gli hash non sono ricalcolati: non rilevano modifiche alle righe successive alla ricezione.
+        """
+        try:
+            with self._connessione() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(ESTRAI_HASH_FOGLIE_BATCH, (id_batch,))
+                return [dict(riga) for riga in cursor.fetchall()]
+        except Psycopg2Error as e:
+            logger.error(f"[QUERY - ESTRAZIONE HASH FOGLIE BATCH] {e}")
+            return []
+
+    def itera_hash_foglie_batch(self, lista_id: list[int]) -> Iterator[tuple[int, list[dict]]]:
+        """
+        Come itera_dati_batch_misurazioni, con le righe di estrai_hash_foglie_batch.
+        In caso di errore lo registra e lo rilancia.
+        """
+        try:
+            yield from self._itera_righe_per_batch(ESTRAI_HASH_FOGLIE_BATCH_MULTIPLI, lista_id)
+        except Psycopg2Error as e:
+            logger.error(f"[QUERY - ESTRAZIONE HASH FOGLIE BATCH MULTIPLI] {e}")
+            raise
+
+    def estrai_id_batch(self, dopo_id: int, limite: int) -> list[int]:
+        """Restituisce al più `limite` ID batch maggiori di `dopo_id`, in ordine crescente."""
+        try:
+            with self._connessione() as conn, conn.cursor() as cursor:
+                cursor.execute(ESTRAI_ID_BATCH_SUCCESSIVI, (dopo_id, limite))
+                return [riga[0] for riga in cursor.fetchall()]
+        except Psycopg2Error as e:
+            logger.error(f"[QUERY - ESTRAZIONE ID BATCH] {e}")
+            return []
+
     def estrai_metadata_misurazione(self, id_misurazione: int) -> dict:
         """
         Estrae i metadati associati a una singola misurazione, potenzialmente manomessi.
@@ -123,9 +307,9 @@ class GestoreDatabase:
         """
 
         try:
-            cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(ESTRAI_METADATA_MISURAZIONE, (id_misurazione,))
-            riga = cursor.fetchone()
+            with self._connessione() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(ESTRAI_METADATA_MISURAZIONE, (id_misurazione,))
+                riga = cursor.fetchone()
             if not riga:
                 raise ValueError(f"Nessuna misurazione trovata con ID {id_misurazione}")
             return dict(riga)
@@ -139,9 +323,9 @@ class GestoreDatabase:
         Estrae i metadata associati alla tupla del batch, potenzialmente manomesso.
         """
         try:
-            cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(ESTRAI_METADATA_BATCH, (id_batch,))
-            riga = cursor.fetchone()
+            with self._connessione() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(ESTRAI_METADATA_BATCH, (id_batch,))
+                riga = cursor.fetchone()
             if not riga:
                 raise ValueError(f"Nessuna tupla batch trovata con ID {id_batch}")
             return dict(riga)
@@ -153,21 +337,14 @@ class GestoreDatabase:
 
     def chiudi_connessione(self):
         """
-        Chiude la connessione al database PostgreSQL in modo sicuro.
+        Chiude tutte le connessioni del pool al database PostgreSQL in modo sicuro.
         Da chiamare durante la fase di shutdown dell'applicazione.
         """
         try:
             # Verifica che l'attributo esista prima di tentare la chiusura,
-            # per evitare errori se la connessione non è mai stata creata correttamente
-            if hasattr(self, "cursor") and self.cursor:
-                self.cursor.close()
-            if hasattr(self, "conn") and self.conn:
-                self.conn.close()
-            logger.info("Connessione al database chiusa correttamente.")
+            # per evitare errori se il pool non è mai stato creato correttamente
+            if hasattr(self, "pool") and self.pool and not self.pool.closed:
+                self.pool.closeall()
+            logger.info("Connessioni al database chiuse correttamente.")
         except Psycopg2Error as e:
             logger.error(f"Errore durante la chiusura della connessione: {e}")
-
-
-
-
-
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator
+
+import asyncpg
+
+from Classi_comuni.config.costanti_comuni import ID_BATCH_LOGICO
+from Classi_comuni.entita.modelli_dati import DatiSensore, DatiMisurazione, DatiBatch, DatiPayload
+from Cloud_Service_Provider.config.costanti_cloud import DIMENSIONE_BLOCCO_CURSORE, DIMENSIONE_MIN_POOL_DB, \
+    DIMENSIONE_MAX_POOL_DB, TIMEOUT_ATTESA_CONNESSIONE, INTERVALLO_VERIFICA_CONNESSIONE
+from Cloud_Service_Provider.database.query import CREA_TABELLA_SENSORE, CREA_TABELLA_BATCH, \
+    CREA_TABELLA_MISURAZIONE, AGGIUNGI_COLONNA_HASH_BATCH, AGGIUNGI_COLONNA_HASH_MISURAZIONE
+from Cloud_Service_Provider.database.query_asyncpg import (
+    INSERISCI_SENSORE,
+    INSERISCI_MISURAZIONE,
+    INSERISCI_BATCH,
+    INSERISCI_BATCH_CON_HASH,
+    INSERISCI_MISURAZIONI_BULK,
+    ESTRAI_DATI_BATCH_MISURAZIONI, ESTRAI_METADATA_MISURAZIONE, ESTRAI_METADATA_BATCH,
+    ESTRAI_DATI_BATCH_MISURAZIONI_MULTIPLI,
+    ESTRAI_HASH_FOGLIE_BATCH, ESTRAI_HASH_FOGLIE_BATCH_MULTIPLI, ESTRAI_ID_BATCH_SUCCESSIVI
+)
+
+logger = logging.getLogger(__name__)
+
+# errori del database, di rete o di attesa di una connessione libera: gestiti come in GestoreDatabase
+ERRORI_DB = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError)
+
+
+async def _inizializza_connessione(conn: asyncpg.Connection) -> None:
+    # JSONB letto come dict (come psycopg2): le righe estratte hanno lo stesso formato
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+"""
+Accesso asincrono al database PostgreSQL del cloud provider con asyncpg.
+Espone gli stessi metodi di GestoreDatabase, come coroutine: una query in attesa del database
+non occupa un thread, per cui un solo processo serve molte richieste concorrenti con
+al più `dimensione_max_pool` connessioni. Le righe restituite hanno lo stesso formato
+di GestoreDatabase (dizionari, colonna dati come dict) e gli errori sono gestiti allo stesso modo:
+registrati e segnalati con False, lista o dizionario vuoto.
+Il pool va creato nell'event loop che lo userà: GestoreDatabaseAsync.crea(...).
+"""
+class GestoreDatabaseAsync:
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+
+    @classmethod
+    async def crea(cls, db_config: dict, dimensione_min_pool: int = DIMENSIONE_MIN_POOL_DB,
+                   dimensione_max_pool: int = DIMENSIONE_MAX_POOL_DB) -> "GestoreDatabaseAsync":
+        try:
+            pool = await asyncpg.create_pool(
+                **db_config,
+                min_size=dimensione_min_pool,
+                max_size=dimensione_max_pool,
+                init=_inizializza_connessione,
+                # le connessioni inattive vengono chiuse e riaperte al primo uso successivo
+                max_inactive_connection_lifetime=INTERVALLO_VERIFICA_CONNESSIONE,
+            )
+            logger.info(f"Pool asincrono di connessioni a PostgreSQL creato "
+                        f"({dimensione_min_pool}-{dimensione_max_pool}).")
+        except ERRORI_DB as e:
+            logger.error(f"Errore di connessione al database: {e}")
+            raise
+        gestore = cls(pool)
+        await gestore._crea_tabelle()
+        return gestore
+
+    def _connessione(self):
+        """Preleva una connessione dal pool, attendendo al più TIMEOUT_ATTESA_CONNESSIONE secondi."""
+        return self.pool.acquire(timeout=TIMEOUT_ATTESA_CONNESSIONE)
+
+    async def _crea_tabelle(self):
+        try:
+            async with self._connessione() as conn:
+                await conn.execute(CREA_TABELLA_SENSORE)
+                await conn.execute(CREA_TABELLA_BATCH)
+                await conn.execute(CREA_TABELLA_MISURAZIONE)
+                await conn.execute(AGGIUNGI_COLONNA_HASH_BATCH)
+                await conn.execute(AGGIUNGI_COLONNA_HASH_MISURAZIONE)
+            logger.info("Tabelle create (se non esistenti).")
+        except ERRORI_DB as e:
+            logger.error(f"Errore creazione tabelle: {e}")
+
+    async def inserisci_sensore(self, sensore: DatiSensore) -> bool:
+        try:
+            async with self._connessione() as conn:
+                await conn.execute(INSERISCI_SENSORE, sensore.id_sensore, sensore.descrizione, sensore.tipo)
+            logger.info(f"Sensore inserito: {sensore.id_sensore}")
+            return True
+        except ERRORI_DB as e:
+            logger.error(f"Errore inserimento sensore {sensore.id_sensore}: {e}")
+            return False
+
+    async def inserisci_batch(self, batch: DatiBatch) -> bool:
+        try:
+            async with self._connessione() as conn:
+                await conn.execute(INSERISCI_BATCH, batch.id_batch, batch.timestamp_creazione,
+                                   batch.numero_misurazioni)
+            logger.info(f"Batch inserito: {batch.id_batch}")
+            return True
+        except ERRORI_DB as e:
+            logger.error(f"Errore inserimento batch {batch.id_batch}: {e}")
+            return False
+
+    async def inserisci_misurazione(self, misurazione: DatiMisurazione, id_batch: int) -> bool:
+        try:
+            async with self._connessione() as conn:
+                await conn.execute(INSERISCI_MISURAZIONE, misurazione.id_misurazione, id_batch,
+                                   misurazione.id_sensore, misurazione.timestamp, misurazione.dati)
+            logger.info(f"Misurazione inserita: {misurazione.id_misurazione}")
+            return True
+        except ERRORI_DB as e:
+            logger.error(f"Errore inserimento misurazione {misurazione.id_misurazione}: {e}")
+            return False
+
+    async def inserisci_payload(self, payload: DatiPayload, hash_foglie: dict[int, str] | None = None) -> bool:
+        """
+        Inserisce un batch e tutte le sue misurazioni in un'unica transazione
+        (stessa semantica di GestoreDatabase.inserisci_payload, hash di foglia compresi):
+        le misurazioni sono inviate come array di colonne in un solo statement.
+        """
+        batch = payload.batch
+        misurazioni = payload.misurazioni
+        hash_foglie = hash_foglie or {}
+        try:
+            async with self._connessione() as conn, conn.transaction():
+                await conn.execute(INSERISCI_BATCH_CON_HASH, batch.id_batch, batch.timestamp_creazione,
+                                   batch.numero_misurazioni, hash_foglie.get(ID_BATCH_LOGICO))
+                await conn.execute(
+                    INSERISCI_MISURAZIONI_BULK,
+                    batch.id_batch,
+                    [m.id_misurazione for m in misurazioni],
+                    [m.id_sensore for m in misurazioni],
+                    [m.timestamp for m in misurazioni],
+                    [json.dumps(m.dati) for m in misurazioni],
+                    [hash_foglie.get(m.id_misurazione) for m in misurazioni],
+                )
+            logger.info(f"Batch inserito: {batch.id_batch} ({len(misurazioni)} misurazioni)")
+            return True
+        except ERRORI_DB as e:
+            logger.error(f"Errore inserimento batch {batch.id_batch}, nessuna riga salvata: {e}")
+            return False
+
+    async def estrai_dati_batch_misurazioni(self, id_batch: int) -> list[dict]:
+        try:
+            async with self._connessione() as conn:
+                righe = await conn.fetch(ESTRAI_DATI_BATCH_MISURAZIONI, id_batch)
+            return [dict(riga) for riga in righe]
+        except ERRORI_DB as e:
+            logger.error(f"QUERY - ESTRAZIONE DATI BATCH] {e}")
+            return []
+
+    async def itera_dati_batch_misurazioni(self, lista_id: list[int]) -> AsyncIterator[tuple[int, list[dict]]]:
+        """
+        Versione asincrona di GestoreDatabase.itera_dati_batch_misurazioni: le righe sono lette
+        da un cursore lato server a blocchi di DIMENSIONE_BLOCCO_CURSORE e raggruppate per batch.
+        In caso di errore lo registra e lo rilancia (la risposta è già in corso di invio).
+        """
+        try:
+            async for id_batch, righe in self._itera_righe_per_batch(ESTRAI_DATI_BATCH_MISURAZIONI_MULTIPLI, lista_id):
+                yield id_batch, righe
+        except ERRORI_DB as e:
+            logger.error(f"[QUERY - ESTRAZIONE DATI BATCH MULTIPLI] {e}")
+            raise
+
+    async def _itera_righe_per_batch(self, query: str, lista_id: list[int]) -> AsyncIterator[tuple[int, list[dict]]]:
+        """Esegue una query ordinata per id_batch con un cursore lato server e raggruppa le righe per batch."""
+        async with self._connessione() as conn, conn.transaction():
+            id_corrente = None
+            righe: list[dict] = []
+            async for riga in conn.cursor(query, list(lista_id), prefetch=DIMENSIONE_BLOCCO_CURSORE):
+                if riga["id_batch"] != id_corrente:
+                    if righe:
+                        yield id_corrente, righe
+                    id_corrente, righe = riga["id_batch"], []
+                righe.append(dict(riga))
+            if righe:
+                yield id_corrente, righe
+
+    async def estrai_hash_foglie_batch(self, id_batch: int) -> list[dict]:
+        """Versione asincrona di GestoreDatabase.estrai_hash_foglie_batch (hash salvati, non ricalcolati)."""
+        try:
+            async with self._connessione() as conn:
+                righe = await conn.fetch(ESTRAI_HASH_FOGLIE_BATCH, id_batch)
+            return [dict(riga) for riga in righe]
+        except ERRORI_DB as e:
+            logger.error(f"[QUERY - ESTRAZIONE HASH FOGLIE BATCH] {e}")
+            return []
+
+    async def itera_hash_foglie_batch(self, lista_id: list[int]) -> AsyncIterator[tuple[int, list[dict]]]:
+        try:
+            async for id_batch, righe in self._itera_righe_per_batch(ESTRAI_HASH_FOGLIE_BATCH_MULTIPLI, lista_id):
+                yield id_batch, righe
+        except ERRORI_DB as e:
+            logger.error(f"[QUERY - ESTRAZIONE HASH FOGLIE BATCH MULTIPLI] {e}")
+            raise
+
+    async def estrai_id_batch(self, dopo_id: int, limite: int) -> list[int]:
+        try:
+            async with self._connessione() as conn:
+                righe = await conn.fetch(ESTRAI_ID_BATCH_SUCCESSIVI, dopo_id, limite)
+            return [riga["id_batch"] for riga in righe]
+        except ERRORI_DB as e:
+            logger.error(f"[QUERY - ESTRAZIONE ID BATCH] {e}")
+            return []
+
+    async def estrai_metadata_misurazione(self, id_misurazione: int) -> dict:
+        try:
+            async with self._connessione() as conn:
+                riga = await conn.fetchrow(ESTRAI_METADATA_MISURAZIONE, id_misurazione)
+            if not riga:
+                raise ValueError(f"Nessuna misurazione trovata con ID {id_misurazione}")
+            return dict(riga)
+        except ERRORI_DB as e:
+            logger.error(f"[QUERY - ESTRAZIONE METADATI MISURAZIONE] {e}")
+            return {}
+
+    async def estrai_metadata_batch(self, id_batch: int) -> dict:
+        try:
+            async with self._connessione() as conn:
+                riga = await conn.fetchrow(ESTRAI_METADATA_BATCH, id_batch)
+            if not riga:
+                raise ValueError(f"Nessuna tupla batch trovata con ID {id_batch}")
+            return dict(riga)
+        except ERRORI_DB as e:
+            logger.error(f"[QUERY - ESTRAZIONE METADATI BATCH] {e}")
+            return {}
+
+    async def chiudi_connessione(self):
+        """Chiude il pool, attendendo il rilascio delle connessioni in uso."""
+        try:
+            await self.pool.close()
+            logger.info("Connessioni al database chiuse correttamente.")
+        except ERRORI_DB as e:
+            logger.error(f"Errore durante la chiusura della connessione: {e}")
@@ -26,6 +26,16 @@ CREATE TABLE IF NOT EXISTS misurazione (
 );
 """
 
+# Hash di foglia calcolato alla ricezione del batch (misurazioni e batch, ID logico 0).
+# Colonne aggiunte alle tabelle già esistenti; NULL per le righe salvate prima della loro introduzione
+AGGIUNGI_COLONNA_HASH_BATCH = """
+ALTER TABLE batch ADD COLUMN IF NOT EXISTS hash_foglia TEXT;
+"""
+
+AGGIUNGI_COLONNA_HASH_MISURAZIONE = """
+ALTER TABLE misurazione ADD COLUMN IF NOT EXISTS hash_foglia TEXT;
+"""
+
 # Inserisce un nuovo sensore
 INSERISCI_SENSORE = """
 INSERT INTO sensore (id_sensore, descrizione, tipo)
@@ -40,6 +50,13 @@ VALUES (%s, %s, %s)
 ON CONFLICT (id_batch) DO NOTHING;
 """
 
+# Inserisce un nuovo batch con l'hash di foglia calcolato alla ricezione
+INSERISCI_BATCH_CON_HASH = """
+INSERT INTO batch (id_batch, timestamp_creazione, numero_misurazioni, hash_foglia)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (id_batch) DO NOTHING;
+"""
+
 # Inserisce una nuova misurazione
 INSERISCI_MISURAZIONE = """
 INSERT INTO misurazione (id_misurazione, id_batch, id_sensore, timestamp, dati)
@@ -49,6 +66,14 @@ ON CONFLICT (id_misurazione) DO NOTHING;
 
 
 
+# Inserisce più misurazioni con un solo statement (psycopg2.extras.execute_values espande VALUES %s)
+# ON CONFLICT DO NOTHING: un batch reinviato dal fog node non genera errori né duplicati
+INSERISCI_MISURAZIONI_BULK = """
+INSERT INTO misurazione (id_misurazione, id_batch, id_sensore, timestamp, dati, hash_foglia)
+VALUES %s
+ON CONFLICT (id_misurazione) DO NOTHING;
+"""
+
 # Estrae tutte le misurazioni di un batch, includendo anche i metadata del batch stesso
 ESTRAI_DATI_BATCH_MISURAZIONI = """
     SELECT m.id_misurazione,
@@ -64,6 +89,54 @@ ESTRAI_DATI_BATCH_MISURAZIONI = """
     ORDER BY m.id_misurazione ASC;
 """
 
+# Estrae in un'unica query le misurazioni di più batch (lista di ID in un array),
+# raggruppate per batch e ordinate per ID come in ESTRAI_DATI_BATCH_MISURAZIONI
+ESTRAI_DATI_BATCH_MISURAZIONI_MULTIPLI = """
+    SELECT m.id_misurazione,
+    m.id_sensore,
+    m.timestamp,
+    m.dati,
+    b.id_batch,
+    b.timestamp_creazione,
+    b.numero_misurazioni
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = ANY(%s)
+    ORDER BY b.id_batch ASC, m.id_misurazione ASC;
+"""
+
+# Hash di foglia salvati alla ricezione, per la verifica rapida (nessun ricalcolo dalle righe)
+ESTRAI_HASH_FOGLIE_BATCH = """
+    SELECT b.id_batch,
+    b.hash_foglia AS hash_batch,
+    m.id_misurazione,
+    m.hash_foglia
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = %s
+    ORDER BY m.id_misurazione ASC;
+"""
+
+ESTRAI_HASH_FOGLIE_BATCH_MULTIPLI = """
+    SELECT b.id_batch,
+    b.hash_foglia AS hash_batch,
+    m.id_misurazione,
+    m.hash_foglia
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = ANY(%s)
+    ORDER BY b.id_batch ASC, m.id_misurazione ASC;
+"""
+
+# ID dei batch successivi a un dato ID, a blocchi (scansione completa per il ricalcolo periodico)
+ESTRAI_ID_BATCH_SUCCESSIVI = """
+    SELECT id_batch
+    FROM batch
+    WHERE id_batch > %s
+    ORDER BY id_batch ASC
+    LIMIT %s;
+"""
+
 #estrae le informazioni associate a una misurazione
 ESTRAI_METADATA_MISURAZIONE = """
     SELECT id_batch, id_sensore, misurazione.timestamp
@@ -0,0 +1,107 @@
+# Query di query.py nella forma richiesta da asyncpg (parametri posizionali $1, $2, ...).
+# La creazione delle tabelle non ha parametri e usa le stesse istruzioni di query.py.
+
+INSERISCI_SENSORE = """
+INSERT INTO sensore (id_sensore, descrizione, tipo)
+VALUES ($1, $2, $3)
+ON CONFLICT (id_sensore) DO NOTHING;
+"""
+
+INSERISCI_BATCH = """
+INSERT INTO batch (id_batch, timestamp_creazione, numero_misurazioni)
+VALUES ($1, $2, $3)
+ON CONFLICT (id_batch) DO NOTHING;
+"""
+
+INSERISCI_BATCH_CON_HASH = """
+INSERT INTO batch (id_batch, timestamp_creazione, numero_misurazioni, hash_foglia)
+VALUES ($1, $2, $3, $4)
+ON CONFLICT (id_batch) DO NOTHING;
+"""
+
+INSERISCI_MISURAZIONE = """
+INSERT INTO misurazione (id_misurazione, id_batch, id_sensore, timestamp, dati)
+VALUES ($1, $2, $3, $4, $5)
+ON CONFLICT (id_misurazione) DO NOTHING;
+"""
+
+# Inserisce tutte le misurazioni di un batch con un solo statement e un solo round trip:
+# le colonne arrivano come array paralleli ($2..$6) e unnest le ricompone in righe;
+# i dati sono testo JSON convertito da PostgreSQL (senza passare dal codec jsonb della connessione)
+INSERISCI_MISURAZIONI_BULK = """
+INSERT INTO misurazione (id_misurazione, id_batch, id_sensore, timestamp, dati, hash_foglia)
+SELECT r.id_misurazione, $1, r.id_sensore, r.timestamp, r.dati::jsonb, r.hash_foglia
+FROM unnest($2::integer[], $3::text[], $4::text[], $5::text[], $6::text[])
+    AS r(id_misurazione, id_sensore, timestamp, dati, hash_foglia)
+ON CONFLICT (id_misurazione) DO NOTHING;
+"""
+
+ESTRAI_DATI_BATCH_MISURAZIONI = """
+    SELECT m.id_misurazione,
+    m.id_sensore,
+    m.timestamp,
+    m.dati,
+    b.id_batch,
+    b.timestamp_creazione,
+    b.numero_misurazioni
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = $1
+    ORDER BY m.id_misurazione ASC;
+"""
+
+ESTRAI_DATI_BATCH_MISURAZIONI_MULTIPLI = """
+    SELECT m.id_misurazione,
+    m.id_sensore,
+    m.timestamp,
+    m.dati,
+    b.id_batch,
+    b.timestamp_creazione,
+    b.numero_misurazioni
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = ANY($1::integer[])
+    ORDER BY b.id_batch ASC, m.id_misurazione ASC;
+"""
+
+ESTRAI_HASH_FOGLIE_BATCH = """
+    SELECT b.id_batch,
+    b.hash_foglia AS hash_batch,
+    m.id_misurazione,
+    m.hash_foglia
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = $1
+    ORDER BY m.id_misurazione ASC;
+"""
+
+ESTRAI_HASH_FOGLIE_BATCH_MULTIPLI = """
+    SELECT b.id_batch,
+    b.hash_foglia AS hash_batch,
+    m.id_misurazione,
+    m.hash_foglia
+    FROM misurazione AS m
+    INNER JOIN batch AS b ON m.id_batch = b.id_batch
+    WHERE b.id_batch = ANY($1::integer[])
+    ORDER BY b.id_batch ASC, m.id_misurazione ASC;
+"""
+
+ESTRAI_ID_BATCH_SUCCESSIVI = """
+    SELECT id_batch
+    FROM batch
+    WHERE id_batch > $1
+    ORDER BY id_batch ASC
+    LIMIT $2;
+"""
+
+ESTRAI_METADATA_MISURAZIONE = """
+    SELECT id_batch, id_sensore, misurazione.timestamp
+    from misurazione
+    where id_misurazione = $1
+"""
+
+ESTRAI_METADATA_BATCH = """
+    SELECT numero_misurazioni, timestamp_creazione
+    from batch
+    where id_batch = $1
+"""
@@ -1,20 +1,26 @@
+import asyncio
+import json
 import logging
 import os
-from contextlib import asynccontextmanager
-from typing import Dict
+from contextlib import asynccontextmanager, suppress
+from typing import Dict, List, Literal
 
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import Depends
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from Classi_comuni.entita.modelli_dati import DatiSensore, DatiPayload, DatiMisurazione, DatiBatch
 from Cloud_Service_Provider.auth.auth_utils import richiede_permesso_scrittura, richiede_permesso_verifica
-from Cloud_Service_Provider.database.gestore_db import GestoreDatabase
+from Cloud_Service_Provider.config.costanti_cloud import MAX_DIMENSIONE_CORPO_DECOMPRESSO, MAX_BATCH_PER_RICHIESTA, \
+    MODALITA_AUDIT, RICALCOLO_HASH_ATTIVO
+from Cloud_Service_Provider.database.backend_db import crea_gestore_db_async, GestoreDbAsincrono
 from Cloud_Service_Provider.entita.utente_api import UtenteAPI
 from Cloud_Service_Provider.interfaccia_rest.utils.cloud_api_utils import elabora_payload
-from cloud_api_utils import costruisci_mappa_id_hash_batch
+from Cloud_Service_Provider.interfaccia_rest.utils.decompressione_gzip import DecompressioneGzipMiddleware
+from Cloud_Service_Provider.interfaccia_rest.task import task_ricalcolo_hash
+from cloud_api_utils import costruisci_mappa_id_hash_batch, itera_mappe_id_hash_batch
 from modelli_dati import MetaDatiBatch, MetaDatiMisurazione
 
 # Configurazione globale del logging
@@ -34,27 +40,39 @@ config_db = {
     "user": os.getenv("DB_USER"),
     "password": os.getenv("DB_PASSWORD")
 }
-gestore_db = GestoreDatabase(config_db)
+# creato all'avvio dell'applicazione, nell'event loop che servirà le richieste (backend da DB_BACKEND)
+gestore_db: GestoreDbAsincrono | None = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global gestore_db
     logger.info("StartUp Applicazione")
+    gestore_db = await crea_gestore_db_async(config_db)
+    task_ricalcolo = None
+    if RICALCOLO_HASH_ATTIVO:
+        task_ricalcolo = asyncio.create_task(task_ricalcolo_hash.task_ricalcolo_hash(gestore_db))
     yield  # Applicazione avviata
     #operazioni da effettuare alla terminazione dell'applicazione
+    if task_ricalcolo is not None:
+        task_ricalcolo.cancel()
+        with suppress(asyncio.CancelledError):
+            await task_ricalcolo
     logger.info("Chiusura dell'applicazione: chiusura connessione al DB.")
-    gestore_db.chiudi_connessione()
+    await gestore_db.chiudi_connessione()
 
 # Istanzia l'app FastAPI con supporto al lifecycle
 app = FastAPI(lifespan=lifespan)
+# il fog node invia i payload dei batch compressi in gzip
+app.add_middleware(DecompressioneGzipMiddleware, max_dimensione=MAX_DIMENSIONE_CORPO_DECOMPRESSO)
 @app.post("/sensori")
-def registra_sensore(dati: DatiSensore, utente: UtenteAPI = Depends(richiede_permesso_scrittura)):
+async def registra_sensore(dati: DatiSensore, utente: UtenteAPI = Depends(richiede_permesso_scrittura)):
     """
     Endpoint per la registrazione di un sensore.
     Riceve un oggetto DatiSensore, lo valida e lo salva nel database.
     Restituisce un messaggio di conferma con l'id del sensore
     per confermare la corretta registrazione del sensore
     """
-    successo_operazione = gestore_db.inserisci_sensore(dati)
+    successo_operazione = await gestore_db.inserisci_sensore(dati)
     if successo_operazione:
         logger.info(f"Sensore registrato: {dati.id_sensore}")
         return JSONResponse(content={
@@ -70,13 +88,13 @@ def registra_sensore(dati: DatiSensore, utente: UtenteAPI = Depends(richiede_per
         )
 
 @app.post("/batch")
-def ricevi_batch(payload: DatiPayload, utente: UtenteAPI = Depends(richiede_permesso_scrittura)):
+async def ricevi_batch(payload: DatiPayload, utente: UtenteAPI = Depends(richiede_permesso_scrittura)):
     """
     Endpoint per ricevere un intero batch con le sue misurazioni.
     Il payload contiene un oggetto DatiBatch e una lista di DatiMisurazione.
     """
     logger.info(f"Ricezione batch {payload.batch.id_batch} con {len(payload.misurazioni)} misurazioni...")
-    successo_operazione = elabora_payload(payload, gestore_db)
+    successo_operazione = await elabora_payload(payload, gestore_db)
 
     if successo_operazione:
         logger.info(f"Batch {payload.batch.id_batch} salvato correttamente.")
@@ -93,26 +111,84 @@ def ricevi_batch(payload: DatiPayload, utente: UtenteAPI = Depends(richiede_perm
         )
 
 @app.get("/batch/mappa-id-hash", response_model=Dict[int, str])
-def ottieni_mappa_id_batch(id: int, utente: UtenteAPI = Depends(richiede_permesso_verifica)):
+async def ottieni_mappa_id_batch(id: int, modalita: Literal["audit", "rapida"] = MODALITA_AUDIT,
+                                 utente: UtenteAPI = Depends(richiede_permesso_verifica)):
+    """
+    Restituisce la mappa ID → hash delle foglie del batch.
+    modalita=audit (default) ricalcola gli hash dalle righe salvate; modalita=rapida restituisce
+    gli hash salvati alla ricezione, senza rilevare modifiche successive alle righe.
+    """
     try:
         logger.debug(f"[DEBUG] Ricevuta richiesta batch con id = {id}")
-        mappa_id_hash = costruisci_mappa_id_hash_batch(id, gestore_db)
+        mappa_id_hash = await costruisci_mappa_id_hash_batch(id, gestore_db, modalita)
         #print(f"[DEBUG] Payload costruito: {payload}")
         return mappa_id_hash
     except Exception as e:
         logger.error(f"[ERRORE GET /batch] {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/batch/mappa-id-hash/multipla")
+async def ottieni_mappe_id_batch(ids: List[int] | None = Query(None), da: int | None = None, a: int | None = None,
+                                 modalita: Literal["audit", "rapida"] = MODALITA_AUDIT,
+                                 utente: UtenteAPI = Depends(richiede_permesso_verifica)):
+    """
+    Restituisce le mappe ID → hash di più batch in un'unica risposta NDJSON (una riga per batch),
+    inviata man mano che i batch vengono letti con un'unica query:
+      {"id_batch": 12, "mappa": {"0": "<hash>", "2048": "<hash>", ...}}
+      {"id_batch": 13, "errore": "Nessun batch trovato con ID 13"}
+    I batch si indicano con ?ids=1&ids=5&... oppure con l'intervallo ?da=1&a=1000 (estremi inclusi).
+    Un errore durante l'invio viene segnalato da un'ultima riga {"errore": "..."}.
+    modalita come in /batch/mappa-id-hash.
+    """
+    if (da is None) != (a is None):
+        raise HTTPException(status_code=400, detail="Indicare sia 'da' sia 'a'")
+    lista_id = list(ids or [])
+    if da is not None:
+        if a < da or a - da + 1 > MAX_BATCH_PER_RICHIESTA:
+            raise HTTPException(status_code=400, detail="Intervallo di batch non valido")
+        lista_id.extend(range(da, a + 1))
+    # ogni batch compare una sola volta nella risposta
+    lista_id = list(dict.fromkeys(lista_id))
+    if not lista_id:
+        raise HTTPException(status_code=400, detail="Nessun batch richiesto")
+    if len(lista_id) > MAX_BATCH_PER_RICHIESTA:
+        raise HTTPException(status_code=400,
+                            detail=f"Al massimo {MAX_BATCH_PER_RICHIESTA} batch per richiesta")
+
+    async def genera_righe():
+        try:
+            async for id_batch, mappa in itera_mappe_id_hash_batch(lista_id, gestore_db, modalita):
+                if mappa is None:
+                    riga = {"id_batch": id_batch, "errore": f"Nessun batch trovato con ID {id_batch}"}
+                else:
+                    riga = {"id_batch": id_batch, "mappa": mappa}
+                yield json.dumps(riga, separators=(",", ":")) + "\n"
+        except Exception as e:
+            logger.error(f"[ERRORE GET /batch/mappa-id-hash/multipla] {e}")
+            yield json.dumps({"errore": str(e)}) + "\n"
+
+    return StreamingResponse(genera_righe(), media_type="application/x-ndjson")
+
+@app.get("/batch/ricalcolo-hash")
+async def ottieni_esito_ricalcolo_hash(utente: UtenteAPI = Depends(richiede_permesso_verifica)):
+    """
+    Esito dell'ultimo ricalcolo periodico degli hash di foglia: batch le cui righe non
+    corrispondono più agli hash salvati alla ricezione.
+    """
+    if task_ricalcolo_hash.ultimo_esito_ricalcolo is None:
+        raise HTTPException(status_code=404, detail="Nessun ricalcolo completato")
+    return task_ricalcolo_hash.ultimo_esito_ricalcolo
+
 @app.get("/metadata/misurazione/{id_misurazione}", response_model=MetaDatiMisurazione)
-def ricostruisci_misurazione(id_misurazione: int, utente: UtenteAPI = Depends(richiede_permesso_verifica)):
-    ris_query = gestore_db.estrai_metadata_misurazione(id_misurazione)
+async def ricostruisci_misurazione(id_misurazione: int, utente: UtenteAPI = Depends(richiede_permesso_verifica)):
+    ris_query = await gestore_db.estrai_metadata_misurazione(id_misurazione)
     if not ris_query:
         raise HTTPException(status_code=404, detail="Misurazione non trovata")
     return MetaDatiMisurazione(**ris_query)
 #
 @app.get("/metadata/batch/{id_batch}", response_model=MetaDatiBatch)
-def ricostruisci_batch(id_batch: int):
-    ris_query = gestore_db.estrai_metadata_batch(id_batch)
+async def ricostruisci_batch(id_batch: int):
+    ris_query = await gestore_db.estrai_metadata_batch(id_batch)
     if not ris_query:
         raise HTTPException(status_code=404, detail="Batch non trovato")
     return MetaDatiBatch(**ris_query)
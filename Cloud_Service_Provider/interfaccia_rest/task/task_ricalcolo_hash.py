@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+
+from Cloud_Service_Provider.config.costanti_cloud import INTERVALLO_RICALCOLO_HASH, DIMENSIONE_BLOCCO_RICALCOLO
+from Cloud_Service_Provider.database.backend_db import GestoreDbAsincrono
+from Cloud_Service_Provider.interfaccia_rest.utils.cloud_api_utils import costruisci_mappa_id_hash, mappa_hash_salvati
+
+logger = logging.getLogger(__name__)
+
+# esito dell'ultimo ricalcolo completato (None finché il primo non termina), esposto da GET /batch/ricalcolo-hash
+ultimo_esito_ricalcolo: dict | None = None
+
+
+async def ricalcola_hash_batch(gestore_db: GestoreDbAsincrono,
+                               dimensione_blocco: int = DIMENSIONE_BLOCCO_RICALCOLO) -> dict:
+    """
+    Ricalcola dalle righe salvate gli hash di foglia di tutti i batch, a blocchi di
+    `dimensione_blocco` batch, e li confronta con quelli salvati alla ricezione.
+    Un hash diverso indica righe (o hash) modificati dopo la ricezione: il batch viene
+    segnalato. Gli hash salvati non vengono mai aggiornati con quelli ricalcolati.
+    """
+    loop = asyncio.get_running_loop()
+    inizio = time.perf_counter()
+    esito = {
+        "batch_controllati": 0,
+        "foglie_controllate": 0,
+        "foglie_senza_hash": 0,
+        # id_batch -> ID delle foglie con hash salvato diverso da quello ricalcolato
+        "batch_non_conformi": {},
+    }
+    ultimo_id = -1
+    while lista_id := await gestore_db.estrai_id_batch(ultimo_id, dimensione_blocco):
+        ultimo_id = lista_id[-1]
+        salvati = {id_batch: mappa_hash_salvati(righe)
+                   async for id_batch, righe in gestore_db.itera_hash_foglie_batch(lista_id)}
+        async for id_batch, righe in gestore_db.itera_dati_batch_misurazioni(lista_id):
+            ricalcolati = await loop.run_in_executor(None, costruisci_mappa_id_hash, righe)
+            hash_salvati = salvati.get(id_batch, {})
+            non_conformi = []
+            for id_foglia, hash_foglia in ricalcolati.items():
+                hash_salvato = hash_salvati.get(id_foglia)
+                if hash_salvato is None:
+                    esito["foglie_senza_hash"] += 1
+                elif hash_salvato != hash_foglia:
+                    non_conformi.append(id_foglia)
+            esito["batch_controllati"] += 1
+            esito["foglie_controllate"] += len(ricalcolati)
+            if non_conformi:
+                esito["batch_non_conformi"][id_batch] = non_conformi
+                logger.error(f"[RICALCOLO HASH] Batch {id_batch}: {len(non_conformi)} foglie con hash "
+                             f"diverso da quello salvato alla ricezione (es. ID {non_conformi[:5]})")
+
+    esito["durata_s"] = round(time.perf_counter() - inizio, 3)
+    esito["completato_alle"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return esito
+
+
+async def task_ricalcolo_hash(gestore_db: GestoreDbAsincrono, intervallo: int = INTERVALLO_RICALCOLO_HASH):
+    """Esegue periodicamente ricalcola_hash_batch e conserva l'ultimo esito."""
+    global ultimo_esito_ricalcolo
+    while True:
+        try:
+            ultimo_esito_ricalcolo = await ricalcola_hash_batch(gestore_db)
+            logger.info(f"[RICALCOLO HASH] {ultimo_esito_ricalcolo['batch_controllati']} batch controllati, "
+                        f"{len(ultimo_esito_ricalcolo['batch_non_conformi'])} non conformi "
+                        f"({ultimo_esito_ricalcolo['durata_s']} s)")
+        except Exception as e:
+            logger.error(f"[RICALCOLO HASH] Ricalcolo interrotto: {e}")
+        await asyncio.sleep(intervallo)
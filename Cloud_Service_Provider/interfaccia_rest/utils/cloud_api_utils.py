@@ -1,48 +1,120 @@
+import asyncio
 import logging
+from typing import AsyncIterator
 
+from Classi_comuni.config.costanti_comuni import ID_BATCH_LOGICO
 from Classi_comuni.costruttore_payload import CostruttorePayload
 from Classi_comuni.entita.modelli_dati import DatiPayload
-from Cloud_Service_Provider.database.gestore_db import GestoreDatabase
+from Cloud_Service_Provider.config.costanti_cloud import MODALITA_RAPIDA, MODALITA_AUDIT
+from Cloud_Service_Provider.database.backend_db import GestoreDbAsincrono
 
 logger = logging.getLogger(__name__)
 
-def elabora_payload(payload: DatiPayload, gestore_db: GestoreDatabase) -> bool:
+async def elabora_payload(payload: DatiPayload, gestore_db: GestoreDbAsincrono) -> bool:
     """
     Riceve un oggetto DatiPayload contenente:
     - Un batch (DatiBatch)
     - Una lista di misurazioni (DatiMisurazione)
-    Esegue:
-    1. Inserimento del batch nel database
-    2. Inserimento di ogni misurazione associata
+    Inserisce il batch e tutte le misurazioni associate in un'unica transazione:
+    un errore a metà non lascia nel database un batch salvato parzialmente.
+    Con le righe vengono salvati gli hash di foglia, usati dalla verifica in modalità rapida.
 
     Ritorna:
     - True se tutte le operazioni vanno a buon fine
-    - False se una qualsiasi operazione fallisce
+    - False se una qualsiasi operazione fallisce (nessuna riga salvata)
+    """
+    hash_foglie = await asyncio.get_running_loop().run_in_executor(None, calcola_hash_foglie, payload)
+    if not await gestore_db.inserisci_payload(payload, hash_foglie):
+        logger.error(f"Inserimento batch {payload.batch.id_batch} fallito.")
+        return False
+    return True
+
+
+def calcola_hash_foglie(payload: DatiPayload) -> dict[int, str]:
+    """
+    Calcola gli hash di foglia di un batch ricevuto (ID logico → hash, 0 = batch), uguali a quelli
+    che costruisci_mappa_id_hash ricalcola dalle righe salvate: ogni misurazione è salvata
+    con l'id_batch del batch che la contiene.
     """
     batch = payload.batch
-    #lista di misurazioni
-    misurazioni = payload.misurazioni
+    mappa_id_hash = {ID_BATCH_LOGICO: batch.to_hash()}
+    for mis in payload.misurazioni:
+        if mis.id_batch != batch.id_batch:
+            mis = mis.model_copy(update={"id_batch": batch.id_batch})
+        mappa_id_hash[mis.id_misurazione] = mis.to_hash()
+    return mappa_id_hash
 
-    # Prima l'inserimento del batch e poi delle misurazioni associate
-    if not gestore_db.inserisci_batch(batch):
-        logger.error(f"Inserimento batch {batch.id_batch} fallito.")
-        return False
 
-    # Inserisce le misurazioni
-    for m in misurazioni:
-        if not gestore_db.inserisci_misurazione(m, batch.id_batch):
-            logger.error(f"Inserimento misurazione {m.id_misurazione} fallito.")
-            return False
+def costruisci_mappa_id_hash(righe: list[dict]) -> dict[int, str]:
+    """Ricalcola la mappa ID → hash dalle righe grezze del batch (modalità audit)."""
+    payload = CostruttorePayload()
+    payload.estrai_dati_da_query(righe)
+    return payload.ottieni_mappa_id_foglie()
+
+
+def mappa_hash_salvati(righe: list[dict]) -> dict[int, str | None]:
+    """Mappa ID → hash salvato alla ricezione (None per le righe salvate senza hash)."""
+    mappa_id_hash = {ID_BATCH_LOGICO: righe[0]["hash_batch"]}
+    for riga in righe:
+        mappa_id_hash[riga["id_misurazione"]] = riga["hash_foglia"]
+    return mappa_id_hash
 
-    #entrambe le operazioni sono andate a buon fine
-    return True
 
+def _mappa_rapida(righe: list[dict]) -> dict[int, str] | None:
+    # None se manca anche un solo hash salvato: il batch viene ricalcolato dalle righe
+    mappa_id_hash = mappa_hash_salvati(righe)
+    return None if None in mappa_id_hash.values() else mappa_id_hash
 
-def costruisci_mappa_id_hash_batch(id_batch: int, gestore_db : GestoreDatabase) -> dict[int, str]:
-    risultati_query = gestore_db.estrai_dati_batch_misurazioni(id_batch)
+
+async def costruisci_mappa_id_hash_batch(id_batch: int, gestore_db: GestoreDbAsincrono,
+                                         modalita: str = MODALITA_AUDIT) -> dict[int, str]:
+    """
+    Mappa ID → hash delle foglie di un batch.
+    - audit (default): ricalcolata dalle righe salvate; rileva qualsiasi modifica alle righe del database.
+    - rapida: hash salvati alla ricezione, senza ricalcolo; non rileva modifiche alle righe successive
+      alla ricezione (controllate dal ricalcolo periodico). I batch salvati senza hash sono ricalcolati.
+    """
+    if modalita == MODALITA_RAPIDA:
+        righe_hash = await gestore_db.estrai_hash_foglie_batch(id_batch)
+        mappa_id_hash = _mappa_rapida(righe_hash) if righe_hash else None
+        if mappa_id_hash is not None:
+            return mappa_id_hash
+
+    risultati_query = await gestore_db.estrai_dati_batch_misurazioni(id_batch)
     if not risultati_query:
         raise ValueError(f"Nessun batch trovato con ID {id_batch}")
 
-    payload = CostruttorePayload()
-    payload.estrai_dati_da_query(risultati_query)
-    return payload.ottieni_mappa_id_foglie()
+    # il calcolo degli hash (CPU) avviene in un thread: l'event loop continua a servire le altre richieste
+    return await asyncio.get_running_loop().run_in_executor(None, costruisci_mappa_id_hash, risultati_query)
+
+
+async def itera_mappe_id_hash_batch(lista_id: list[int], gestore_db: GestoreDbAsincrono,
+                                    modalita: str = MODALITA_AUDIT) -> AsyncIterator[tuple[int, dict[int, str] | None]]:
+    """
+    Costruisce le mappe ID → hash di più batch leggendo le righe con un'unica query
+    (modalità come in costruisci_mappa_id_hash_batch).
+    Restituisce (id_batch, mappa) per ogni batch trovato, in ordine di ID, e infine
+    (id_batch, None) per ogni batch richiesto ma non presente nel database.
+    In modalità rapida i batch salvati senza hash seguono quelli serviti dagli hash salvati.
+    """
+    loop = asyncio.get_running_loop()
+    da_ricalcolare = list(lista_id)
+    if modalita == MODALITA_RAPIDA:
+        serviti = set()
+        async for id_batch, righe in gestore_db.itera_hash_foglie_batch(lista_id):
+            mappa_id_hash = _mappa_rapida(righe)
+            if mappa_id_hash is not None:
+                serviti.add(id_batch)
+                yield id_batch, mappa_id_hash
+        da_ricalcolare = [id_batch for id_batch in lista_id if id_batch not in serviti]
+        if not da_ricalcolare:
+            return
+
+    trovati = set()
+    async for id_batch, righe in gestore_db.itera_dati_batch_misurazioni(da_ricalcolare):
+        trovati.add(id_batch)
+        yield id_batch, await loop.run_in_executor(None, costruisci_mappa_id_hash, righe)
+
+    for id_batch in da_ricalcolare:
+        if id_batch not in trovati:
+            yield id_batch, None
@@ -0,0 +1,96 @@
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+"""
+Middleware ASGI che decomprime i corpi delle richieste inviati con Content-Encoding: gzip
+(il fog node comprime i payload dei batch). Le richieste non compresse passano invariate.
+La decompressione è limitata a `max_dimensione` byte per evitare che un corpo compresso
+molto piccolo si espanda in memoria senza limiti (zip bomb): oltre il limite risponde 413.
+Corpi gzip non validi o troncati ricevono 400, Content-Encoding non supportati 415.
+"""
+class DecompressioneGzipMiddleware:
+    def __init__(self, app, max_dimensione: int = 64 * 1024 * 1024):
+        self.app = app
+        self.max_dimensione = max_dimensione
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = dict(scope["headers"])
+        codifica = header.get(b"content-encoding", b"").strip().lower()
+        if not codifica or codifica == b"identity":
+            await self.app(scope, receive, send)
+            return
+        if codifica != b"gzip":
+            await self._rispondi_errore(send, 415, "Content-Encoding non supportato")
+            return
+
+        # wbits 16 + MAX_WBITS: formato gzip (header e trailer)
+        decompressore = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        parti = []
+        dimensione = 0
+        try:
+            altro_corpo = True
+            while altro_corpo:
+                messaggio = await receive()
+                if messaggio["type"] == "http.disconnect":
+                    return
+                altro_corpo = messaggio.get("more_body", False)
+                # max_length limita l'output di ogni passo: il residuo resta in unconsumed_tail
+                dati = messaggio.get("body", b"")
+                while dati:
+                    parte = decompressore.decompress(dati, self.max_dimensione - dimensione + 1)
+                    dimensione += len(parte)
+                    if dimensione > self.max_dimensione:
+                        await self._rispondi_errore(send, 413, "Corpo decompresso troppo grande")
+                        return
+                    parti.append(parte)
+                    dati = decompressore.unconsumed_tail
+            parte = decompressore.flush()
+            dimensione += len(parte)
+            if dimensione > self.max_dimensione:
+                await self._rispondi_errore(send, 413, "Corpo decompresso troppo grande")
+                return
+            parti.append(parte)
+            if not decompressore.eof:
+                # stream gzip senza fine (corpo troncato): non viene passato all'applicazione
+                logger.warning("[GZIP] Corpo compresso troncato")
+                await self._rispondi_errore(send, 400, "Corpo gzip non valido")
+                return
+        except zlib.error as e:
+            logger.warning(f"[GZIP] Corpo compresso non valido: {e}")
+            await self._rispondi_errore(send, 400, "Corpo gzip non valido")
+            return
+
+        corpo = b"".join(parti)
+        # l'applicazione vede una richiesta non compressa con la lunghezza corretta
+        scope = dict(scope)
+        scope["headers"] = [
+            (nome, valore) for nome, valore in scope["headers"]
+            if nome not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(corpo)).encode("ascii"))]
+        inviato = False
+
+        async def ricevi_decompresso():
+            nonlocal inviato
+            if inviato:
+                # dopo il corpo, inoltra gli eventi successivi (es. disconnessione del client)
+                return await receive()
+            inviato = True
+            return {"type": "http.request", "body": corpo, "more_body": False}
+
+        await self.app(scope, ricevi_decompresso, send)
+
+    @staticmethod
+    async def _rispondi_errore(send, status: int, messaggio: str) -> None:
+        corpo = ('{"detail":"' + messaggio + '"}').encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(corpo)).encode("ascii"))],
+        })
+        await send({"type": "http.response.body", "body": corpo})
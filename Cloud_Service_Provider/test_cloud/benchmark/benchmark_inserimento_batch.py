@@ -0,0 +1,105 @@
+"""
+Benchmark dell'inserimento dei batch ricevuti dal cloud provider (PostgreSQL).
+Confronta, a parità di batch da 1023 misurazioni:
+- ciclo precedente: inserisci_batch + inserisci_misurazione per ogni riga (autocommit, un round trip per riga)
+- inserisci_payload: un'unica transazione con INSERT multi-riga (execute_values)
+e verifica che un errore a metà batch non lasci righe salvate con inserisci_payload.
+
+Usa il database configurato in config/.env, in uno schema temporaneo eliminato al termine.
+Esecuzione: python benchmark_inserimento_batch.py --batch 20
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+from Classi_comuni.entita.modelli_dati import DatiSensore, DatiBatch, DatiMisurazione, DatiPayload
+from Cloud_Service_Provider.database.gestore_db import GestoreDatabase
+
+DIMENSIONE_BATCH = 1023
+SCHEMA_BENCHMARK = f"benchmark_inserimento_{os.getpid()}"
+
+
+def configurazione_db() -> dict:
+    load_dotenv(os.path.join(os.path.dirname(__file__), "..", "..", "config", ".env"))
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": int(os.getenv("DB_PORT", 5432)),
+        "database": os.getenv("DB_NAME", "dati_cloud"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "admin"),
+    }
+
+
+def esegui_ddl(config: dict, istruzione: str) -> None:
+    conn = psycopg2.connect(**config)
+    try:
+        conn.autocommit = True
+        conn.cursor().execute(istruzione)
+    finally:
+        conn.close()
+
+
+def crea_payload(id_batch: int) -> DatiPayload:
+    primo_id = id_batch * (DIMENSIONE_BATCH + 1) + 1
+    return DatiPayload(
+        batch=DatiBatch(id_batch=id_batch, timestamp_creazione="2025-01-01 00:00:00",
+                        numero_misurazioni=DIMENSIONE_BATCH),
+        misurazioni=[
+            DatiMisurazione(id_misurazione=primo_id + i, id_sensore="JOY001", timestamp="2025-01-01 00:00:00",
+                            id_batch=id_batch, dati={"pressed": i % 2 == 0, "x": i / 1000, "y": -i / 1000})
+            for i in range(DIMENSIONE_BATCH)
+        ],
+    )
+
+
+def inserimento_per_riga(gestore: GestoreDatabase, payload: DatiPayload) -> bool:
+    # flusso precedente di elabora_payload
+    if not gestore.inserisci_batch(payload.batch):
+        return False
+    return all(gestore.inserisci_misurazione(m, payload.batch.id_batch) for m in payload.misurazioni)
+
+
+def conta_misurazioni(gestore: GestoreDatabase, id_batch: int) -> int:
+    return len(gestore.estrai_dati_batch_misurazioni(id_batch))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inserimento dei batch: ciclo per riga vs transazione bulk")
+    parser.add_argument("--batch", type=int, default=20, help="batch inseriti per ciascun metodo")
+    args = parser.parse_args()
+
+    config = configurazione_db()
+    esegui_ddl(config, f"CREATE SCHEMA {SCHEMA_BENCHMARK}")
+    # le tabelle del GestoreDatabase vengono create nello schema temporaneo
+    gestore = GestoreDatabase({**config, "options": f"-c search_path={SCHEMA_BENCHMARK}"})
+    try:
+        gestore.inserisci_sensore(DatiSensore(id_sensore="JOY001", descrizione="Joystick benchmark", tipo="joystick"))
+        payload = [crea_payload(i) for i in range(1, 2 * args.batch + 1)]
+
+        for nome, metodo, lotto in (("per riga", inserimento_per_riga, payload[:args.batch]),
+                                    ("bulk", GestoreDatabase.inserisci_payload, payload[args.batch:])):
+            inizio = time.perf_counter()
+            for p in lotto:
+                assert metodo(gestore, p), f"inserimento del batch {p.batch.id_batch} fallito"
+            durata = time.perf_counter() - inizio
+            righe = args.batch * DIMENSIONE_BATCH
+            print(f"{nome:>9}: {righe / durata:,.0f} righe/s ({durata * 1000 / args.batch:.1f} ms per batch)")
+
+        # atomicità: l'ultima misurazione viola la foreign key sul sensore e l'intero batch viene annullato
+        guasto = crea_payload(10 ** 5)
+        ultima = guasto.misurazioni[-1]
+        guasto.misurazioni.append(ultima.model_copy(
+            update={"id_misurazione": ultima.id_misurazione + 1, "id_sensore": "SENSORE_INESISTENTE"}))
+        assert not gestore.inserisci_payload(guasto)
+        print(f"atomicità: batch con errore all'ultima riga -> "
+              f"{conta_misurazioni(gestore, guasto.batch.id_batch)} misurazioni salvate")
+    finally:
+        gestore.chiudi_connessione()
+        esegui_ddl(config, f"DROP SCHEMA {SCHEMA_BENCHMARK} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Test di carico del pool di connessioni del cloud provider (PostgreSQL).
+Per ogni dimensione del pool, `--thread` thread eseguono in parallelo caricamenti di batch
+(inserisci_payload, come POST /batch) e verifiche (estrai_dati_batch_misurazioni, come
+GET /batch/mappa-id-hash) sullo stesso GestoreDatabase, come i thread del server FastAPI.
+Con pool di dimensione 1 le operazioni sono serializzate (comportamento della singola
+connessione condivisa); il throughput dovrebbe crescere con la dimensione del pool
+finché non si saturano i core del server PostgreSQL o i thread.
+
+Usa il database configurato in config/.env, in uno schema temporaneo eliminato al termine.
+Esecuzione: python load_test_pool.py --pool 1 2 4 8 --thread 16 --operazioni 400
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Classi_comuni.entita.modelli_dati import DatiSensore, DatiPayload
+from Cloud_Service_Provider.database.gestore_db import GestoreDatabase
+from Cloud_Service_Provider.test_cloud.benchmark.benchmark_inserimento_batch import DIMENSIONE_BATCH, \
+    configurazione_db, esegui_ddl, crea_payload
+
+SCHEMA_LOAD_TEST = f"load_test_pool_{os.getpid()}"
+# batch caricati prima della misura, letti dalle verifiche
+BATCH_PRECARICATI = 50
+
+
+def esegui_carico(gestore: GestoreDatabase, thread: int, operazioni: int, quota_caricamenti: float,
+                  primo_id_nuovo: int) -> dict:
+    """Esegue `operazioni` tra caricamenti e verifiche con `thread` thread; restituisce i tempi."""
+    contatore = iter(range(primo_id_nuovo, primo_id_nuovo + operazioni))
+    lock_contatore = threading.Lock()
+    casuale = random.Random(0)
+    # l'ordine delle operazioni è lo stesso per ogni dimensione del pool
+    tipi = ["caricamento" if casuale.random() < quota_caricamenti else "verifica" for _ in range(operazioni)]
+    payload_per_id: dict[int, DatiPayload] = {}
+    for tipo in tipi:
+        if tipo == "caricamento":
+            id_batch = next(contatore)
+            payload_per_id[id_batch] = crea_payload(id_batch)
+    da_caricare = iter(sorted(payload_per_id))
+
+    def operazione(tipo: str) -> tuple[str, float, bool]:
+        inizio = time.perf_counter()
+        if tipo == "caricamento":
+            with lock_contatore:
+                id_batch = next(da_caricare)
+            esito = gestore.inserisci_payload(payload_per_id[id_batch])
+        else:
+            id_batch = casuale.randint(1, BATCH_PRECARICATI)
+            esito = len(gestore.estrai_dati_batch_misurazioni(id_batch)) == DIMENSIONE_BATCH
+        return tipo, time.perf_counter() - inizio, esito
+
+    inizio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=thread) as esecutore:
+        esiti = list(esecutore.map(operazione, tipi))
+    durata = time.perf_counter() - inizio
+
+    latenze = {tipo: sorted(t for k, t, _ in esiti if k == tipo) for tipo in ("caricamento", "verifica")}
+    return {
+        "durata": durata,
+        "falliti": sum(1 for _, _, esito in esiti if not esito),
+        "latenze": latenze,
+    }
+
+
+def percentile(valori: list[float], p: float) -> float:
+    return valori[min(len(valori) - 1, int(len(valori) * p))] if valori else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput di caricamenti e verifiche al variare del pool")
+    parser.add_argument("--pool", type=int, nargs="+", default=[1, 2, 4, 8], help="dimensioni del pool da provare")
+    parser.add_argument("--thread", type=int, default=16, help="richieste concorrenti")
+    parser.add_argument("--operazioni", type=int, default=400, help="operazioni per dimensione del pool")
+    parser.add_argument("--quota-caricamenti", type=float, default=0.3,
+                        help="frazione delle operazioni che sono caricamenti di batch")
+    args = parser.parse_args()
+
+    config = configurazione_db()
+    esegui_ddl(config, f"CREATE SCHEMA {SCHEMA_LOAD_TEST}")
+    config_schema = {**config, "options": f"-c search_path={SCHEMA_LOAD_TEST}"}
+    try:
+        preparazione = GestoreDatabase(config_schema, 1, 1)
+        try:
+            preparazione.inserisci_sensore(DatiSensore(id_sensore="JOY001", descrizione="Joystick load test",
+                                                       tipo="joystick"))
+            for id_batch in range(1, BATCH_PRECARICATI + 1):
+                assert preparazione.inserisci_payload(crea_payload(id_batch))
+        finally:
+            preparazione.chiudi_connessione()
+
+        primo_id_nuovo = BATCH_PRECARICATI + 1
+        riferimento = None
+        print(f"{args.thread} thread, {args.operazioni} operazioni "
+              f"({args.quota_caricamenti:.0%} caricamenti da {DIMENSIONE_BATCH} misurazioni)")
+        for dimensione in args.pool:
+            gestore = GestoreDatabase(config_schema, dimensione, dimensione)
+            try:
+                misura = esegui_carico(gestore, args.thread, args.operazioni, args.quota_caricamenti, primo_id_nuovo)
+            finally:
+                gestore.chiudi_connessione()
+            primo_id_nuovo += args.operazioni
+            throughput = args.operazioni / misura["durata"]
+            riferimento = riferimento or throughput
+            caricamenti, verifiche = misura["latenze"]["caricamento"], misura["latenze"]["verifica"]
+            print(f"pool {dimensione:>3}: {throughput:8.1f} op/s (x{throughput / riferimento:.2f}) | "
+                  f"caricamento p50 {percentile(caricamenti, 0.5) * 1000:7.1f} ms "
+                  f"p95 {percentile(caricamenti, 0.95) * 1000:7.1f} ms | "
+                  f"verifica p50 {percentile(verifiche, 0.5) * 1000:7.1f} ms "
+                  f"p95 {percentile(verifiche, 0.95) * 1000:7.1f} ms | falliti {misura['falliti']}")
+    finally:
+        esegui_ddl(config, f"DROP SCHEMA {SCHEMA_LOAD_TEST} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,57 @@ ERRORE_IPFS = "ERRORE_IPFS"
 ERRORE_BLOCKCHAIN= "ERRORE_BLOCKCHAIN"
 ERRORE_HTTP = "ERRORE_HTTP"
 
-#soglia potenza di due - 1
+# numero massimo di misurazioni per batch (+1 foglia logica del batch, ID 0).
+# Il Merkle Tree supporta qualsiasi numero di foglie (promozione dei nodi dispari)
 SOGLIA_BATCH : int = 1023
+# età massima (in secondi) di un batch aperto: superata questa soglia il batch viene chiuso
+# anche se non ha raggiunto SOGLIA_BATCH (si chiude al primo dei due limiti raggiunto)
+SOGLIA_TEMPO_BATCH : int = 300
+# intervallo (in secondi) del task periodico che controlla l'età del batch aperto
+INTERVALLO_CONTROLLO_BATCH : int = 10
+
+# group-commit: le misurazioni in coda vengono salvate in un'unica transazione
+# ogni GROUP_COMMIT_INTERVALLO_MS millisecondi o appena se ne accumulano GROUP_COMMIT_MAX_RIGHE
+GROUP_COMMIT_MAX_RIGHE : int = 256
+GROUP_COMMIT_INTERVALLO_MS : float = 5
+
+# Profilo di storage del database SQLite del fog node:
+# - journal_mode WAL: i lettori (elaborazione batch, task di retry) non bloccano lo scrittore
+# - synchronous NORMAL: in WAL un commit resta atomico e sopravvive al crash del processo;
+#   usare "FULL" se serve la durabilità anche in caso di interruzione di corrente
+# - mmap_size in byte, cache_size in KiB se negativo (numero di pagine se positivo)
+PROFILO_STORAGE_SQLITE : dict = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+}
+
+# elaborazione dei batch completi fuori dall'event loop:
+# - payload JSON, hashing delle foglie e Merkle Tree in un pool di processi (CPU-bound)
+# - letture dal DB e upload IPFS in un pool di thread (I/O-bound)
+NUM_PROCESSI_ELABORAZIONE : int = os.cpu_count() or 2
+NUM_THREAD_IO : int = 8
+
+# pipeline dei batch guidata da eventi: un batch chiuso viene accodato subito per l'elaborazione
+# e, una volta elaborato, per l'invio al cloud. PROFONDITA_CODA_PIPELINE è la capienza massima
+# di ciascuna coda; i batch che non trovano posto vengono ripresi dalla scansione di recupero
+# eseguita ogni INTERVALLO_RECUPERO_PIPELINE secondi (e all'avvio), che drena l'arretrato a blocchi
+PROFONDITA_CODA_PIPELINE : int = 64
+INTERVALLO_RECUPERO_PIPELINE : int = 60
+
+# uplink HTTP verso il cloud (sessione condivisa con keep-alive):
+# - CONCORRENZA_INVIO: invii (sensori o batch) eseguiti in parallelo nel pool di thread di I/O
+# - DIMENSIONE_POOL_HTTP: connessioni tenute aperte verso il cloud
+# - COMPRESSIONE_UPLINK: "gzip" oppure None; si comprimono solo i corpi >= SOGLIA_COMPRESSIONE_BYTE
+CONCORRENZA_INVIO : int = 4
+DIMENSIONE_POOL_HTTP : int = CONCORRENZA_INVIO
+COMPRESSIONE_UPLINK : str | None = "gzip"
+SOGLIA_COMPRESSIONE_BYTE : int = 1024
+TIMEOUT_HTTP : float = 10
+
+# numero massimo di misurazioni accettate in una singola richiesta /misurazioni/bulk
+MAX_MISURAZIONI_BULK : int = 5000
 
 # Costanti con valori ammissibili
 TIPO_SENSORE_JOYSTICK: Final = "JOYSTICK"
@@ -25,4 +74,17 @@ ENDPOINT_CLOUD_SENSORI = "http://localhost:8080/sensori"
 ENDPOINT_CLOUD_BATCH = "http://localhost:8080/batch"
 
 #BUCKET FILEBASE
-BUCKET_MERKLE_PATH = "merkle-path-batch"
\ No newline at end of file
+BUCKET_MERKLE_PATH = "merkle-path-batch"
+# formato del file dei Merkle Path caricato su IPFS:
+# - "binario": formato versionato compatto (Classi_comuni/formato_path_binario.py)
+# - "livelli": livelli dell'albero, ogni nodo una sola volta (Classi_comuni/albero_livelli.py);
+#   il Verificatore deriva il path di ogni foglia su richiesta. File ~log n volte più piccolo
+# - "json": JSON indentato compresso in gzip (formato precedente, mantenuto come fallback)
+# il Verificatore riconosce automaticamente tutti i formati
+FORMATO_MERKLE_PATH : str = os.getenv("FORMATO_MERKLE_PATH", "binario")
+# endpoint S3-compatibile usato per caricare i Merkle Path su IPFS
+ENDPOINT_IPFS_S3 = os.getenv("ENDPOINT_IPFS_S3", "https://s3.filebase.com")
+# i file più grandi di SOGLIA_MULTIPART_IPFS byte vengono caricati in multipart,
+# a parti da DIMENSIONE_PARTE_IPFS byte (minimo 5 MiB imposto da S3)
+SOGLIA_MULTIPART_IPFS : int = 16 * 1024 * 1024
+DIMENSIONE_PARTE_IPFS : int = 8 * 1024 * 1024
\ No newline at end of file
@@ -2,8 +2,11 @@ import json
 import logging
 import os
 import sqlite3
+import threading
 from datetime import datetime
+from typing import Callable
 
+from config.costanti_produttore import PROFILO_STORAGE_SQLITE
 from database import query
 
 logger = logging.getLogger(__name__)
@@ -20,12 +23,102 @@ class GestoreDatabase:
     _DBPATH = os.path.join(BASE_DIR, "dati_fog_node.sqlite")
     _STRING_MAX_LENGTH = 12
 
-    def __init__(self, soglia_batch: int = 1023):
-        self.conn = sqlite3.connect(self._DBPATH)
+    def __init__(self, soglia_batch: int = 1023, soglia_tempo_batch: int = 300,
+                 profilo_storage: dict | None = None, percorso_db: str | None = None):
+        percorso_db = percorso_db or self._DBPATH
+        # le chiavi non specificate nel profilo passato assumono i valori di configurazione
+        self.profilo_storage = {**PROFILO_STORAGE_SQLITE, **(profilo_storage or {})}
+        # Connessione di SCRITTURA: usata dall'ingestione e da tutti gli aggiornamenti
+        self.conn = sqlite3.connect(percorso_db)
         #logger.debug("Usando database:", os.path.abspath(self._DBPATH))
         self.conn.row_factory = sqlite3.Row
+        self._applica_profilo_storage(self.conn)
         self.crea_tabelle()
+        self.applica_migrazioni()
+        # Connessione di LETTURA: usata dalle query di elaborazione batch e di retry,
+        # in modo che le letture lunghe non blocchino l'ingestione delle misurazioni.
+        # Può essere usata anche da thread diversi dall'event loop (accesso serializzato dal lock)
+        self.conn_lettura = sqlite3.connect(percorso_db, check_same_thread=False)
+        self.conn_lettura.row_factory = sqlite3.Row
+        self._applica_profilo_storage(self.conn_lettura)
+        self.conn_lettura.execute(query.PRAGMA_SOLA_LETTURA)
+        self._lock_lettura = threading.Lock()
         self.soglia_batch = soglia_batch
+        # età massima in secondi di un batch aperto prima della chiusura forzata
+        self.soglia_tempo_batch = soglia_tempo_batch
+        # Cache in memoria del percorso di ingestione (il fog node è l'unico scrittore del DB):
+        # - insieme dei sensori registrati
+        # - batch aperto: {"id_batch", "numero_misurazioni", "timestamp_creazione"} oppure None
+        # La cache viene aggiornata solo dopo il commit delle modifiche corrispondenti
+        self._sensori_registrati: set[str] = set()
+        self._batch_attivo: dict | None = None
+        # True se l'ultimo caricamento della cache è fallito: va ricaricata prima del prossimo uso
+        self._cache_da_ricaricare = False
+        self._carica_cache()
+        # funzioni invocate con l'ID di ogni batch chiuso (per soglia o per tempo),
+        # dopo il commit della chiusura: alimentano la pipeline di elaborazione
+        self._ascoltatori_batch_chiusi: list[Callable[[int], None]] = []
+
+    def _applica_profilo_storage(self, conn: sqlite3.Connection) -> None:
+        """
+        Applica alla connessione i PRAGMA del profilo di storage configurato.
+        """
+        try:
+            conn.execute(query.PRAGMA_JOURNAL_MODE.format(str(self.profilo_storage["journal_mode"])))
+            conn.execute(query.PRAGMA_SYNCHRONOUS.format(str(self.profilo_storage["synchronous"])))
+            conn.execute(query.PRAGMA_MMAP_SIZE.format(int(self.profilo_storage["mmap_size"])))
+            conn.execute(query.PRAGMA_CACHE_SIZE.format(int(self.profilo_storage["cache_size"])))
+        except sqlite3.Error as e:
+            logger.error(f"QUERY - PROFILO STORAGE] {e}")
+
+    def _carica_cache(self) -> bool:
+        """
+        Carica (o ricarica) dal database l'insieme dei sensori registrati e lo stato
+        del batch aperto. Invocato all'avvio e dopo ogni transazione annullata.
+        In caso di errore la cache precedente resta invariata ma viene marcata come
+        da ricaricare: il caricamento viene ritentato al prossimo uso (_verifica_cache).
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(query.OTTIENI_ID_SENSORI)
+            sensori_registrati = {riga["id_sensore"] for riga in cursor.fetchall()}
+            cursor.execute(query.OTTIENI_STATO_BATCH_ATTIVO)
+            riga = cursor.fetchone()
+            self._sensori_registrati = sensori_registrati
+            self._batch_attivo = dict(riga) if riga else None
+            self._cache_da_ricaricare = False
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"QUERY - CARICAMENTO CACHE] {e}")
+            self._cache_da_ricaricare = True
+            return False
+
+    def _verifica_cache(self) -> bool:
+        """
+        Ricarica la cache se l'ultimo caricamento è fallito.
+        Restituisce False se la cache non riflette il database (ricaricamento di nuovo fallito):
+        il chiamante non deve usarla e segnala l'errore.
+        """
+        if not self._cache_da_ricaricare:
+            return True
+        logger.info("[CACHE] Nuovo tentativo di caricamento della cache dal database.")
+        return self._carica_cache()
+
+    def registra_ascoltatore_batch_chiuso(self, ascoltatore: Callable[[int], None]) -> None:
+        """
+        Registra una funzione da invocare con l'ID di ogni batch appena chiuso.
+        L'ascoltatore viene chiamato nel thread che ha eseguito la chiusura
+        e non deve bloccare (es. accodare l'ID e tornare subito).
+        """
+        self._ascoltatori_batch_chiusi.append(ascoltatore)
+
+    def _notifica_batch_chiusi(self, id_batch_chiusi: list[int]) -> None:
+        for id_batch in id_batch_chiusi:
+            for ascoltatore in self._ascoltatori_batch_chiusi:
+                try:
+                    ascoltatore(id_batch)
+                except Exception as e:
+                    logger.error(f"[BATCH CHIUSO] Errore nella notifica del batch {id_batch}: {e}")
 
     def crea_tabelle(self):
         """
@@ -41,6 +134,30 @@ class GestoreDatabase:
         except sqlite3.Error as e:
             logger.error(f"QUERY - CREAZIONE TABELLE] {e}")
 
+    def applica_migrazioni(self) -> None:
+        """
+        Porta lo schema all'ultima versione applicando le migrazioni mancanti
+        (indici e modifiche successive alla creazione delle tabelle).
+        La versione raggiunta è registrata nel database tramite PRAGMA user_version.
+        Ogni versione è applicata in una transazione esplicita: se una sua istruzione fallisce,
+        nessuna istruzione della versione (né il nuovo user_version) resta applicata.
+        """
+        try:
+            versione_attuale = self.conn.execute(query.OTTIENI_VERSIONE_SCHEMA).fetchone()[0]
+            for versione, istruzioni in query.MIGRAZIONI_SCHEMA:
+                if versione <= versione_attuale:
+                    continue
+                cursor = self.conn.cursor()
+                cursor.execute(query.INIZIA_TRANSAZIONE)
+                for istruzione in istruzioni:
+                    cursor.execute(istruzione)
+                cursor.execute(query.IMPOSTA_VERSIONE_SCHEMA.format(int(versione)))
+                self.conn.commit()
+                logger.info(f"[MIGRAZIONE] Schema aggiornato alla versione {versione}")
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            logger.error(f"QUERY - MIGRAZIONE SCHEMA] {e}")
+
     def inserisci_dati_sensore(self, id_sensore: str, descrizione: str, tipo: str) -> bool:
         """
         Inserisce un nuovo sensore solo se non già presente.
@@ -49,6 +166,7 @@ class GestoreDatabase:
             cursor = self.conn.cursor()
             cursor.execute(query.INSERISCI_SENSORE, (id_sensore, descrizione, tipo))
             self.conn.commit()
+            self._sensori_registrati.add(id_sensore)
             return True
         except sqlite3.Error as e:
             logger.error(f"QUERY - INSERIMENTO SENSORE] {e}")
@@ -61,64 +179,134 @@ class GestoreDatabase:
         La misurazione viene accettata solo se il sensore esiste.
         Restituisce True se tutto va a buon fine, altrimenti False.
         """
+        esiti = self.inserisci_misurazioni_bulk([(id_sensore, dati)])
+        return bool(esiti) and esiti[0]
+
+    def inserisci_misurazioni_bulk(self, misurazioni: list[tuple[str, str]]) -> list[bool]:
+        """
+        Inserisce una lista di misurazioni (id_sensore, dati) in un'unica transazione SQLite.
+        Rispetta la soglia del batch: se la lista attraversa il confine di un batch, il batch
+        attivo viene chiuso e le misurazioni successive finiscono in un nuovo batch.
+        Esistenza dei sensori e batch aperto sono letti dalla cache in memoria:
+        il percorso di ingestione esegue solo scritture.
+        Restituisce una lista di esiti nello stesso ordine dell'input:
+        False indica una misurazione rifiutata perché il sensore non è registrato.
+        In caso di errore del database la transazione viene annullata per intero
+        e viene restituita una lista vuota (anche se la cache non può essere ricaricata).
+        """
+        if not self._verifica_cache():
+            logger.error("[INSERIMENTO MISURAZIONI BULK] Cache non disponibile, misurazioni non inserite.")
+            return []
+        # copia locale dello stato del batch: la cache viene aggiornata solo dopo il commit
+        batch_attivo = dict(self._batch_attivo) if self._batch_attivo else None
         try:
             cursor = self.conn.cursor()
-            # Controllo preventivo: il sensore deve esistere
-            cursor.execute(query.VERIFICA_ESISTENZA_SENSORE, (id_sensore,))
-            #Se il sensore non è stato ancora registrato, nessuna riga viene restituita (None in Python).
-            if cursor.fetchone() is None:
-                logger.warning(f"[MISURAZIONE RIFIUTATA] Sensore '{id_sensore}' non registrato.")
-                return False
-
-            # Recupera o crea un nuovo batch attivo
-            cursor.execute(query.OTTIENI_BATCH_ATTIVO)
-            risultato = cursor.fetchone()
-            if risultato:
-                # esiste un batch attivo
-                id_batch = risultato["id_batch"]
-                num_misurazione_attuale = risultato["numero_misurazioni"]
-            else:
-                # devo creare un batch nuovo
-                id_batch = self._crea_batch()
-                num_misurazione_attuale = 0
-
-            timestamp_locale = datetime.now().isoformat()
-            cursor.execute(
-                query.INSERISCI_MISURAZIONE,
-                (id_sensore, id_batch, dati, timestamp_locale)
-            )
-
-            # Aggiorna numero misurazioni nel batch
-            nuovo_num = num_misurazione_attuale + 1
-            cursor.execute(query.AGGIORNA_BATCH_NUM_MISURAZIONI, (nuovo_num, id_batch))
-            # Chiudi batch se soglia raggiunta
-            if nuovo_num >= self.soglia_batch:
-                cursor.execute(query.CHIUDI_BATCH, (id_batch,))
-                #quando il batch è stato chiuso questo viene marcato come completo
-                # il task di invio periodico elabora tutti i batch completo
-                # che possono essere elaborati sono stati ancora elaborati
-                logger.info(f"[BATCH CHIUSO] ID batch: {id_batch}")
-
-            # Conferma tutte le modifiche
+            esiti = []
+            id_batch_chiusi = []
+            for id_sensore, dati in misurazioni:
+                if id_sensore not in self._sensori_registrati:
+                    logger.warning(f"[MISURAZIONE RIFIUTATA] Sensore '{id_sensore}' non registrato.")
+                    esiti.append(False)
+                    continue
+                if batch_attivo is None:
+                    # crea il nuovo batch nella stessa transazione
+                    batch_attivo = self._crea_batch(cursor)
+
+                cursor.execute(
+                    query.INSERISCI_MISURAZIONE,
+                    (id_sensore, batch_attivo["id_batch"], dati, datetime.now().isoformat())
+                )
+                batch_attivo["numero_misurazioni"] += 1
+                esiti.append(True)
+                if batch_attivo["numero_misurazioni"] >= self.soglia_batch:
+                    cursor.execute(query.CHIUDI_BATCH_CON_NUM_MISURAZIONI,
+                                   (batch_attivo["numero_misurazioni"], batch_attivo["id_batch"]))
+                    #quando il batch è stato chiuso questo viene marcato come completo
+                    # il task di invio periodico elabora tutti i batch completo
+                    logger.info(f"[BATCH CHIUSO] ID batch: {batch_attivo['id_batch']}")
+                    id_batch_chiusi.append(batch_attivo["id_batch"])
+                    batch_attivo = None
+
+            if batch_attivo is not None and batch_attivo != self._batch_attivo:
+                cursor.execute(query.AGGIORNA_BATCH_NUM_MISURAZIONI,
+                               (batch_attivo["numero_misurazioni"], batch_attivo["id_batch"]))
+            # Conferma tutte le modifiche in un'unica transazione
             self.conn.commit()
-            return True
+            self._batch_attivo = batch_attivo
+            self._notifica_batch_chiusi(id_batch_chiusi)
+            return esiti
         except sqlite3.Error as e:
-            logger.error(f"[QUERY - INSERIMENTO MISURAZIONE] {e}")
-            return False
+            self.conn.rollback()
+            logger.error(f"[QUERY - INSERIMENTO MISURAZIONI BULK] {e}")
+            # la cache potrebbe non riflettere più il database: viene ricaricata
+            self._carica_cache()
+            return []
+
+    def _crea_batch(self, cursor: sqlite3.Cursor) -> dict:
+        """
+        Crea un nuovo batch all'interno della transazione corrente (senza commit)
+        e ne restituisce lo stato iniziale da memorizzare nella cache.
+        Eventuali errori vengono propagati al chiamante che annulla la transazione.
+        """
+        timestamp_locale = datetime.now().isoformat()
+        cursor.execute(query.CREA_BATCH, (timestamp_locale,))
+        return {
+            "id_batch": cursor.lastrowid,
+            "numero_misurazioni": 0,
+            "timestamp_creazione": timestamp_locale
+        }
 
-    def _crea_batch(self) -> int:
+    def ottieni_stato_batch_attivo(self) -> dict:
         """
-        Crea un nuovo batch e restituisce l'ID generato.
+        Restituisce lo stato del batch attualmente aperto (letto dalla cache in memoria):
+        id_batch, numero_misurazioni, età in secondi e livello di riempimento
+        rispetto alla soglia (0.0 - 1.0). Restituisce un dizionario vuoto se non
+        esiste alcun batch aperto o in caso di errore.
         """
+        if self._batch_attivo is None:
+            return {}
+        try:
+            creazione = datetime.fromisoformat(self._batch_attivo["timestamp_creazione"])
+        except ValueError as e:
+            logger.error(f"[STATO BATCH ATTIVO] Timestamp non valido: {e}")
+            return {}
+        return {
+            "id_batch": self._batch_attivo["id_batch"],
+            "numero_misurazioni": self._batch_attivo["numero_misurazioni"],
+            "eta_secondi": (datetime.now() - creazione).total_seconds(),
+            "riempimento": self._batch_attivo["numero_misurazioni"] / self.soglia_batch
+        }
+
+    def chiudi_batch_scaduto(self) -> int | None:
+        """
+        Chiude il batch aperto se ha superato l'età massima (soglia_tempo_batch),
+        anche se non ha raggiunto la soglia di misurazioni. Un batch senza misurazioni
+        non viene chiuso. Restituisce l'ID del batch chiuso oppure None.
+        """
+        if not self._verifica_cache():
+            logger.error("[CHIUSURA BATCH SCADUTO] Cache non disponibile, controllo rimandato.")
+            return None
+        stato = self.ottieni_stato_batch_attivo()
+        if not stato or stato["numero_misurazioni"] == 0:
+            return None
+        if stato["eta_secondi"] < self.soglia_tempo_batch:
+            return None
         try:
             cursor = self.conn.cursor()
-            timestamp_locale = datetime.now().isoformat()
-            cursor.execute(query.CREA_BATCH, (timestamp_locale,))
+            cursor.execute(query.CHIUDI_BATCH_CON_NUM_MISURAZIONI,
+                           (stato["numero_misurazioni"], stato["id_batch"]))
             self.conn.commit()
-            return cursor.lastrowid
+            self._batch_attivo = None
+            logger.info(f"[BATCH CHIUSO PER TEMPO] ID batch: {stato['id_batch']} "
+                        f"({stato['numero_misurazioni']} misurazioni, {stato['eta_secondi']:.0f}s)")
+            self._notifica_batch_chiusi([stato["id_batch"]])
+            return stato["id_batch"]
         except sqlite3.Error as e:
-            logger.error(f"QUERY - CREAZIONE BATCH] {e}")
-            return -1
+            self.conn.rollback()
+            logger.error(f"QUERY - CHIUSURA BATCH SCADUTO] {e}")
+            # come nell'ingestione: la cache potrebbe non riflettere più il database
+            self._carica_cache()
+            return None
 
     def estrai_dati_batch_misurazioni(self, id_batch: int) -> list[dict]:
         """
@@ -126,9 +314,10 @@ class GestoreDatabase:
         Utile per la verifica dell'integrità e la costruzione del Merkle Tree.
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(query.ESTRAI_DATI_BATCH_MISURAZIONI, (id_batch,))
-            righe = cursor.fetchall()
+            with self._lock_lettura:
+                cursor = self.conn_lettura.cursor()
+                cursor.execute(query.ESTRAI_DATI_BATCH_MISURAZIONI, (id_batch,))
+                righe = cursor.fetchall()
             #.fetchall() restituisce una lista di sqlite3.Row, che sembrano dizionari, ma non lo sono al 100%.
             # Se ti serve una lista di dizionari veri,
             # fai righe = [dict(r) for r in cursor.fetchall()].
@@ -170,12 +359,12 @@ class GestoreDatabase:
             return False
 
 
-    def ottieni_payload_batch_pronti_per_invio(self) -> list[tuple[int, str]]:
+    def ottieni_id_batch_pronti_per_invio(self, limite: int = 1) -> list[int]:
         """
-        Metodo che viene utilizzato dalla classe che gestisce
-        il reinvio dei batch completi, il cui payload JSON è pronto per l'invio.
-        Restituisce solo i payload dei batch completi (completo = 1)
-        ma non ancora inviati (inviato = 0). Essendo esecuzioni concorrenti la connessione al database
+        Metodo che viene utilizzato dalla scansione di recupero della pipeline di invio.
+        Restituisce gli ID (al massimo `limite`) dei batch completi (completo = 1),
+        il cui payload JSON è pronto per l'invio, ma non ancora confermati dal cloud.
+        Essendo esecuzioni concorrenti la connessione al database
         potrebbe non essere stata ancora stabilita al momento dell'esecuzione del metodo.
         Se la connessione non è stata stabilita restituisce una lista vuota.
         """
@@ -183,17 +372,47 @@ class GestoreDatabase:
             logger.warning("[AVVISO] Connessione al database non attiva. Nessuna query di retry eseguita.")
             return []
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(query.OTTIENI_PAYLOAD_BATCH_PRONTI_PER_INVIO)
-            risultati = cursor.fetchall()
-            return [(r["id_batch"], r["payload_json"]) for r in risultati]
+            with self._lock_lettura:
+                cursor = self.conn_lettura.cursor()
+                cursor.execute(query.OTTIENI_ID_BATCH_PRONTI_PER_INVIO, (limite,))
+                risultati = cursor.fetchall()
+            return [r["id_batch"] for r in risultati]
         except sqlite3.Error as e:
             logger.error(f"QUERY - LETTURA BATCH NON INVIATI] {e}")
             return []
 
-    def ottieni_id_batch_completi(self) -> list[int]:
+    def ottieni_payload_batch_pronto_per_invio(self, id_batch: int) -> str | None:
+        """
+        Restituisce il payload JSON del batch se è pronto per l'invio
+        (elaborato, non confermato, sensori tutti confermati dal cloud), altrimenti None.
+        """
+        try:
+            with self._lock_lettura:
+                cursor = self.conn_lettura.cursor()
+                cursor.execute(query.OTTIENI_PAYLOAD_BATCH_PRONTO_PER_INVIO, (id_batch,))
+                riga = cursor.fetchone()
+            return riga["payload_json"] if riga else None
+        except sqlite3.Error as e:
+            logger.error(f"QUERY - LETTURA PAYLOAD BATCH {id_batch}] {e}")
+            return None
+
+    def batch_da_elaborare(self, id_batch: int) -> bool:
+        """
+        True se il batch è ancora da elaborare (completo, elaborabile, senza Merkle Root né payload).
+        In caso di errore restituisce False: il batch sarà ripreso dalla scansione di recupero.
+        """
+        try:
+            with self._lock_lettura:
+                cursor = self.conn_lettura.cursor()
+                cursor.execute(query.VERIFICA_BATCH_DA_ELABORARE, (id_batch,))
+                return cursor.fetchone() is not None
+        except sqlite3.Error as e:
+            logger.error(f"QUERY - VERIFICA BATCH DA ELABORARE {id_batch}] {e}")
+            return False
+
+    def ottieni_id_batch_completi(self, limite: int = 1) -> list[int]:
         """
-        Restituisce tutti i batch completi (completi = 1) che necessitano di elaborazione:
+        Restituisce i batch completi (completi = 1), al massimo `limite`, che necessitano di elaborazione:
         aggregazione, creazione merkle tree ecc e che non sono ancora stati inviati (inviato = 0).
         Se la connessione al database non è disponibile, restituisce una lista vuota
         senza sollevare eccezioni. Metodo che viene utilizzato dalla classe che gestisce
@@ -203,9 +422,10 @@ class GestoreDatabase:
             logger.warning("[AVVISO] Connessione al database non attiva. Nessuna query di retry eseguita.")
             return []
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(query.OTTIENI_ID_BATCH_COMPLETI_DA_ELABORARE)
-            risultati = cursor.fetchall()
+            with self._lock_lettura:
+                cursor = self.conn_lettura.cursor()
+                cursor.execute(query.OTTIENI_ID_BATCH_COMPLETI_DA_ELABORARE, (limite,))
+                risultati = cursor.fetchall()
             #estrai solo i primi elementi e li inserisci in una lista
             return list(riga[0] for riga in risultati)
         except sqlite3.Error as e:
@@ -222,22 +442,28 @@ class GestoreDatabase:
             logger.warning("[AVVISO] Connessione al database non attiva. Nessuna query di retry eseguita.")
             return []
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(query.OTTIENI_SENSORI_NON_CONFERMA_RICEZIONE)
-            righe = cursor.fetchall()
+            with self._lock_lettura:
+                cursor = self.conn_lettura.cursor()
+                cursor.execute(query.OTTIENI_SENSORI_NON_CONFERMA_RICEZIONE)
+                righe = cursor.fetchall()
             return [{"id_sensore": r["id_sensore"], "descrizione": r["descrizione"]} for r in righe]
         except sqlite3.Error as e:
             logger.error(f"[DB] Errore durante l'estrazione dei sensori non confermati: {e}")
             return []
 
 
-    def aggiorna_batch_errore_elaborazione(self, id_batch: int, messaggio_errore: str, tipo_errore: str) -> None:
+    def aggiorna_batch_errore_elaborazione(self, id_batch: int, messaggio_errore: str, tipo_errore: str,
+                                           solo_se_non_elaborato: bool = False) -> None:
         """
-        Segna un batch come impossibile da elaborare in seguito a errore grave
+        Segna un batch come impossibile da elaborare in seguito a errore grave.
+        Con solo_se_non_elaborato il batch viene segnato solo se non ha ancora una Merkle Root
+        (errori che precedono il salvataggio dei metadata, come quelli IPFS).
         """
+        istruzione = (query.AGGIORNA_ERRORE_ELABORAZIONE_BATCH_NON_ELABORATO if solo_se_non_elaborato
+                      else query.AGGIORNA_ERRORE_ELABORAZIONE_BATCH)
         try:
             cursor = self.conn.cursor()
-            cursor.execute(query.AGGIORNA_ERRORE_ELABORAZIONE_BATCH, (messaggio_errore, tipo_errore, id_batch))
+            cursor.execute(istruzione, (messaggio_errore, tipo_errore, id_batch))
             self.conn.commit()
             logger.debug(f"Batch {id_batch} marcato come non elaborabile. Errore: {tipo_errore}")
         except sqlite3.Error as e:
@@ -289,6 +515,7 @@ class GestoreDatabase:
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='misurazione_in_ingresso'")
             cursor.execute("DELETE FROM sqlite_sequence WHERE name='batch'")
             self.conn.commit()
+            self._carica_cache()
             logger.info("Tabelle svuotate e contatori ID resettati.")
         except sqlite3.Error as e:
             logger.error(f"QUERY - SVUOTAMENTO TABELLE] {e}")
@@ -305,13 +532,17 @@ class GestoreDatabase:
             cursor.execute("DROP TABLE IF EXISTS batch")
             cursor.execute("DROP TABLE IF EXISTS sensore")
             self.conn.commit()
+            self._sensori_registrati = set()
+            self._batch_attivo = None
             logger.info("Tutte le tabelle sono state eliminate.")
         except sqlite3.Error as e:
             logger.error(f"QUERY - DROP TABELLE] {e}")
 
     def chiudi_connessione(self) -> None:
-        """Chiude la connessione al database, se ancora aperta."""
+        """Chiude le connessioni (scrittura e lettura) al database, se ancora aperte."""
         try:
+            if self.conn_lettura:
+                self.conn_lettura.close()
             if self.conn:
                 self.conn.close()
                 logger.info("Connessione al database chiusa correttamente.")
@@ -1,6 +1,15 @@
 # Abilita i vincoli di integrità referenziale in SQLite (obbligatorio per usare FOREIGN KEY)
 PRAGMA_FK = "PRAGMA foreign_keys = ON"
 
+# PRAGMA del profilo di storage (i valori non possono essere parametri: vengono formattati
+# a partire dal profilo configurato in GestoreDatabase)
+PRAGMA_JOURNAL_MODE = "PRAGMA journal_mode = {}"
+PRAGMA_SYNCHRONOUS = "PRAGMA synchronous = {}"
+PRAGMA_MMAP_SIZE = "PRAGMA mmap_size = {}"
+PRAGMA_CACHE_SIZE = "PRAGMA cache_size = {}"
+# Impedisce qualsiasi scrittura dalla connessione dedicata alle letture
+PRAGMA_SOLA_LETTURA = "PRAGMA query_only = ON"
+
 # Crea la tabella dei sensori registrati localmente.
 # Il campo `conferma_ricezione` indica se il sensore è stato confermato dal cloud provider (0 = no, 1 = sì).
 # È fondamentale per evitare problemi di integrità referenziale: se un sensore non è confermato,
@@ -52,10 +61,44 @@ CREA_TABELLA_MISURAZIONE = """
     )
 """
 
-# Controlla se esiste già un sensore con l'id specificato
-VERIFICA_ESISTENZA_SENSORE = """
-SELECT 1 FROM sensore 
-WHERE id_sensore = ?
+#--------------------------------#
+# MIGRAZIONI DELLO SCHEMA
+#--------------------------------#
+
+# Versione dello schema memorizzata nel file del database (0 = schema iniziale senza indici)
+OTTIENI_VERSIONE_SCHEMA = "PRAGMA user_version"
+IMPOSTA_VERSIONE_SCHEMA = "PRAGMA user_version = {}"
+# apertura esplicita della transazione di una migrazione: sqlite3 (modalità legacy) non apre
+# una transazione implicita prima di CREATE INDEX o PRAGMA, che resterebbero applicati
+# anche se un'istruzione successiva della stessa versione fallisse
+INIZIA_TRANSAZIONE = "BEGIN"
+
+"""
+Elenco ordinato delle migrazioni: (versione, istruzioni). All'avvio GestoreDatabase applica,
+ognuna in una propria transazione, tutte le migrazioni con versione maggiore di quella
+registrata nel database. Le nuove migrazioni vanno solo AGGIUNTE in coda.
+Versione 1:
+- indice su misurazione(id_batch, id_sensore): ricerca delle misurazioni di un batch
+  e controllo dei sensori non confermati senza leggere la tabella
+- indice parziale sui batch completi ancora da elaborare/inviare, usato dalle query di polling
+"""
+MIGRAZIONI_SCHEMA = [
+    (1, [
+        """
+        CREATE INDEX IF NOT EXISTS idx_misurazione_batch_sensore
+        ON misurazione (id_batch, id_sensore)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_batch_da_elaborare
+        ON batch (id_batch)
+        WHERE completo = 1 AND conferma_ricezione = 0 AND elaborabile = 1
+        """,
+    ]),
+]
+
+# Restituisce gli id di tutti i sensori registrati (caricamento della cache all'avvio)
+OTTIENI_ID_SENSORI = """
+    SELECT id_sensore FROM sensore
 """
 
 # Inserisce un nuovo sensore, ignorando la richiesta se l'ID è già presente
@@ -77,19 +120,20 @@ AGGIORNA_BATCH_NUM_MISURAZIONI = """
     WHERE id_batch = ?
 """
 
-# Restituisce l’ultimo batch attivo (non completo), da usare per nuove misurazioni
-OTTIENI_BATCH_ATTIVO = """
-    SELECT id_batch, numero_misurazioni
+# Restituisce lo stato del batch attivo (non completo): riempimento e istante di creazione,
+# usato per caricare la cache del batch aperto all'avvio
+OTTIENI_STATO_BATCH_ATTIVO = """
+    SELECT id_batch, numero_misurazioni, timestamp_creazione
     FROM batch
     WHERE completo = 0
     ORDER BY id_batch DESC
     LIMIT 1
 """
 
-# Chiude un batch (completo = 1)
-CHIUDI_BATCH = """
+# Chiude un batch registrando contestualmente il numero finale di misurazioni
+CHIUDI_BATCH_CON_NUM_MISURAZIONI = """
     UPDATE batch
-    SET completo = 1
+    SET completo = 1, numero_misurazioni = ?
     WHERE id_batch = ?
 """
 
@@ -135,10 +179,21 @@ ESTRAI_DATI_BATCH_MISURAZIONI = """
 # del batch)
 AGGIORNA_ERRORE_ELABORAZIONE_BATCH = """
     UPDATE batch
-    SET elaborabile = ?,
+    SET elaborabile = 0,
+        messaggio_errore = ?,
+        tipo_errore = ?
+    WHERE id_batch = ?
+"""
+
+# Come AGGIORNA_ERRORE_ELABORAZIONE_BATCH, ma solo se il batch non ha ancora una Merkle Root:
+# un errore di un'elaborazione ripetuta non blocca l'invio di un batch già elaborato correttamente
+AGGIORNA_ERRORE_ELABORAZIONE_BATCH_NON_ELABORATO = """
+    UPDATE batch
+    SET elaborabile = 0,
         messaggio_errore = ?,
         tipo_errore = ?
     WHERE id_batch = ?
+    AND (merkle_root IS NULL OR merkle_root = '')
 """
 
 #Salva il merkle root, il cid IPFS e il payload JSON di un batch correttamente
@@ -158,22 +213,41 @@ Seleziona i batch completi (hanno raggiunto la soglia di misurazioni massime pre
 che necessitano di elaborazioni:
 (elaborabile=1) e merkle_root e/o payload_json nulli
 (significa che il batch deve ancora attraversare la pipeline di elaborazione)
+Il numero massimo di batch restituiti è un parametro: più batch possono essere elaborati in parallelo.
+La condizione sulle misurazioni è espressa con EXISTS (basta trovarne una tramite
+l'indice su misurazione(id_batch)) invece di una JOIN + DISTINCT su tutte le righe;
+i filtri sullo stato del batch sono coperti dall'indice parziale idx_batch_da_elaborare.
 """
 OTTIENI_ID_BATCH_COMPLETI_DA_ELABORARE = """
-    SELECT DISTINCT b.id_batch
+    SELECT b.id_batch
     FROM batch b
-    INNER JOIN misurazione m ON b.id_batch = m.id_batch
     WHERE b.completo = 1
     AND b.conferma_ricezione = 0
     AND b.elaborabile = 1
     AND (b.merkle_root IS NULL OR b.merkle_root = '')
     AND (b.payload_json IS NULL OR b.payload_json = '')
+    AND EXISTS (
+        SELECT 1 FROM misurazione m WHERE m.id_batch = b.id_batch
+    )
     ORDER BY b.id_batch ASC
-    LIMIT 1;
+    LIMIT ?;
+"""
+
+# Verifica che un singolo batch sia ancora da elaborare (stesse condizioni di
+# OTTIENI_ID_BATCH_COMPLETI_DA_ELABORARE): controllata al prelievo dalla coda di elaborazione
+VERIFICA_BATCH_DA_ELABORARE = """
+    SELECT 1
+    FROM batch b
+    WHERE b.id_batch = ?
+    AND b.completo = 1
+    AND b.conferma_ricezione = 0
+    AND b.elaborabile = 1
+    AND (b.merkle_root IS NULL OR b.merkle_root = '')
+    AND (b.payload_json IS NULL OR b.payload_json = '')
 """
 
 """
-Restituisce i batch pronti per l’invio: 
+Restituisce gli ID dei batch pronti per l’invio (al massimo il limite passato come parametro): 
 - payload_json presente,
 - ancora non confermati (conferma_ricezione = 0)
 - non corrotti/errori gravi durante la pipeline (elaborabile = 1)
@@ -189,19 +263,48 @@ un errore durante la elaborazione il batch è marcato come non elaborabile e la
 ne impedisce l'invio del payload JSON. Per evitare violazioni ai vincoli di integrità referenziale lato
 cloud, è possibile inviare il payload di un batch solo se i sensori che hanno eseguito le misurazioni
 sono stati registrati dal cloud (conferma_ricezione di sensore). Se così non fosse si creerebbero errori
-a cascata.
+a cascata. La condizione è espressa con NOT EXISTS: il batch è escluso se anche una sola delle sue
+misurazioni proviene da un sensore non ancora confermato (ricerca coperta dall'indice
+misurazione(id_batch, id_sensore)).
 """
-OTTIENI_PAYLOAD_BATCH_PRONTI_PER_INVIO = """
-    SELECT b.id_batch, b.payload_json   
+OTTIENI_ID_BATCH_PRONTI_PER_INVIO = """
+    SELECT b.id_batch
     FROM batch as b
-    INNER JOIN misurazione as m ON b.id_batch = m.id_batch
-    INNER JOIN sensore as s ON m.id_sensore = s.id_sensore
-    WHERE payload_json IS NOT NULL
+    WHERE b.completo = 1
+    AND b.payload_json IS NOT NULL
     AND b.conferma_ricezione = 0
-    AND elaborabile = 1
-    AND s.conferma_ricezione = 1
+    AND b.elaborabile = 1
+    AND NOT EXISTS (
+        SELECT 1
+        FROM misurazione as m
+        INNER JOIN sensore as s ON m.id_sensore = s.id_sensore
+        WHERE m.id_batch = b.id_batch
+        AND s.conferma_ricezione = 0
+    )
     ORDER BY b.id_batch ASC
-    LIMIT 1
+    LIMIT ?
+"""
+
+"""
+Restituisce il payload JSON di un singolo batch se è pronto per l'invio
+(stesse condizioni di OTTIENI_ID_BATCH_PRONTI_PER_INVIO). Usata dalla pipeline
+di invio, che riceve gli ID dei batch appena elaborati.
+"""
+OTTIENI_PAYLOAD_BATCH_PRONTO_PER_INVIO = """
+    SELECT b.payload_json
+    FROM batch as b
+    WHERE b.id_batch = ?
+    AND b.completo = 1
+    AND b.payload_json IS NOT NULL
+    AND b.conferma_ricezione = 0
+    AND b.elaborabile = 1
+    AND NOT EXISTS (
+        SELECT 1
+        FROM misurazione as m
+        INNER JOIN sensore as s ON m.id_sensore = s.id_sensore
+        WHERE m.id_batch = b.id_batch
+        AND s.conferma_ricezione = 0
+    )
 """
 
 """
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+from database.gestore_db import GestoreDatabase
+
+logger = logging.getLogger(__name__)
+
+"""
+Scrittore con group-commit per l'ingestione delle misurazioni.
+Le misurazioni ricevute dagli endpoint vengono accodate in memoria; un unico task
+scrittore le raccoglie e le salva con una sola transazione SQLite (un solo commit/fsync)
+ogni `intervallo_ms` millisecondi oppure appena ne ha accumulate `max_righe`.
+Il chiamante riceve l'esito solo dopo il commit della transazione che contiene la sua
+misurazione: la garanzia di durabilità resta quella dell'inserimento singolo.
+"""
+class ScrittoreGruppo:
+    def __init__(self, gestore_db: GestoreDatabase, max_righe: int = 256, intervallo_ms: float = 5):
+        self.gestore_db = gestore_db
+        self.max_righe = max_righe
+        self.intervallo = intervallo_ms / 1000
+        # elementi in coda: (id_sensore, dati, future da risolvere dopo il commit)
+        self._coda: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def avvia(self) -> None:
+        """Avvia il task scrittore. Va invocato dall'interno dell'event loop."""
+        if self._task is None:
+            self._coda = asyncio.Queue()
+            self._task = asyncio.create_task(self._ciclo_scrittura())
+            logger.info(f"[GROUP-COMMIT] Scrittore avviato (max {self.max_righe} righe, "
+                        f"{self.intervallo * 1000:.0f} ms)")
+
+    async def arresta(self) -> None:
+        """Salva le misurazioni ancora in coda e arresta il task scrittore."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # svuota la coda residua con un ultimo commit
+        residui = []
+        while not self._coda.empty():
+            residui.append(self._coda.get_nowait())
+        if residui:
+            self._scrivi(residui)
+        logger.info("[GROUP-COMMIT] Scrittore arrestato.")
+
+    async def inserisci(self, id_sensore: str, dati: str) -> bool:
+        """
+        Accoda una misurazione e attende il commit della transazione che la contiene.
+        Restituisce True se la misurazione è stata salvata, False altrimenti
+        (sensore non registrato o errore del database).
+        """
+        if self._task is None or self._task.done():
+            # scrittore non attivo (o terminato): inserimento diretto, nessuno leggerebbe la coda
+            if self._task is not None:
+                logger.error("[GROUP-COMMIT] Task scrittore terminato: inserimento diretto.")
+            return self.gestore_db.inserisci_misurazione(id_sensore, dati)
+        future = asyncio.get_running_loop().create_future()
+        await self._coda.put((id_sensore, dati, future))
+        return await future
+
+    async def _ciclo_scrittura(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            gruppo = []
+            try:
+                # attende la prima misurazione, poi raccoglie le successive fino alla scadenza
+                gruppo.append(await self._coda.get())
+                scadenza = loop.time() + self.intervallo
+                while len(gruppo) < self.max_righe:
+                    attesa = scadenza - loop.time()
+                    if attesa <= 0:
+                        break
+                    try:
+                        gruppo.append(await asyncio.wait_for(self._coda.get(), attesa))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # arresto durante la raccolta: le misurazioni già prelevate vanno comunque salvate
+                if gruppo:
+                    self._scrivi(gruppo)
+                raise
+            self._scrivi(gruppo)
+
+    def _scrivi(self, gruppo: list) -> None:
+        """
+        Salva un gruppo di misurazioni in un'unica transazione e risolve le future.
+        Non solleva eccezioni: un errore inatteso viene registrato e tutte le misurazioni
+        del gruppo risultano non salvate, così il task scrittore resta attivo.
+        """
+        try:
+            esiti = self.gestore_db.inserisci_misurazioni_bulk(
+                [(id_sensore, dati) for id_sensore, dati, _ in gruppo])
+            logger.debug(f"[GROUP-COMMIT] Commit di {len(gruppo)} misurazioni")
+        except Exception as e:
+            logger.error(f"[GROUP-COMMIT] Errore nel salvataggio di {len(gruppo)} misurazioni: {e}")
+            esiti = []
+        if not esiti:
+            # errore del database: l'intera transazione è stata annullata
+            esiti = [False] * len(gruppo)
+        for (_, _, future), esito in zip(gruppo, esiti):
+            if not future.done():
+                future.set_result(esito)
@@ -2,14 +2,17 @@ import asyncio
 import logging
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Union, Annotated
+from typing import Union, Annotated, List, Any, Dict
 
 import uvicorn
 from fastapi import FastAPI, HTTPException, Body
+from pydantic import Field, TypeAdapter, ValidationError
 
 from Classi_comuni.entita.modelli_dati import DatiSensore
-from config.costanti_produttore import SOGLIA_BATCH
+from config.costanti_produttore import SOGLIA_BATCH, SOGLIA_TEMPO_BATCH, MAX_MISURAZIONI_BULK, \
+    GROUP_COMMIT_MAX_RIGHE, GROUP_COMMIT_INTERVALLO_MS
 from database.gestore_db import GestoreDatabase
+from database.scrittore_gruppo import ScrittoreGruppo
 # Import dei modelli di misurazione_in_ingresso specifici
 # i modelli di misurazione in ingresso servono solo al fog node e non al cloud provider
 from misurazioni_in_ingresso import MisurazioneInIngressoJoystick, MisurazioneInIngressoTemperatura
@@ -23,17 +26,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.CRITICAL)
 
-# Istanza del database (con soglia per batch)
-gestore_db = GestoreDatabase(soglia_batch=SOGLIA_BATCH)
+# Istanza del database (con soglia per batch: numero di misurazioni o età massima)
+gestore_db = GestoreDatabase(soglia_batch=SOGLIA_BATCH, soglia_tempo_batch=SOGLIA_TEMPO_BATCH)
+# Scrittore con group-commit per le misurazioni singole
+scrittore = ScrittoreGruppo(gestore_db, max_righe=GROUP_COMMIT_MAX_RIGHE, intervallo_ms=GROUP_COMMIT_INTERVALLO_MS)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Avvio dei task periodici per invio dati sensori, invio payload al cloud,"
                 "elaborazione dei batch completi")
     asyncio.create_task(avvia_task_periodici(gestore_db))
+    scrittore.avvia()
     yield  # Applicazione avviata
     #operazioni da effettuare alla terminazione dell'applicazione
     logger.info("Chiusura dell'applicazione: chiusura connessione al DB.")
+    await scrittore.arresta()
     gestore_db.chiudi_connessione()
 
 # Istanzia l'app FastAPI con supporto al lifecycle
@@ -74,7 +81,8 @@ async def registra_misurazione(misurazione: MisurazioneInIngresso):
     #estraggo un dizionario contenente solo i dati effettivi dalla misurazione separandolo dai metadata
     dati = misurazione.estrai_dati_misurazione()
     logger.debug(f"Misurazione ricevuta dal sensore {id_sensore}: {dati}")
-    successo_operazione = gestore_db.inserisci_misurazione(id_sensore=id_sensore, dati=dati)
+    # la risposta viene inviata solo dopo il commit del gruppo che contiene la misurazione
+    successo_operazione = await scrittore.inserisci(id_sensore=id_sensore, dati=dati)
     if not successo_operazione:
         logger.error("Errore nella memorizzazione della misurazione del sensore", exc_info=True)
         raise HTTPException(
@@ -89,6 +97,64 @@ async def registra_misurazione(misurazione: MisurazioneInIngresso):
     }
     return risposta
 
+"""
+Validatore della singola misurazione usato dall'endpoint bulk: stesso discriminatore "tipo"
+dell'endpoint /misurazioni, ma applicato elemento per elemento, così che una misurazione
+non valida non faccia rifiutare l'intera richiesta.
+"""
+validatore_misurazione = TypeAdapter(
+    Annotated[Union[MisurazioneInIngressoJoystick, MisurazioneInIngressoTemperatura],
+              Field(discriminator="tipo")]
+)
+@app.post("/misurazioni/bulk", summary="Registra un insieme di misurazioni", response_model=dict)
+async def registra_misurazioni_bulk(misurazioni: List[Dict[str, Any]] = Body(...)):
+    """
+    Endpoint per ricevere in una sola richiesta un array di misurazioni (joystick e temperatura),
+    ad esempio accumulate da un microcontrollore rimasto offline.
+    Le misurazioni valide vengono salvate in un'unica transazione, rispettando la soglia del batch.
+    Restituisce l'esito di ogni elemento nello stesso ordine dell'array ricevuto.
+    """
+    if len(misurazioni) > MAX_MISURAZIONI_BULK:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Troppe misurazioni nella richiesta (massimo {MAX_MISURAZIONI_BULK})."
+        )
+
+    esiti: list[dict] = []
+    # posizione nell'array ricevuto -> (id_sensore, dati) delle sole misurazioni valide
+    da_inserire: list[tuple[int, tuple[str, str]]] = []
+    for indice, elemento in enumerate(misurazioni):
+        try:
+            misurazione = validatore_misurazione.validate_python(elemento)
+        except ValidationError as e:
+            esiti.append({"indice": indice, "sensore": elemento.get("id_sensore"),
+                          "esito": "non valida", "errore": e.errors(include_url=False, include_input=False)})
+            continue
+        id_sensore = misurazione.id_sensore.upper()
+        esiti.append({"indice": indice, "sensore": id_sensore, "esito": None})
+        da_inserire.append((indice, (id_sensore, misurazione.estrai_dati_misurazione())))
+
+    if da_inserire:
+        risultati = gestore_db.inserisci_misurazioni_bulk([m for _, m in da_inserire])
+        if not risultati:
+            logger.error("Errore nella memorizzazione delle misurazioni bulk")
+            raise HTTPException(
+                status_code=500,
+                detail="Errore nella memorizzazione delle misurazioni."
+            )
+        for (indice, _), registrata in zip(da_inserire, risultati):
+            esiti[indice]["esito"] = "registrata" if registrata else "sensore non registrato"
+
+    registrate = sum(1 for e in esiti if e["esito"] == "registrata")
+    return {
+        "status": "misurazioni in ingresso elaborate",
+        "ricevute": len(misurazioni),
+        "registrate": registrate,
+        "rifiutate": len(misurazioni) - registrate,
+        "esiti": esiti,
+        "timestamp_iso": datetime.now().isoformat()
+    }
+
 
 def main():
     uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+
+from config.costanti_produttore import ENDPOINT_CLOUD_BATCH, PROFONDITA_CODA_PIPELINE, NUM_PROCESSI_ELABORAZIONE, \
+    CONCORRENZA_INVIO
+from database.gestore_db import GestoreDatabase
+from utils.fog_api_utils import gestisci_batch_completo_async, invia_payload_async
+
+logger = logging.getLogger(__name__)
+
+"""
+Pipeline dei batch guidata da eventi.
+Un batch chiuso (per soglia di misurazioni o per tempo) viene notificato da GestoreDatabase
+e accodato subito per l'elaborazione (payload, Merkle Tree, IPFS); al termine dell'elaborazione
+viene accodato per l'invio al cloud. Le code hanno capienza limitata (profondita_coda):
+se una coda è piena il batch non viene perso, resta nel DB e viene ripreso dalla
+scansione di recupero, che drena l'arretrato a blocchi di profondita_coda batch.
+Gli ID già presenti in una coda (o in lavorazione) non vengono accodati una seconda volta;
+un ID riaccodato dopo la fine della sua elaborazione viene scartato al prelievo
+(il batch risulta già elaborato nel DB).
+"""
+class PipelineBatch:
+    def __init__(self, gestore_db: GestoreDatabase, esecutore_cpu: Executor, esecutore_io: Executor,
+                 profondita_coda: int = PROFONDITA_CODA_PIPELINE,
+                 num_elaboratori: int = NUM_PROCESSI_ELABORAZIONE,
+                 num_inviatori: int = CONCORRENZA_INVIO):
+        self.gestore_db = gestore_db
+        self.esecutore_cpu = esecutore_cpu
+        self.esecutore_io = esecutore_io
+        self.profondita_coda = profondita_coda
+        self.num_elaboratori = num_elaboratori
+        self.num_inviatori = num_inviatori
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._coda_elaborazione: asyncio.Queue | None = None
+        self._coda_invio: asyncio.Queue | None = None
+        # ID accodati o in lavorazione in ciascuna fase
+        self._in_elaborazione: set[int] = set()
+        self._in_invio: set[int] = set()
+        self._task: list[asyncio.Task] = []
+        # True se l'ultimo invio al cloud è fallito (cloud non raggiungibile)
+        self.invio_in_errore = False
+        # numero di batch elaborati o inviati con successo: indica se la pipeline avanza
+        self.batch_avanzati = 0
+
+    def avvia(self) -> None:
+        """
+        Crea le code, avvia i worker e si registra per le notifiche di chiusura dei batch.
+        Va invocato dall'interno dell'event loop.
+        """
+        if self._task:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._coda_elaborazione = asyncio.Queue(maxsize=self.profondita_coda)
+        self._coda_invio = asyncio.Queue(maxsize=self.profondita_coda)
+        self._task = [asyncio.create_task(self._worker_elaborazione()) for _ in range(self.num_elaboratori)]
+        # più invii in parallelo sulla sessione HTTP condivisa (connessioni keep-alive)
+        self._task += [asyncio.create_task(self._worker_invio()) for _ in range(self.num_inviatori)]
+        self.gestore_db.registra_ascoltatore_batch_chiuso(self._su_batch_chiuso)
+        logger.info(f"[PIPELINE] Avviata ({self.num_elaboratori} elaboratori, {self.num_inviatori} inviatori, "
+                    f"profondità code {self.profondita_coda})")
+
+    async def arresta(self) -> None:
+        for task in self._task:
+            task.cancel()
+        await asyncio.gather(*self._task, return_exceptions=True)
+        self._task = []
+        logger.info("[PIPELINE] Arrestata.")
+
+    def _su_batch_chiuso(self, id_batch: int) -> None:
+        # può essere invocato da qualunque thread: l'accodamento avviene nell'event loop
+        self._loop.call_soon_threadsafe(self.accoda_elaborazione, id_batch)
+
+    def accoda_elaborazione(self, id_batch: int) -> bool:
+        """
+        Accoda un batch per l'elaborazione. Restituisce False se il batch è già in coda
+        o se la coda è piena (in tal caso sarà ripreso dalla scansione di recupero).
+        """
+        return self._accoda(self._coda_elaborazione, self._in_elaborazione, id_batch, "elaborazione")
+
+    def accoda_invio(self, id_batch: int) -> bool:
+        """Accoda un batch elaborato per l'invio al cloud (stesse regole di accoda_elaborazione)."""
+        return self._accoda(self._coda_invio, self._in_invio, id_batch, "invio")
+
+    @staticmethod
+    def _accoda(coda: asyncio.Queue, in_corso: set[int], id_batch: int, fase: str) -> bool:
+        if id_batch in in_corso:
+            return False
+        try:
+            coda.put_nowait(id_batch)
+        except asyncio.QueueFull:
+            logger.debug(f"[PIPELINE] Coda di {fase} piena: batch {id_batch} rimandato al recupero")
+            return False
+        in_corso.add(id_batch)
+        return True
+
+    async def recupera(self) -> int:
+        """
+        Scansione di recupero: accoda i batch rimasti indietro (riavvio, code piene,
+        errori di rete, sensori confermati in ritardo) fino a riempire le code.
+        Restituisce il numero di batch accodati.
+        """
+        loop = asyncio.get_running_loop()
+        da_elaborare = await loop.run_in_executor(
+            self.esecutore_io, self.gestore_db.ottieni_id_batch_completi, self.profondita_coda)
+        da_inviare = await loop.run_in_executor(
+            self.esecutore_io, self.gestore_db.ottieni_id_batch_pronti_per_invio, self.profondita_coda)
+        accodati = sum(self.accoda_elaborazione(id_batch) for id_batch in da_elaborare)
+        accodati += sum(self.accoda_invio(id_batch) for id_batch in da_inviare)
+        if accodati:
+            logger.info(f"[PIPELINE] Recupero: {accodati} batch accodati "
+                        f"(elaborazione={self._coda_elaborazione.qsize()}, invio={self._coda_invio.qsize()})")
+        return accodati
+
+    async def attendi_code_vuote(self) -> None:
+        """Attende che tutti i batch accodati siano stati elaborati e inviati (o scartati)."""
+        await self._coda_elaborazione.join()
+        await self._coda_invio.join()
+
+    async def _worker_elaborazione(self) -> None:
+        while True:
+            id_batch = await self._coda_elaborazione.get()
+            try:
+                logger.debug(f"[BATCH-ELAB] INIZIO ELABORAZIONE batch {id_batch}...")
+                if await gestisci_batch_completo_async(id_batch, self.gestore_db,
+                                                       self.esecutore_cpu, self.esecutore_io):
+                    self.batch_avanzati += 1
+                    self.accoda_invio(id_batch)
+                else:
+                    logger.debug(f"[BATCH-ELAB] Elaborazione batch {id_batch} FALLITA")
+            except Exception as e:
+                logger.error(f"[BATCH-ELAB] Errore durante elaborazione batch {id_batch}: {e}")
+            finally:
+                self._in_elaborazione.discard(id_batch)
+                self._coda_elaborazione.task_done()
+
+    async def _worker_invio(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            id_batch = await self._coda_invio.get()
+            try:
+                payload_json = await loop.run_in_executor(
+                    self.esecutore_io, self.gestore_db.ottieni_payload_batch_pronto_per_invio, id_batch)
+                if payload_json is None:
+                    # sensori non ancora confermati dal cloud: sarà ripreso dal recupero
+                    logger.debug(f"[BATCH-JSON] Batch {id_batch} non ancora pronto per l'invio")
+                    continue
+                logger.debug(f"[BATCH-JSON] Tentativo invio id_batch={id_batch}...")
+                # il payload JSON salvato nel DB viene inviato così com'è, senza essere ricostruito
+                if await invia_payload_async(payload_json, ENDPOINT_CLOUD_BATCH, self.gestore_db, self.esecutore_io):
+                    logger.info(f"[BATCH-JSON] Inviato correttamente id_batch={id_batch}")
+                    self.invio_in_errore = False
+                    self.batch_avanzati += 1
+                else:
+                    logger.warning(f"[BATCH-JSON] Invio fallito per id_batch={id_batch}")
+                    self.invio_in_errore = True
+                    # cloud non raggiungibile: inutile tentare i batch successivi,
+                    # verranno riaccodati dalla prossima scansione di recupero
+                    self._svuota_coda_invio()
+            except Exception as e:
+                logger.error(f"[BATCH-JSON] Errore invio id_batch={id_batch}: {e}")
+            finally:
+                self._in_invio.discard(id_batch)
+                self._coda_invio.task_done()
+
+    def _svuota_coda_invio(self) -> None:
+        while not self._coda_invio.empty():
+            self._in_invio.discard(self._coda_invio.get_nowait())
+            self._coda_invio.task_done()
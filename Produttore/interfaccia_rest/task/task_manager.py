@@ -1,84 +1,106 @@
 import asyncio
-import json
 import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
-from config.costanti_produttore import ENDPOINT_CLOUD_SENSORI, ENDPOINT_CLOUD_BATCH
+from config.costanti_produttore import ENDPOINT_CLOUD_SENSORI, INTERVALLO_CONTROLLO_BATCH, \
+    NUM_PROCESSI_ELABORAZIONE, NUM_THREAD_IO, INTERVALLO_RECUPERO_PIPELINE, CONCORRENZA_INVIO
 from database.gestore_db import GestoreDatabase
-from utils.fog_api_utils import gestisci_batch_completo, invia_payload
+from task.pipeline_batch import PipelineBatch
+from utils.fog_api_utils import invia_payload_async
 
 logger = logging.getLogger(__name__)
 
 # === TASK PER INVIO SENSORI NON CONFERMATI ===
-async def task_invio_sensori(gestore_database: GestoreDatabase, intervallo: int = 20):
+async def task_invio_sensori(gestore_database: GestoreDatabase, esecutore_io: Executor, intervallo: int = 20):
+    """
+    Invia al cloud i sensori non ancora confermati, CONCORRENZA_INVIO alla volta
+    (richieste HTTP nel pool di thread di I/O, senza bloccare l'event loop).
+    """
     await asyncio.sleep(5)
     while True:
         logger.info("[SENSORI] Controllo sensori da inviare...")
         lista_sensori = gestore_database.ottieni_sensori_non_conferma_ricezione()
-        for sensore in lista_sensori:
-            id_sensore = sensore.get("id_sensore", "??")
-            try:
-                logger.debug(f"[SENSORI] Tentativo invio id_sensore={id_sensore}...")
-                if invia_payload(sensore, ENDPOINT_CLOUD_SENSORI, gestore_database):
+        for inizio in range(0, len(lista_sensori), CONCORRENZA_INVIO):
+            gruppo = lista_sensori[inizio:inizio + CONCORRENZA_INVIO]
+            esiti = await asyncio.gather(
+                *(invia_payload_async(sensore, ENDPOINT_CLOUD_SENSORI, gestore_database, esecutore_io)
+                  for sensore in gruppo),
+                return_exceptions=True
+            )
+            for sensore, esito in zip(gruppo, esiti):
+                id_sensore = sensore.get("id_sensore", "??")
+                if isinstance(esito, Exception):
+                    logger.error(f"[SENSORI] Errore invio id_sensore={id_sensore}: {esito}")
+                elif esito:
                     logger.info(f"[SENSORI] Inviato correttamente id_sensore={id_sensore}")
                 else:
                     logger.warning(f"[SENSORI] Invio fallito per id_sensore={id_sensore}")
-                    break # interrompi il ciclo in caso di errori
-            except Exception as e:
-                logger.error(f"[SENSORI] Errore invio id_sensore={id_sensore}: {e}")
+            if not all(esito is True for esito in esiti):
+                break # interrompi il ciclo in caso di errori
         await asyncio.sleep(intervallo)
 
 
-async def task_invio_batch(gestore_db: GestoreDatabase, intervallo: int = 60):
+# === SCANSIONE DI RECUPERO DELLA PIPELINE DEI BATCH ===
+async def task_recupero_pipeline(pipeline: PipelineBatch, intervallo: int = INTERVALLO_RECUPERO_PIPELINE):
+    """
+    I batch chiusi vengono elaborati e inviati appena notificati dalla pipeline;
+    questo task ricerca periodicamente (e subito all'avvio) i batch rimasti indietro
+    e li riaccoda a blocchi. Se le code sono state riempite, la scansione viene ripetuta
+    appena si liberano, così un arretrato viene drenato senza attendere l'intervallo.
+    La scansione viene ripetuta subito solo se almeno un batch del blocco è stato elaborato
+    o inviato: batch che falliscono a ogni tentativo vengono ripresi dopo l'intervallo.
+    """
     await asyncio.sleep(5)
     while True:
-        logger.info("[BATCH-JSON] Controllo batch da inviare...")
-        # restituisce lista di tuple (id_batch, payload_json)
-        lista_id_payload = gestore_db.ottieni_payload_batch_pronti_per_invio()
-        for id_batch, payload_json in lista_id_payload:
-            try:
-                if isinstance(payload_json, str):
-                    payload = json.loads(payload_json)
-                else:
-                    payload = payload_json
-                logger.debug(f"[BATCH-JSON] Tentativo invio id_batch={id_batch}...")
-                if invia_payload(payload, ENDPOINT_CLOUD_BATCH, gestore_db):
-                    logger.info(f"[BATCH-JSON] Inviato correttamente id_batch={id_batch}")
-                else:
-                    logger.warning(f"[BATCH-JSON] Invio fallito per id_batch={id_batch}")
-                    break  # se fallisce, interrompi per evitare retry inutili
-            except Exception as e:
-                logger.error(f"[BATCH-JSON] Errore invio id_batch={id_batch}: {e}")
-
+        logger.info("[PIPELINE] Controllo batch da elaborare o da inviare...")
+        avanzati = pipeline.batch_avanzati
+        accodati = await pipeline.recupera()
+        if accodati >= pipeline.profondita_coda and not pipeline.invio_in_errore:
+            # probabile arretrato: attende che le code si svuotino e riprova subito
+            # (con il cloud non raggiungibile si attende invece l'intervallo)
+            await pipeline.attendi_code_vuote()
+            if pipeline.batch_avanzati > avanzati:
+                continue
+            logger.warning("[PIPELINE] Nessun batch del blocco elaborato o inviato: "
+                           f"nuovo tentativo tra {intervallo}s")
         await asyncio.sleep(intervallo)
 
-# === TASK PER ELABORAZIONE PERIODICA DEI BATCH COMPLETI ===
-async def task_elabora_batch_completi(db, intervallo: int = 60):
+
+# === TASK PER LA CHIUSURA DEI BATCH APERTI DA TROPPO TEMPO ===
+async def task_chiusura_batch_scaduti(db: GestoreDatabase, intervallo: int = INTERVALLO_CONTROLLO_BATCH):
     """
-    Controlla periodicamente se esistono batch completi (hanno raggiunto la soglia)
-    ma non ancora elaborati (manca Merkle Root o JSON), e li elabora.
+    Riporta periodicamente età e riempimento del batch aperto e lo chiude
+    quando supera l'età massima, anche se non ha raggiunto la soglia di misurazioni.
+    In questo modo la latenza tra misurazione e invio al cloud è limitata.
     """
-    await asyncio.sleep(10)
     while True:
-        logger.info("[BATCH-ELAB] Controllo batch completi da elaborare...")
-        lista_id_batch = db.ottieni_id_batch_completi()
-        logger.debug(f"[BATCH-ELAB] Lista batch chiusi {lista_id_batch}")
-        for id_batch in lista_id_batch:
-            try:
-                logger.debug(f"[BATCH-ELAB] INIZIO ELABORAZIONE batch {id_batch}...")
-                if not gestisci_batch_completo(id_batch, db):
-                    logger.debug(f"[BATCH-ELAB] Elaborazione batch {id_batch} FALLITA")
-            except Exception as e:
-                logger.error(f"[BATCH-ELAB] Errore durante elaborazione batch {id_batch}: {e}")
+        stato = db.ottieni_stato_batch_attivo()
+        if stato:
+            logger.info(f"[BATCH-APERTO] id_batch={stato['id_batch']} "
+                        f"misurazioni={stato['numero_misurazioni']}/{db.soglia_batch} "
+                        f"({stato['riempimento']:.0%}) età={stato['eta_secondi']:.0f}s")
+            id_batch_chiuso = db.chiudi_batch_scaduto()
+            if id_batch_chiuso is not None:
+                logger.info(f"[BATCH-APERTO] Batch {id_batch_chiuso} chiuso per superamento "
+                            f"dell'età massima ({db.soglia_tempo_batch}s)")
         await asyncio.sleep(intervallo)
 
 
 # === AVVIO DEI TASK ASINCRONI ===
 async def avvia_task_periodici(db: GestoreDatabase):
-    task1 = asyncio.create_task(task_invio_sensori(db))
-    task2 = asyncio.create_task(task_invio_batch(db))
-    task3 = asyncio.create_task(task_elabora_batch_completi(db))
+    esecutore_cpu = ProcessPoolExecutor(max_workers=NUM_PROCESSI_ELABORAZIONE)
+    esecutore_io = ThreadPoolExecutor(max_workers=NUM_THREAD_IO, thread_name_prefix="fog-io")
+    pipeline = PipelineBatch(db, esecutore_cpu, esecutore_io)
+    pipeline.avvia()
+    task1 = asyncio.create_task(task_invio_sensori(db, esecutore_io))
+    task2 = asyncio.create_task(task_recupero_pipeline(pipeline))
+    task3 = asyncio.create_task(task_chiusura_batch_scaduti(db))
     try:
         await asyncio.gather(task1, task2, task3)
     except Exception as e:
         logger.critical(f"Errore critico nella gestione dei task periodici: {e}")
+    finally:
+        await pipeline.arresta()
+        esecutore_cpu.shutdown(wait=False, cancel_futures=True)
+        esecutore_io.shutdown(wait=False, cancel_futures=True)
 
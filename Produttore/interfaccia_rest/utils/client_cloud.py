@@ -0,0 +1,82 @@
+import gzip
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from costanti_produttore import API_KEY_PRODUTTORE, COMPRESSIONE_UPLINK, SOGLIA_COMPRESSIONE_BYTE, \
+    DIMENSIONE_POOL_HTTP, TIMEOUT_HTTP
+
+logger = logging.getLogger(__name__)
+
+"""
+Client HTTP del fog node verso il cloud provider.
+Usa una requests.Session condivisa e di lunga durata: le connessioni TCP (e TLS in produzione)
+restano aperte (keep-alive) e vengono riutilizzate da un pool di DIMENSIONE_POOL_HTTP connessioni
+per host, invece di aprirne una nuova per ogni sensore o batch inviato.
+I corpi delle richieste più grandi di SOGLIA_COMPRESSIONE_BYTE vengono compressi in gzip
+(Content-Encoding: gzip): i payload dei batch sono JSON molto ripetitivi e si riducono di 5-10 volte.
+Il client esegue solo la richiesta HTTP e non accede al DB: può essere usato da più thread
+contemporaneamente (pool di thread di I/O), lasciando libero l'event loop.
+"""
+class ClientCloud:
+    def __init__(self, compressione: str | None = COMPRESSIONE_UPLINK,
+                 soglia_compressione: int = SOGLIA_COMPRESSIONE_BYTE,
+                 dimensione_pool: int = DIMENSIONE_POOL_HTTP, timeout: float = TIMEOUT_HTTP):
+        if compressione not in (None, "gzip"):
+            raise ValueError(f"Compressione non supportata: {compressione}")
+        self.compressione = compressione
+        self.soglia_compressione = soglia_compressione
+        self.timeout = timeout
+        self.sessione = requests.Session()
+        # nessun retry automatico: i reinvii sono gestiti dalla pipeline e dai task periodici
+        adattatore = HTTPAdapter(pool_connections=1, pool_maxsize=dimensione_pool, max_retries=0)
+        self.sessione.mount("http://", adattatore)
+        self.sessione.mount("https://", adattatore)
+        self.sessione.headers.update({
+            "X-API-Key": API_KEY_PRODUTTORE or "",
+            "Content-Type": "application/json",
+        })
+
+    def _prepara_corpo(self, payload: dict | str) -> tuple[bytes, dict]:
+        """
+        Serializza il payload (se non è già una stringa JSON) e lo comprime
+        se supera la soglia. Restituisce il corpo e gli header aggiuntivi.
+        """
+        testo = payload if isinstance(payload, str) else json.dumps(payload, separators=(",", ":"))
+        corpo = testo.encode("utf-8")
+        if self.compressione == "gzip" and len(corpo) >= self.soglia_compressione:
+            # livello 6: buon compromesso tra CPU del fog node e dimensione
+            return gzip.compress(corpo, compresslevel=6), {"Content-Encoding": "gzip"}
+        return corpo, {}
+
+    def invia(self, payload: dict | str, endpoint_cloud: str) -> dict:
+        """
+        Invia il payload (dizionario o stringa JSON già serializzata) con una POST
+        e restituisce la risposta JSON del cloud.
+        Solleva requests.RequestException per errori di rete o status non 2xx
+        e ValueError se la risposta non è JSON valido.
+        """
+        corpo, header = self._prepara_corpo(payload)
+        response = self.sessione.post(endpoint_cloud, data=corpo, headers=header, timeout=self.timeout)
+        response.raise_for_status()  # genera eccezione se non 2xx
+        return response.json()
+
+    def chiudi(self) -> None:
+        self.sessione.close()
+
+
+_client_cloud: ClientCloud | None = None
+_lock_client = threading.Lock()
+
+
+def ottieni_client_cloud() -> ClientCloud:
+    """Restituisce il client condiviso dal processo (creato al primo utilizzo)."""
+    global _client_cloud
+    if _client_cloud is None:
+        with _lock_client:
+            if _client_cloud is None:
+                _client_cloud = ClientCloud()
+    return _client_cloud
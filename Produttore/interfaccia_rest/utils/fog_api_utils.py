@@ -1,107 +1,116 @@
+import asyncio
 import logging
+from concurrent.futures import Executor
 
 import requests
-from costruttore_payload import CostruttorePayload
 
-from Classi_comuni.entita.modelli_dati import DatiPayload
-from costanti_produttore import ERRORE_IPFS, ERRORE_BLOCKCHAIN, API_KEY_PRODUTTORE
+from client_cloud import ottieni_client_cloud
+from costanti_produttore import ERRORE_IPFS, ERRORE_BLOCKCHAIN
 from database.gestore_db import GestoreDatabase
-from gestione_batch import costruisci_merkle_tree, carica_merkle_path_ipfs
+from gestione_batch import elabora_dati_batch, carica_merkle_path_ipfs
 from ipfs_client import ErroreCaricamentoIPFS, ErroreRecuperoCID
 
 logger = logging.getLogger(__name__)
 logging.getLogger("urllib3.connectionpool").setLevel(logging.CRITICAL)
 
-def gestisci_batch_completo(id_batch: int, gestore_db: GestoreDatabase) -> bool:
+async def gestisci_batch_completo_async(id_batch: int, gestore_db: GestoreDatabase,
+                                        esecutore_cpu: Executor, esecutore_io: Executor) -> bool:
     """
     Gestisce l'intero ciclo di elaborazione di un batch completo:
     1. Estrae i dati del batch dal DB.
-    2. Costruisce il payload (modelli Pydantic).
-    3. Serializza il payload in JSON.
-    4. Costruisce Merkle Tree e Merkle Path.
-    5. Salva Merkle Path su IPFS.
-    6. Aggiorna DB con metadata del batch.
-    7. (Prossimamente) Salva su blockchain.
+    2. Calcola gli hash delle foglie e il payload JSON.
+    3. Costruisce Merkle Tree e Merkle Path.
+    4. Salva Merkle Path su IPFS.
+    5. Aggiorna DB con metadata del batch.
+    6. (Prossimamente) Salva su blockchain.
+    Le fasi vengono eseguite senza bloccare l'event loop:
+    - lettura delle misurazioni (connessione di lettura) e upload IPFS nel pool di thread (I/O)
+    - payload JSON, hashing delle foglie e Merkle Tree nel pool di processi (CPU)
+    L'event loop si limita a schedulare le fasi e a registrare il risultato nel DB
+    (connessione di scrittura), quindi l'ingestione delle misurazioni non viene rallentata.
     """
-    dati_query = gestore_db.estrai_dati_batch_misurazioni(id_batch)
+    loop = asyncio.get_running_loop()
+    # l'ID può arrivare più volte (notifica e scansione di recupero): un batch già elaborato
+    # non viene ricostruito né caricato di nuovo su IPFS
+    if not await loop.run_in_executor(esecutore_io, gestore_db.batch_da_elaborare, id_batch):
+        logger.info(f"Batch {id_batch} già elaborato o non elaborabile: elaborazione saltata")
+        return False
+    dati_query = await loop.run_in_executor(esecutore_io, gestore_db.estrai_dati_batch_misurazioni, id_batch)
     if not dati_query:
         logger.error(f"Nessun dato trovato per il batch {id_batch}")
         return False
 
-    # === Costruzione del payload ===
-    payload = CostruttorePayload()
-    payload.estrai_dati_da_query(dati_query)
-    payload_da_inviare: DatiPayload = payload.costruisci_payload()
-    payload_json = payload_da_inviare.to_json()
-    # === Costruzione Merkle Tree e Path ===
-    merkle_root, merkle_path = costruisci_merkle_tree(payload)
-    # === Upload su IPFS ===
+    # === Costruzione del payload, Merkle Tree e Path (processo separato) ===
+    merkle_root, merkle_path, payload_json = await loop.run_in_executor(esecutore_cpu, elabora_dati_batch, dati_query)
+    # === Upload su IPFS (thread di I/O) ===
     try:
-        cid = carica_merkle_path_ipfs(merkle_path)
-        #IPFS OK → aggiorna subito i metadata nel DB
-        gestore_db.aggiorna_metadata_batch(id_batch, merkle_root, cid, payload_json)
-        # (in futuro) Upload su blockchain
-        try:
-            # da implementare
-            # _carica_dati_su_blockchain(...)
-            pass
-        except Exception as e:
-            logger.error(f"Errore blockchain per batch {id_batch}: {e}")
-            gestore_db.aggiorna_batch_errore_elaborazione(
-                id_batch,
-                messaggio_errore=str(e),
-                tipo_errore=ERRORE_BLOCKCHAIN
-            )
-            return False
+        cid = await loop.run_in_executor(esecutore_io, carica_merkle_path_ipfs, merkle_path)
     except (ErroreCaricamentoIPFS, ErroreRecuperoCID) as e:
-        logger.error(f"Errore IPFS per batch {id_batch}: {e}")
+        return _registra_errore_ipfs(id_batch, e, gestore_db)
+    return _registra_metadata_batch(id_batch, merkle_root, cid, payload_json, gestore_db)
+
+
+def _registra_metadata_batch(id_batch: int, merkle_root: str, cid: str, payload_json: str,
+                             gestore_db: GestoreDatabase) -> bool:
+    #IPFS OK → aggiorna subito i metadata nel DB
+    gestore_db.aggiorna_metadata_batch(id_batch, merkle_root, cid, payload_json)
+    # (in futuro) Upload su blockchain
+    try:
+        # da implementare
+        # _carica_dati_su_blockchain(...)
+        pass
+    except Exception as e:
+        logger.error(f"Errore blockchain per batch {id_batch}: {e}")
         gestore_db.aggiorna_batch_errore_elaborazione(
             id_batch,
             messaggio_errore=str(e),
-            tipo_errore=ERRORE_IPFS
+            tipo_errore=ERRORE_BLOCKCHAIN
         )
         return False
     # Tutto ok nell'elaborazione
     return True
 
 
-def invia_payload(payload_dict: dict, endpoint_cloud: str, gestore_db : GestoreDatabase) -> bool:
+def _registra_errore_ipfs(id_batch: int, errore: Exception, gestore_db: GestoreDatabase) -> bool:
+    logger.error(f"Errore IPFS per batch {id_batch}: {errore}")
+    gestore_db.aggiorna_batch_errore_elaborazione(
+        id_batch,
+        messaggio_errore=str(errore),
+        tipo_errore=ERRORE_IPFS,
+        # un batch con Merkle Root già salvata resta inviabile
+        solo_se_non_elaborato=True
+    )
+    return False
+
+
+async def invia_payload_async(payload: dict | str, endpoint_cloud: str, gestore_db: GestoreDatabase,
+                              esecutore_io: Executor) -> bool:
     """
-    Invia il payload (dizionario) al servizio cloud tramite HTTP POST.
+    Invia il payload (dizionario o stringa JSON) al servizio cloud tramite HTTP POST.
 
     La funzione si aspetta una risposta JSON strutturata dal cloud, contenente almeno:
     - "success": True/False
     - "id_sensore" oppure "id_batch" a seconda del tipo di operazione
     Ritorna True solo se la risposta HTTP ha status 2xx e se il campo "success" è True.
-    Eventuali errori di rete o risposte errate vengono loggati sul logger
+    Eventuali errori di rete o risposte errate vengono loggati sul logger.
+    La richiesta HTTP viene eseguita nel pool di thread di I/O (sessione condivisa con keep-alive)
+    e solo l'aggiornamento del DB avviene nell'event loop: più invii possono essere in corso
+    contemporaneamente.
     """
-    try:
-        # Header con chiave API
-        headers = {
-            "X-API-Key": API_KEY_PRODUTTORE
-        }
-
-        # Invia il payload con header e timeout
-        response = requests.post(endpoint_cloud, json=payload_dict, headers=headers, timeout=10)
-        response.raise_for_status()  # genera eccezione se non 2xx
-        # Tenta di effettuare il parsing della risposta come JSON (in realtà il payload è un dizionario)
-        payload_dict = response.json()
-        logger.debug(payload_dict)
-        # Verifica che il campo "conferma_ricezione" sia presente e valga True
-        if payload_dict.get("conferma_ricezione") is True:
-            # Messaggio di log personalizzato in base al contenuto della risposta
-            if "id_sensore" in payload_dict:
-                logger.debug(f"Registrazione id Sensore confermata: {payload_dict['id_sensore']}")
-                gestore_db.aggiorna_conferma_ricezione_sensore(payload_dict['id_sensore'])
-            elif "id_batch" in payload_dict:
-                logger.debug(f"Registrazione id Batch confermato: {payload_dict['id_batch']}")
-                gestore_db.aggiorna_conferma_ricezione_batch(payload_dict['id_batch'])
-            return True
-        else:
-            #fallita la registrazione del sensore o del batch
-            logger.warning(f"Risposta dal cloud provider ricevuta ma non conferma"
-                           f"la ricezione del sensore o del batch: {payload_dict}")
+    loop = asyncio.get_running_loop()
+    risposta = await loop.run_in_executor(esecutore_io, _invia_al_cloud, payload, endpoint_cloud)
+    return risposta is not None and _registra_conferma_ricezione(risposta, gestore_db)
 
+
+def _invia_al_cloud(payload: dict | str, endpoint_cloud: str) -> dict | None:
+    """
+    Esegue la sola richiesta HTTP (nessun accesso al DB).
+    Restituisce la risposta JSON del cloud oppure None in caso di errore.
+    """
+    try:
+        risposta = ottieni_client_cloud().invia(payload, endpoint_cloud)
+        logger.debug(risposta)
+        return risposta
     except requests.exceptions.Timeout:
         logger.error("Timeout durante l'invio del payload al cloud.")
     except requests.exceptions.ConnectionError:
@@ -110,6 +119,22 @@ def invia_payload(payload_dict: dict, endpoint_cloud: str, gestore_db : GestoreD
         logger.error(f"Invio del payload fallito: {e}")
     except ValueError:
         logger.error("Risposta del cloud non è in formato JSON valido.")
-    # In tutti i casi d’errore ritorna False per ritentare in seguito
-    return False
+    # In tutti i casi d’errore ritorna None per ritentare in seguito
+    return None
+
 
+def _registra_conferma_ricezione(risposta: dict, gestore_db: GestoreDatabase) -> bool:
+    # Verifica che il campo "conferma_ricezione" sia presente e valga True
+    if risposta.get("conferma_ricezione") is True:
+        # Messaggio di log personalizzato in base al contenuto della risposta
+        if "id_sensore" in risposta:
+            logger.debug(f"Registrazione id Sensore confermata: {risposta['id_sensore']}")
+            gestore_db.aggiorna_conferma_ricezione_sensore(risposta['id_sensore'])
+        elif "id_batch" in risposta:
+            logger.debug(f"Registrazione id Batch confermato: {risposta['id_batch']}")
+            gestore_db.aggiorna_conferma_ricezione_batch(risposta['id_batch'])
+        return True
+    #fallita la registrazione del sensore o del batch
+    logger.warning(f"Risposta dal cloud provider ricevuta ma non conferma"
+                   f"la ricezione del sensore o del batch: {risposta}")
+    return False
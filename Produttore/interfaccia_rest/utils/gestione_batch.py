@@ -5,8 +5,8 @@ from typing import Tuple
 from costruttore_payload import CostruttorePayload
 from merkle_tree import MerkleTree, PathCompatto
 
-from costanti_produttore import BUCKET_MERKLE_PATH
-from  ipfs_client import IpfsClient
+from costanti_produttore import BUCKET_MERKLE_PATH, FORMATO_MERKLE_PATH
+from  ipfs_client import ottieni_client_ipfs
 
 # Logger del modulo
 logger = logging.getLogger(__name__)
@@ -33,13 +33,14 @@ def debug_stampa_paths_json(paths: dict[int, PathCompatto], verbose: bool = Fals
     logger.debug(f"\n{separator}\n{json_str}\n{separator}")
 
 
-def costruisci_merkle_tree(payload: CostruttorePayload) -> Tuple[str, str]:
+def costruisci_merkle_tree(payload: CostruttorePayload,
+                           formato: str = FORMATO_MERKLE_PATH) -> Tuple[str, str | bytes]:
     """
     Costruisce il Merkle Tree a partire da un CostruttorePayload.
     Utilizza la mappa ID → hash (con ID 0 per il batch) già ordinata,
     e restituisce:
       - la Merkle Root
-      - i Merkle Path in formato JSON (stringa)
+      - i Merkle Path nel formato richiesto: bytes se "binario" o "livelli", stringa JSON se "json"
     """
     # Estrazione della mappa id → hash (ordinata all'interno del metodo stesso)
     mappa_id_hash = payload.ottieni_mappa_id_foglie()
@@ -53,17 +54,39 @@ def costruisci_merkle_tree(payload: CostruttorePayload) -> Tuple[str, str]:
     merkle_root = merkle_tree.costruisci_albero()
 
     logger.debug(f"Merkle Root calcolata: {merkle_root}")
+    if formato == "livelli":
+        # solo i livelli dell'albero: i path vengono derivati dal Verificatore
+        return merkle_root, merkle_tree.ottieni_livelli_albero()
+    if formato == "binario":
+        return merkle_root, merkle_tree.ottieni_merkle_paths_binario()
     # Esportazione dei Merkle Path in formato JSON
     merkle_path_json = merkle_tree.ottieni_merkle_paths_JSON()
     return merkle_root, merkle_path_json
 
 
 
-def carica_merkle_path_ipfs(merkle_path: str):
-    client = IpfsClient()
-    #carica l'oggetto stringa su IPFS e restituisce il nome del file generato internamente
-    # dalla classe IPFS in modo che sia univoco in IPFS
-    nome_file: str = client.upload_json_string(BUCKET_MERKLE_PATH, merkle_path, comprimi_dimensione=True)
-    #recupera il CID a partire dai metadata del file caricato nel bucket dell'utente
-    cid = client.recupera_cid_file_bucket(BUCKET_MERKLE_PATH, nome_file)
-    return cid
+def elabora_dati_batch(dati_query: list[dict]) -> Tuple[str, str | bytes, str]:
+    """
+    Parte CPU-bound dell'elaborazione di un batch completo, senza accesso a DB o rete:
+    serializzazione delle foglie (una sola volta, per hash e payload), hashing e Merkle Tree.
+    È una funzione di modulo con input/output serializzabili, quindi può essere eseguita
+    in un processo separato (ProcessPoolExecutor).
+    Restituisce (merkle_root, merkle_path, payload_json); merkle_path è nel formato FORMATO_MERKLE_PATH.
+    """
+    payload = CostruttorePayload()
+    payload.estrai_dati_da_query(dati_query)
+    # payload composto dai testi canonici delle foglie, già serializzati per il calcolo degli hash
+    payload_json = payload.ottieni_payload_json()
+    merkle_root, merkle_path = costruisci_merkle_tree(payload)
+    return merkle_root, merkle_path, payload_json
+
+
+def carica_merkle_path_ipfs(merkle_path: str | bytes) -> str:
+    # client condiviso dal processo: connessioni e verifica del bucket sono riutilizzate
+    client = ottieni_client_ipfs()
+    if isinstance(merkle_path, bytes):
+        # formati binari: gli hash grezzi non si comprimono, il file viene caricato così com'è
+        return client.carica_binario(BUCKET_MERKLE_PATH, merkle_path)
+    #carica l'oggetto stringa su IPFS con un nome file generato internamente dalla classe IPFS
+    # (univoco in IPFS) e restituisce il CID letto dalla risposta dell'upload
+    return client.carica_json(BUCKET_MERKLE_PATH, merkle_path, comprimi_dimensione=True)
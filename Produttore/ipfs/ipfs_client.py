@@ -1,19 +1,28 @@
 # Import delle librerie per l'interazione con Filebase (via S3), gestione eccezioni,
 import gzip
+import hashlib
 import logging
+import threading
 from io import BytesIO
 
 import boto3
+import boto3.exceptions
 import botocore.exceptions
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 from Classi_comuni.hash_utils import Hashing
-from costanti_produttore import AWS_SECRET_ACCESS_KEY, AWS_ACCESS_KEY_ID
+from costanti_produttore import AWS_SECRET_ACCESS_KEY, AWS_ACCESS_KEY_ID, ENDPOINT_IPFS_S3, SOGLIA_MULTIPART_IPFS, \
+    DIMENSIONE_PARTE_IPFS, NUM_THREAD_IO
 
 logger = logging.getLogger(__name__)
 logging.getLogger("botocore").setLevel(logging.CRITICAL)
 logging.getLogger("boto3").setLevel(logging.CRITICAL)
 logging.getLogger("urllib3").setLevel(logging.CRITICAL)
 
+# header HTTP con cui Filebase restituisce il CID nella risposta all'upload
+HEADER_CID = "x-amz-meta-cid"
+
 
 #ErroreCaricamento: nella put_object → quando upload fallisce.
 #ErroreRecuperoCID: nella head_object → se ipfs-hash non esiste nei metadata.
@@ -40,8 +49,11 @@ e non può essere fatto su oggetti esterni o appartenenti ad altri account.
 class IpfsClient:
     """
     Classe per caricare file JSON su Filebase (IPFS) e recuperare il CID associato.
+    Il client boto3 è thread-safe: un'unica istanza (vedi ottieni_client_ipfs) viene condivisa
+    da tutto il processo, riutilizzando le connessioni HTTP verso l'endpoint S3.
+    L'esistenza di un bucket viene verificata una sola volta e poi memorizzata.
     """
-    def __init__(self):
+    def __init__(self, endpoint_url: str = ENDPOINT_IPFS_S3, max_connessioni: int = NUM_THREAD_IO):
         #load_dotenv()
         #access_key = os.getenv("AWS_ACCESS_KEY_ID")
         #secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
@@ -49,58 +61,108 @@ class IpfsClient:
         secret_key = AWS_SECRET_ACCESS_KEY
         self.s3 = boto3.client(
             's3',
-            endpoint_url='https://s3.filebase.com',
+            endpoint_url=endpoint_url,
             aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key
+            aws_secret_access_key=secret_key,
+            # un upload per ogni thread di I/O senza attese sul pool di connessioni
+            config=Config(max_pool_connections=max_connessioni)
+        )
+        self.config_trasferimento = TransferConfig(
+            multipart_threshold=SOGLIA_MULTIPART_IPFS,
+            multipart_chunksize=DIMENSIONE_PARTE_IPFS
         )
+        self._bucket_verificati: set[str] = set()
+        self._lock_bucket = threading.Lock()
 
     def verifica_o_crea_bucket(self, nome_bucket: str):
         """
         Controlla se il bucket esiste, altrimenti lo crea.
+        L'esito positivo viene memorizzato: le chiamate successive non eseguono richieste.
         """
-        try:
-            risposta = self.s3.list_buckets()
-            buckets_esistenti = [b["Name"] for b in risposta["Buckets"]]
-            if nome_bucket not in buckets_esistenti:
-                self.s3.create_bucket(Bucket=nome_bucket)
-                logger.info(f"🪣 Bucket '{nome_bucket}' creato.")
-            else:
+        if nome_bucket in self._bucket_verificati:
+            return
+        with self._lock_bucket:
+            if nome_bucket in self._bucket_verificati:
+                return
+            try:
+                # head_bucket interroga il solo bucket richiesto (list_buckets li elenca tutti)
+                self.s3.head_bucket(Bucket=nome_bucket)
                 logger.debug(f"Bucket '{nome_bucket}' già esistente.")
-        except botocore.exceptions.ClientError as e:
-            logger.error(f"❌ Errore nella verifica/creazione del bucket: {e}")
-            raise ErroreCaricamentoIPFS("Errore durante la creazione o verifica del bucket.")
+            except botocore.exceptions.ClientError as e:
+                codice = e.response.get("Error", {}).get("Code", "")
+                if codice not in ("404", "NoSuchBucket", "NotFound"):
+                    logger.error(f"❌ Errore nella verifica/creazione del bucket: {e}")
+                    raise ErroreCaricamentoIPFS("Errore durante la creazione o verifica del bucket.")
+                try:
+                    self.s3.create_bucket(Bucket=nome_bucket)
+                    logger.info(f"🪣 Bucket '{nome_bucket}' creato.")
+                except botocore.exceptions.ClientError as e:
+                    logger.error(f"❌ Errore nella verifica/creazione del bucket: {e}")
+                    raise ErroreCaricamentoIPFS("Errore durante la creazione o verifica del bucket.")
+            self._bucket_verificati.add(nome_bucket)
 
     def upload_json_string(self, nome_bucket: str, stringa_json: str, comprimi_dimensione: bool = False) -> str:
         """
         Carica un file JSON su IPFS (tramite Filebase), usando come nome file
         un hash deterministico del contenuto. Se l'upload fallisce, solleva ErroreCaricamento.
+        Restituisce il nome del file; per ottenere direttamente il CID usare carica_json.
         """
-        self.verifica_o_crea_bucket(nome_bucket)
+        nome_file, _ = self._carica_json(nome_bucket, stringa_json, comprimi_dimensione)
+        return nome_file
+
+    def carica_json(self, nome_bucket: str, stringa_json: str, comprimi_dimensione: bool = False) -> str:
+        """
+        Carica un file JSON su IPFS e restituisce il suo CID.
+        Il CID viene letto dagli header della risposta all'upload (x-amz-meta-cid);
+        solo se assente viene eseguita una head_object sul file caricato.
+        """
+        nome_file, cid = self._carica_json(nome_bucket, stringa_json, comprimi_dimensione)
+        return cid or self.recupera_cid_file_bucket(nome_bucket, nome_file)
+
+    def carica_binario(self, nome_bucket: str, contenuto: bytes) -> str:
+        """
+        Carica un file binario dei Merkle Path (formato_path_binario o albero_livelli)
+        e restituisce il suo CID. L'estensione è scelta in base al magic del contenuto.
+        """
+        estensione = "mkt" if contenuto[:4] == b"MKTL" else "mkp"
+        nome_file = f"merkle_path_{hashlib.sha256(contenuto).hexdigest()[:8]}.{estensione}"
+        cid = self.carica_contenuto(nome_bucket, nome_file, contenuto, "application/octet-stream")
+        return cid or self.recupera_cid_file_bucket(nome_bucket, nome_file)
+
+    def _carica_json(self, nome_bucket: str, stringa_json: str, comprimi_dimensione: bool) -> tuple[str, str | None]:
         nome_file = IpfsClient._genera_nome_file(stringa_json)
         if comprimi_dimensione:
             contenuto = IpfsClient._genera_contenuto_gzip(stringa_json)
             nome_file += ".gz"
+            tipo_contenuto = "application/gzip"
         else:
             contenuto = stringa_json.encode("utf-8")  # CORRETTO
+            tipo_contenuto = "application/json"
+        return nome_file, self.carica_contenuto(nome_bucket, nome_file, contenuto, tipo_contenuto)
+
+    def carica_contenuto(self, nome_bucket: str, nome_file: str, contenuto: bytes, tipo_contenuto: str) -> str | None:
+        """
+        Carica un contenuto binario nel bucket e restituisce il CID se presente negli header
+        della risposta, altrimenti None. Sotto SOGLIA_MULTIPART_IPFS byte usa una sola put_object,
+        oltre la soglia un upload multipart a parti da DIMENSIONE_PARTE_IPFS byte.
+        """
+        self.verifica_o_crea_bucket(nome_bucket)
         try:
             logger.info(f"Caricamento '{nome_file}' nel bucket '{nome_bucket}'...")
-            params = {
-                "Bucket": nome_bucket,
-                "Key": nome_file,
-                "Body": contenuto,
-            }
-            if comprimi_dimensione:
-                params["ContentType"] = "application/gzip"
+            if len(contenuto) < SOGLIA_MULTIPART_IPFS:
+                risposta = self.s3.put_object(Bucket=nome_bucket, Key=nome_file,
+                                              Body=contenuto, ContentType=tipo_contenuto)
+                cid = risposta.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get(HEADER_CID)
             else:
-                params["ContentType"] = "application/json"
-
-            #usando un dizionario (params), puoi aggiungere parametri solo quando servono
-            #con ** sto creando un nuovo dizionario
-            self.s3.put_object(**params)
+                # upload multipart: il contenuto è già interamente in memoria (il nome del file deriva
+                # dal suo hash): il multipart divide solo l'invio in una richiesta per parte
+                self.s3.upload_fileobj(BytesIO(contenuto), nome_bucket, nome_file,
+                                       ExtraArgs={"ContentType": tipo_contenuto},
+                                       Config=self.config_trasferimento)
+                cid = None
             logger.info("✅ Upload completato.")
-            return nome_file
-
-        except botocore.exceptions.ClientError as e:
+            return cid
+        except (botocore.exceptions.ClientError, boto3.exceptions.S3UploadFailedError) as e:
             logger.error(f"❌ Errore durante upload: {e}")
             raise ErroreCaricamentoIPFS(f"Errore nel caricamento di '{nome_file}'")
 
@@ -118,12 +180,14 @@ class IpfsClient:
             #recupera il file
             risposta = self.s3.head_object(Bucket=nome_bucket, Key=nome_file)
             metadata_file = risposta.get("Metadata", {})
-            cid = metadata_file.get("cid", {})  # ✅ questo è il campo corretto
-            logger.info(f"🔑 CID recuperato: {cid}")
-            return cid
+            cid = metadata_file.get("cid")  # ✅ questo è il campo corretto
         except botocore.exceptions.ClientError as e:
             logger.error(f"❌ Errore nel recupero del CID: {e}")
             raise ErroreRecuperoCID(f"Impossibile ottenere CID per il file '{nome_file}'")
+        if not cid:
+            raise ErroreRecuperoCID(f"CID assente nei metadata del file '{nome_file}'")
+        logger.info(f"🔑 CID recuperato: {cid}")
+        return cid
 
 
     @staticmethod
@@ -149,6 +213,19 @@ class IpfsClient:
             gzip_file.write(json_string.encode('utf-8'))
         return buffer.getvalue()
 
+_client_ipfs: IpfsClient | None = None
+_lock_client = threading.Lock()
+
+
+def ottieni_client_ipfs() -> IpfsClient:
+    """Restituisce il client IPFS condiviso dal processo (creato al primo utilizzo)."""
+    global _client_ipfs
+    if _client_ipfs is None:
+        with _lock_client:
+            if _client_ipfs is None:
+                _client_ipfs = IpfsClient()
+    return _client_ipfs
+
 """
 # FUNZIONE DI AUSILIO/DEBUG (serve per testare il comportamento della classe in modo indipendente)
 def main():
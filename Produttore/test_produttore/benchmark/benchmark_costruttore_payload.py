@@ -0,0 +1,93 @@
+"""
+Benchmark della parte CPU dell'elaborazione di un batch sul fog node (elabora_dati_batch):
+estrazione delle foglie da righe sintetiche come quelle lette da SQLite (colonna dati come testo JSON),
+hash delle foglie, Merkle Tree e payload JSON.
+Misura separatamente CostruttorePayload (hash + payload) e l'elaborazione completa,
+e verifica che la Merkle Root non dipenda dal percorso usato:
+le foglie ricalcolate con to_hash dai modelli Pydantic devono coincidere con quelle del costruttore.
+
+Esecuzione: python benchmark_costruttore_payload.py --batch 200 --misurazioni 1023
+"""
+import argparse
+import json
+import random
+import time
+
+from costruttore_payload import CostruttorePayload
+from Classi_comuni.config.costanti_comuni import ID_BATCH_LOGICO
+from Classi_comuni.entita.modelli_dati import DatiBatch, DatiMisurazione
+from interfaccia_rest.utils.gestione_batch import elabora_dati_batch
+
+NUMERO_SENSORI = 90
+
+
+def genera_righe(id_batch: int, numero_misurazioni: int) -> list[dict]:
+    """Righe della INNER JOIN batch + misurazioni, ordinate per id_misurazione come nella query."""
+    righe = []
+    for i in range(numero_misurazioni):
+        dati = {
+            "x": random.randint(-32768, 32767),
+            "y": random.randint(-32768, 32767),
+            "pulsante": random.random() < 0.5,
+            "temperatura": round(random.uniform(-10, 40), 2),
+        }
+        righe.append({
+            "id_misurazione": id_batch * numero_misurazioni + i + 1,
+            "id_sensore": f"SENS{i % NUMERO_SENSORI:03d}",
+            "timestamp": f"2025-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}",
+            "dati": json.dumps(dati),
+            "id_batch": id_batch,
+            "timestamp_creazione": "2025-01-01 00:00:00",
+            "numero_misurazioni": numero_misurazioni,
+        })
+    return righe
+
+
+def hash_foglie_da_modelli(righe: list[dict]) -> dict[int, str]:
+    """Foglie calcolate con to_hash dei modelli Pydantic, per il controllo di equivalenza."""
+    prima = righe[0]
+    batch = DatiBatch(id_batch=prima["id_batch"], timestamp_creazione=prima["timestamp_creazione"],
+                      numero_misurazioni=prima["numero_misurazioni"])
+    mappa_id_hash = {ID_BATCH_LOGICO: batch.to_hash()}
+    for riga in righe:
+        mis = DatiMisurazione(id_misurazione=riga["id_misurazione"], id_sensore=riga["id_sensore"],
+                              timestamp=riga["timestamp"], id_batch=riga["id_batch"], dati=json.loads(riga["dati"]))
+        mappa_id_hash[mis.id_misurazione] = mis.to_hash()
+    return mappa_id_hash
+
+
+def misura(descrizione: str, funzione, lista_righe: list[list[dict]]) -> None:
+    inizio = time.perf_counter()
+    for righe in lista_righe:
+        funzione(righe)
+    durata = time.perf_counter() - inizio
+    print(f"{descrizione:<40} {durata / len(lista_righe) * 1000:8.2f} ms/batch")
+
+
+def costruisci_payload(righe: list[dict]) -> None:
+    payload = CostruttorePayload()
+    payload.estrai_dati_da_query(righe)
+    payload.ottieni_mappa_id_foglie()
+    payload.ottieni_payload_json()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--misurazioni", type=int, default=1023)
+    args = parser.parse_args()
+
+    random.seed(0)
+    lista_righe = [genera_righe(id_batch, args.misurazioni) for id_batch in range(1, args.batch + 1)]
+
+    payload = CostruttorePayload()
+    payload.estrai_dati_da_query(lista_righe[0])
+    assert payload.ottieni_mappa_id_foglie() == hash_foglie_da_modelli(lista_righe[0]), "hash delle foglie diversi"
+
+    misura("to_hash dai modelli Pydantic", hash_foglie_da_modelli, lista_righe)
+    misura("CostruttorePayload (hash + payload)", costruisci_payload, lista_righe)
+    misura("elabora_dati_batch (+ Merkle Tree)", elabora_dati_batch, lista_righe)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark delle query di polling del fog node su un database sintetico di grandi dimensioni.
+Costruisce un database con N misurazioni (default 10 milioni) distribuite in batch da 1023,
+quasi tutti già confermati dal cloud, e misura i tempi di:
+- OTTIENI_ID_BATCH_COMPLETI_DA_ELABORARE
+- OTTIENI_ID_BATCH_PRONTI_PER_INVIO
+nella versione precedente (JOIN + DISTINCT, nessun indice) e nella versione attuale
+(EXISTS / NOT EXISTS) prima e dopo l'applicazione delle migrazioni dello schema.
+
+Esecuzione: python benchmark_query_polling.py --righe 10000000
+La costruzione del database da 10M righe richiede qualche decina di secondi.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from database import query
+
+DIMENSIONE_BATCH = 1023
+NUMERO_SENSORI = 90
+
+# Versioni delle query prima dell'introduzione degli indici, per confronto
+QUERY_PRECEDENTI = {
+    "batch_da_elaborare": """
+        SELECT DISTINCT b.id_batch
+        FROM batch b
+        INNER JOIN misurazione m ON b.id_batch = m.id_batch
+        WHERE b.completo = 1
+        AND b.conferma_ricezione = 0
+        AND b.elaborabile = 1
+        AND (b.merkle_root IS NULL OR b.merkle_root = '')
+        AND (b.payload_json IS NULL OR b.payload_json = '')
+        ORDER BY b.id_batch ASC
+        LIMIT 1
+    """,
+    "payload_pronti": """
+        SELECT b.id_batch, b.payload_json
+        FROM batch as b
+        INNER JOIN misurazione as m ON b.id_batch = m.id_batch
+        INNER JOIN sensore as s ON m.id_sensore = s.id_sensore
+        WHERE payload_json IS NOT NULL
+        AND b.conferma_ricezione = 0
+        AND elaborabile = 1
+        AND s.conferma_ricezione = 1
+        ORDER BY b.id_batch ASC
+        LIMIT 1
+    """,
+}
+QUERY_ATTUALI = {
+    "batch_da_elaborare": query.OTTIENI_ID_BATCH_COMPLETI_DA_ELABORARE,
+    "payload_pronti": query.OTTIENI_ID_BATCH_PRONTI_PER_INVIO,
+}
+# parametri delle query attuali (limite di batch restituiti)
+PARAMETRI_ATTUALI = {
+    "batch_da_elaborare": (1,),
+    "payload_pronti": (1,),
+}
+
+
+def costruisci_database(percorso: str, righe: int) -> None:
+    """
+    Crea lo schema iniziale (senza indici) e lo popola con dati sintetici:
+    tutti i batch sono confermati tranne gli ultimi tre
+    (uno completo da elaborare, uno con payload pronto per l'invio, uno aperto).
+    """
+    conn = sqlite3.connect(percorso)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(query.CREA_TABELLA_SENSORE)
+    conn.execute(query.CREA_TABELLA_BATCH)
+    conn.execute(query.CREA_TABELLA_MISURAZIONE)
+    conn.executemany(
+        "INSERT INTO sensore (id_sensore, descrizione, tipo, conferma_ricezione) VALUES (?, ?, ?, 1)",
+        [(f"JOY{i:03d}", f"Joystick {i}", "joystick") for i in range(NUMERO_SENSORI)]
+    )
+    numero_batch = (righe + DIMENSIONE_BATCH - 1) // DIMENSIONE_BATCH
+    conn.execute("""
+        WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+        INSERT INTO batch (id_batch, timestamp_creazione, numero_misurazioni, completo,
+                           conferma_ricezione, merkle_root, payload_json)
+        SELECT i, '2025-01-01T00:00:00', ?, 1, 1, 'root', '{}' FROM seq
+    """, (numero_batch, DIMENSIONE_BATCH))
+    conn.execute("""
+        WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < ? - 1)
+        INSERT INTO misurazione (id_sensore, id_batch, dati, timestamp)
+        SELECT printf('JOY%03d', i % ?), i / ? + 1, '{"pressed":true,"x":0.1,"y":0.2}', '2025-01-01T00:00:00'
+        FROM seq
+    """, (righe, NUMERO_SENSORI, DIMENSIONE_BATCH))
+    # ultimi batch: da elaborare, pronto per l'invio, aperto
+    conn.execute("UPDATE batch SET conferma_ricezione = 0, merkle_root = NULL, payload_json = NULL "
+                 "WHERE id_batch = ?", (numero_batch - 2,))
+    conn.execute("UPDATE batch SET conferma_ricezione = 0 WHERE id_batch = ?", (numero_batch - 1,))
+    conn.execute("UPDATE batch SET completo = 0, conferma_ricezione = 0, merkle_root = NULL, "
+                 "payload_json = NULL WHERE id_batch = ?", (numero_batch,))
+    conn.commit()
+    conn.close()
+
+
+def cronometra(conn: sqlite3.Connection, testo_query: str, ripetizioni: int,
+               parametri: tuple = ()) -> tuple[float, list]:
+    """Restituisce il tempo medio in millisecondi e il risultato dell'ultima esecuzione."""
+    risultato = []
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        risultato = conn.execute(testo_query, parametri).fetchall()
+    return (time.perf_counter() - inizio) / ripetizioni * 1000, [tuple(r) for r in risultato]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delle query di polling del fog node")
+    parser.add_argument("--righe", type=int, default=10_000_000, help="numero di misurazioni sintetiche")
+    parser.add_argument("--ripetizioni", type=int, default=3, help="esecuzioni per ogni query")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cartella:
+        percorso = os.path.join(cartella, "polling.sqlite")
+        inizio = time.perf_counter()
+        costruisci_database(percorso, args.righe)
+        print(f"Database sintetico: {args.righe} misurazioni, costruito in {time.perf_counter() - inizio:.1f}s")
+
+        conn = sqlite3.connect(percorso)
+        for nome in QUERY_ATTUALI:
+            t, r = cronometra(conn, QUERY_PRECEDENTI[nome], args.ripetizioni)
+            print(f"{nome:<20} precedente, senza indici  {t:>10.2f} ms  {[x[0] for x in r]}")
+            t, r = cronometra(conn, QUERY_ATTUALI[nome], args.ripetizioni, PARAMETRI_ATTUALI[nome])
+            print(f"{nome:<20} attuale, senza indici     {t:>10.2f} ms  {[x[0] for x in r]}")
+
+        inizio = time.perf_counter()
+        for _, istruzioni in query.MIGRAZIONI_SCHEMA:
+            for istruzione in istruzioni:
+                conn.execute(istruzione)
+        conn.commit()
+        print(f"Migrazioni applicate in {time.perf_counter() - inizio:.1f}s")
+
+        for nome in QUERY_ATTUALI:
+            t, r = cronometra(conn, QUERY_ATTUALI[nome], args.ripetizioni, PARAMETRI_ATTUALI[nome])
+            print(f"{nome:<20} attuale, con indici       {t:>10.2f} ms  {[x[0] for x in r]}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
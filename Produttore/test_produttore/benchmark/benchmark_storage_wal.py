@@ -0,0 +1,84 @@
+"""
+Benchmark del profilo di storage SQLite del fog node.
+Misura il ritmo di ingestione delle misurazioni (inserimenti singoli con commit) mentre
+un thread separato legge ripetutamente un batch completo da 1023 misurazioni,
+come fa la pipeline di elaborazione dei batch.
+Confronta il rollback journal con synchronous=FULL (comportamento precedente)
+con il profilo WAL + synchronous=NORMAL.
+
+Esecuzione: python benchmark_storage_wal.py --durata 5
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from database.gestore_db import GestoreDatabase
+
+PROFILI = {
+    "rollback_journal": {"journal_mode": "DELETE", "synchronous": "FULL"},
+    "wal": {"journal_mode": "WAL", "synchronous": "NORMAL"},
+}
+DIMENSIONE_BATCH = 1023
+DATI_MISURAZIONE = '{"pressed":true,"x":0.12,"y":-0.5}'
+
+
+def esegui_profilo(nome: str, profilo: dict, durata: float, con_lettore: bool) -> dict:
+    with tempfile.TemporaryDirectory() as cartella:
+        gestore = GestoreDatabase(soglia_batch=DIMENSIONE_BATCH, profilo_storage=profilo,
+                                  percorso_db=os.path.join(cartella, "benchmark.sqlite"))
+        gestore.inserisci_dati_sensore("JOY001", "Joystick benchmark", "joystick")
+        # batch 1 completo: è quello che il lettore rilegge durante la misura
+        gestore.inserisci_misurazioni_bulk([("JOY001", DATI_MISURAZIONE)] * DIMENSIONE_BATCH)
+
+        stop = threading.Event()
+        letture = [0]
+
+        def lettore():
+            while not stop.is_set():
+                if len(gestore.estrai_dati_batch_misurazioni(1)) == DIMENSIONE_BATCH:
+                    letture[0] += 1
+
+        thread_lettore = threading.Thread(target=lettore)
+        if con_lettore:
+            thread_lettore.start()
+
+        inserite = fallite = 0
+        inizio = time.perf_counter()
+        while time.perf_counter() - inizio < durata:
+            if gestore.inserisci_misurazione("JOY001", DATI_MISURAZIONE):
+                inserite += 1
+            else:
+                fallite += 1
+        trascorso = time.perf_counter() - inizio
+        stop.set()
+        if con_lettore:
+            thread_lettore.join()
+        gestore.chiudi_connessione()
+
+    return {
+        "profilo": nome,
+        "lettore_concorrente": con_lettore,
+        "misurazioni_al_secondo": inserite / trascorso,
+        "inserimenti_falliti": fallite,
+        "letture_batch_al_secondo": letture[0] / trascorso,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestione SQLite con lettura concorrente di un batch")
+    parser.add_argument("--durata", type=float, default=5.0, help="durata di ogni misura in secondi")
+    args = parser.parse_args()
+
+    for nome, profilo in PROFILI.items():
+        for con_lettore in (False, True):
+            r = esegui_profilo(nome, profilo, args.durata, con_lettore)
+            print(f"{r['profilo']:<17} lettore={'si' if r['lettore_concorrente'] else 'no':<3} "
+                  f"ingestione={r['misurazioni_al_secondo']:>9.0f} mis/s  "
+                  f"falliti={r['inserimenti_falliti']:<5} "
+                  f"letture batch={r['letture_batch_al_secondo']:>6.1f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Harness locale per il caricamento dei Merkle Path su IPFS, con moto al posto di Filebase.
+Conta le richieste HTTP inviate all'endpoint S3 (evento botocore "before-send") per N batch:
+- flusso precedente: nuovo client per batch + list_buckets + put_object + head_object
+- flusso attuale: client condiviso, bucket verificato una volta, CID letto dalla risposta alla put
+Verifica inoltre il caricamento multipart di un file sopra SOGLIA_MULTIPART_IPFS.
+
+Filebase restituisce il CID nell'header x-amz-meta-cid: moto non lo fa, quindi l'harness
+lo aggiunge alle risposte di PutObject, CompleteMultipartUpload e HeadObject (evento "before-parse").
+
+Esecuzione: python harness_ipfs_moto.py --batch 50
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+import boto3
+from moto import mock_aws
+
+from costanti_produttore import BUCKET_MERKLE_PATH, SOGLIA_MULTIPART_IPFS
+from ipfs_client import IpfsClient
+
+OPERAZIONI_CON_CID = ("PutObject", "CompleteMultipartUpload", "HeadObject")
+
+
+def strumenta(client, contatore: Counter) -> None:
+    """Registra sul client il conteggio delle richieste e la simulazione del CID di Filebase."""
+    def conta(request, event_name, **kwargs):
+        # event_name = "before-send.s3.<Operazione>"
+        contatore[event_name.rsplit(".", 1)[-1]] += 1
+
+    def aggiungi_cid(operation_model, response_dict, **kwargs):
+        if operation_model.name in OPERAZIONI_CON_CID and response_dict["status_code"] < 300:
+            response_dict["headers"]["x-amz-meta-cid"] = "bafy" + hashlib.sha256(
+                str(response_dict["headers"].get("etag", "")).encode()).hexdigest()[:40]
+
+    client.meta.events.register("before-send.s3", conta)
+    client.meta.events.register("before-parse.s3", aggiungi_cid)
+
+
+def merkle_path_sintetico(indice: int, foglie: int = 1024) -> str:
+    hash_fittizio = hashlib.sha256(str(indice).encode()).hexdigest()
+    return json.dumps({i: {"dir": "0101010101", "hash": [hash_fittizio] * 10} for i in range(foglie)},
+                      sort_keys=True, separators=(",", ":"), indent=2)
+
+
+def flusso_precedente(paths: list[str], contatore: Counter) -> list[str]:
+    cid = []
+    for merkle_path in paths:
+        # un nuovo client (e nuove connessioni) per ogni batch
+        client = IpfsClient(endpoint_url=None)
+        strumenta(client.s3, contatore)
+        nomi = [b["Name"] for b in client.s3.list_buckets()["Buckets"]]
+        if BUCKET_MERKLE_PATH not in nomi:
+            client.s3.create_bucket(Bucket=BUCKET_MERKLE_PATH)
+        nome_file = IpfsClient._genera_nome_file(merkle_path) + ".gz"
+        client.s3.put_object(Bucket=BUCKET_MERKLE_PATH, Key=nome_file,
+                             Body=IpfsClient._genera_contenuto_gzip(merkle_path), ContentType="application/gzip")
+        cid.append(client.recupera_cid_file_bucket(BUCKET_MERKLE_PATH, nome_file))
+    return cid
+
+
+def flusso_attuale(paths: list[str], contatore: Counter) -> list[str]:
+    client = IpfsClient(endpoint_url=None)
+    strumenta(client.s3, contatore)
+    return [client.carica_json(BUCKET_MERKLE_PATH, merkle_path, comprimi_dimensione=True) for merkle_path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conteggio richieste S3 per il caricamento dei Merkle Path")
+    parser.add_argument("--batch", type=int, default=50, help="numero di batch da caricare")
+    args = parser.parse_args()
+    paths = [merkle_path_sintetico(i) for i in range(args.batch)]
+
+    for nome, flusso in (("precedente", flusso_precedente), ("attuale", flusso_attuale)):
+        with mock_aws():
+            contatore = Counter()
+            inizio = time.perf_counter()
+            cid = flusso(paths, contatore)
+            durata = time.perf_counter() - inizio
+            assert all(cid), "CID mancante"
+            totale = sum(contatore.values())
+            print(f"{nome:>10}: {totale} richieste ({totale / args.batch:.2f} per batch), "
+                  f"{durata * 1000 / args.batch:.1f} ms per batch -> {dict(contatore)}")
+
+    # file oltre la soglia: upload multipart e CID recuperato con head_object
+    with mock_aws():
+        contatore = Counter()
+        client = IpfsClient(endpoint_url=None)
+        strumenta(client.s3, contatore)
+        contenuto = os.urandom(SOGLIA_MULTIPART_IPFS + 1024)
+        cid = client.carica_contenuto(BUCKET_MERKLE_PATH, "merkle_path_grande.bin", contenuto,
+                                      "application/octet-stream")
+        cid = cid or client.recupera_cid_file_bucket(BUCKET_MERKLE_PATH, "merkle_path_grande.bin")
+        scaricato = boto3.client("s3").get_object(Bucket=BUCKET_MERKLE_PATH, Key="merkle_path_grande.bin")
+        assert scaricato["Body"].read() == contenuto
+        print(f" multipart: {len(contenuto) / 2 ** 20:.1f} MiB, CID={cid} -> {dict(contatore)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
+import json
+from typing import Iterator
+
 import requests
 from Classi_comuni.entita.modelli_dati import DatiPayload, DatiBatch, DatiMisurazione
-from Verificatore.config.costanti_verificatore import ENDPOINT_CLOUD_PROVIDER, API_KEY_VERIFICATORE
+from Verificatore.config.costanti_verificatore import ENDPOINT_CLOUD_PROVIDER, API_KEY_VERIFICATORE, \
+    TIMEOUT_HTTP_VERIFICATORE, ENDPOINT_CLOUD_PROVIDER_MULTIPLO, MODALITA_VERIFICA_CLOUD
 
-def richiedi_mappa_id_hash_batch(id_batch: int) -> dict[int, str]:
+def richiedi_mappa_id_hash_batch(id_batch: int, sessione: requests.Session | None = None) -> dict[int, str]:
     """
     Richiede al Cloud Provider la mappa ID → hash delle foglie di un batch.
+    Se viene passata una sessione, la richiesta riusa le sue connessioni (verifica di più batch).
     """
     headers = {"X-API-Key": API_KEY_VERIFICATORE}
-    params = {"id": id_batch}
+    params = {"id": id_batch, "modalita": MODALITA_VERIFICA_CLOUD}
 
-    response = requests.get(ENDPOINT_CLOUD_PROVIDER, headers=headers, params=params)
+    response = (sessione or requests).get(ENDPOINT_CLOUD_PROVIDER, headers=headers, params=params,
+                                         timeout=TIMEOUT_HTTP_VERIFICATORE)
 
     if response.status_code != 200:
         raise ValueError(f"Errore nella richiesta: {response.status_code} - {response.text}")
@@ -18,3 +24,29 @@ def richiedi_mappa_id_hash_batch(id_batch: int) -> dict[int, str]:
     mappa_str = response.json()
     return {int(k): v for k, v in mappa_str.items()}
 
+
+def richiedi_mappe_id_hash_batch(lista_id: list[int],
+                                 sessione: requests.Session | None = None) -> Iterator[tuple[int, dict[int, str]]]:
+    """
+    Richiede al Cloud Provider le mappe ID → hash di più batch con una sola richiesta
+    e le restituisce man mano che arrivano (risposta NDJSON, una riga per batch).
+    I batch non presenti nel cloud hanno una mappa vuota. Un intervallo contiguo di ID
+    viene inviato come ?da=&a=, altrimenti come elenco di ID.
+    """
+    headers = {"X-API-Key": API_KEY_VERIFICATORE}
+    if lista_id == list(range(lista_id[0], lista_id[0] + len(lista_id))):
+        params = {"da": lista_id[0], "a": lista_id[-1], "modalita": MODALITA_VERIFICA_CLOUD}
+    else:
+        params = {"ids": lista_id, "modalita": MODALITA_VERIFICA_CLOUD}
+
+    with (sessione or requests).get(ENDPOINT_CLOUD_PROVIDER_MULTIPLO, headers=headers, params=params,
+                                    stream=True, timeout=TIMEOUT_HTTP_VERIFICATORE) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Errore nella richiesta: {response.status_code} - {response.text}")
+        for riga in response.iter_lines():
+            if not riga:
+                continue
+            dati = json.loads(riga)
+            if "id_batch" not in dati:
+                raise ValueError(f"Errore del cloud provider: {dati.get('errore')}")
+            yield dati["id_batch"], {int(k): v for k, v in (dati.get("mappa") or {}).items()}
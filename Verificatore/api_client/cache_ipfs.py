@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import uuid
+from typing import Callable
+
+from Classi_comuni.albero_livelli import e_livelli_albero
+from Classi_comuni.formato_path_binario import e_formato_binario, scrivi_paths_compatti
+from Verificatore.config.costanti_verificatore import CACHE_IPFS_ATTIVA, CARTELLA_CACHE_IPFS, \
+    DIMENSIONE_MAX_CACHE_IPFS
+from Verificatore.verifica.verificatore_utils import carica_paths_da_bytes
+
+logger = logging.getLogger(__name__)
+
+# i CID (v0 base58, v1 base32) sono alfanumerici: qualsiasi altro carattere è rifiutato
+_FORMATO_CID = re.compile(r"^[A-Za-z0-9]{1,128}$")
+ESTENSIONE_DATI = ".bin"
+ESTENSIONE_IMPRONTA = ".sha256"
+
+"""
+Cache su disco dei file dei Merkle Path scaricati da IPFS, con chiave il CID.
+Un CID identifica un contenuto immutabile: una volta scaricato, il file non va più richiesto
+al gateway e una nuova verifica dello stesso batch non usa la rete per i Merkle Path
+(la mappa ID → hash va invece sempre richiesta al cloud: è il dato sotto verifica).
+
+Ogni voce è composta da due file nella cartella della cache:
+- <cid>.bin      contenuto in forma binaria pronta da caricare: i livelli dell'albero (MKTL,
+                 aperti con mmap) e il formato binario (MKPB) sono salvati invariati, il JSON
+                 viene convertito una sola volta nel formato binario;
+- <cid>.sha256   SHA-256 del file .bin, controllato a ogni lettura: una voce danneggiata
+                 viene eliminata e il file riscaricato.
+Le scritture sono atomiche (file temporaneo + os.replace). La data di modifica del file .bin
+registra l'ultimo utilizzo: oltre `dimensione_max` byte si eliminano le voci usate meno di recente.
+"""
+class CacheMerklePath:
+    def __init__(self, cartella: str = CARTELLA_CACHE_IPFS, dimensione_max: int = DIMENSIONE_MAX_CACHE_IPFS):
+        self.cartella = os.path.abspath(cartella)
+        self.dimensione_max = dimensione_max
+        self._lock_eliminazione = threading.Lock()
+        # un lock per CID: richieste concorrenti dello stesso file lo scaricano una sola volta
+        # (lock, numero di thread che lo usano): rimosso quando nessuno lo usa più
+        self._lock_cid: dict[str, list] = {}
+        self._lock_tabella = threading.Lock()
+        os.makedirs(self.cartella, exist_ok=True)
+
+    def _percorsi(self, cid: str) -> tuple[str, str]:
+        if not _FORMATO_CID.match(cid):
+            raise ValueError(f"CID non valido: {cid!r}")
+        base = os.path.join(self.cartella, cid)
+        return base + ESTENSIONE_DATI, base + ESTENSIONE_IMPRONTA
+
+    @staticmethod
+    def _impronta_file(percorso: str) -> str:
+        sha = hashlib.sha256()
+        with open(percorso, "rb") as file:
+            for blocco in iter(lambda: file.read(1024 * 1024), b""):
+                sha.update(blocco)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _normalizza(contenuto: bytes) -> bytes:
+        """Restituisce il contenuto in forma binaria (MKTL o MKPB); il JSON viene convertito."""
+        if e_livelli_albero(contenuto) or e_formato_binario(contenuto):
+            return contenuto
+        try:
+            return scrivi_paths_compatti(carica_paths_da_bytes(contenuto))
+        except ValueError as e:
+            # il contenuto resta in cache così com'è: verrà interpretato a ogni lettura
+            logger.warning(f"[CACHE IPFS] Conversione in formato binario non riuscita: {e}")
+            return contenuto
+
+    def ottieni(self, cid: str) -> str | None:
+        """
+        Restituisce il percorso del file in cache per il CID, o None se assente o danneggiato.
+        """
+        percorso_dati, percorso_impronta = self._percorsi(cid)
+        try:
+            with open(percorso_impronta, encoding="ascii") as file:
+                impronta_attesa = file.read().strip()
+            impronta = self._impronta_file(percorso_dati)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"[CACHE IPFS] Lettura della voce {cid} non riuscita: {e}")
+            return None
+
+        if impronta != impronta_attesa:
+            logger.warning(f"[CACHE IPFS] Voce {cid} danneggiata: eliminata")
+            self.rimuovi(cid)
+            return None
+
+        try:
+            # ultimo utilizzo, per l'eliminazione LRU
+            os.utime(percorso_dati)
+        except OSError:
+            pass
+        return percorso_dati
+
+    def salva(self, cid: str, contenuto: bytes) -> str:
+        """Salva il contenuto scaricato per il CID e restituisce il percorso del file in cache."""
+        percorso_dati, percorso_impronta = self._percorsi(cid)
+        dati = self._normalizza(contenuto)
+        suffisso = f".{uuid.uuid4().hex}.tmp"
+        # prima i dati e poi l'impronta: una voce senza impronta valida non viene mai letta
+        with open(percorso_dati + suffisso, "wb") as file:
+            file.write(dati)
+        with open(percorso_impronta + suffisso, "w", encoding="ascii") as file:
+            file.write(hashlib.sha256(dati).hexdigest())
+        os.replace(percorso_dati + suffisso, percorso_dati)
+        os.replace(percorso_impronta + suffisso, percorso_impronta)
+        self._applica_limite(cid)
+        return percorso_dati
+
+    def ottieni_o_scarica(self, cid: str, scarica: Callable[[], bytes]) -> str:
+        """
+        Restituisce il percorso del file in cache per il CID; se assente lo scarica
+        con `scarica` (che restituisce il contenuto decompresso) e lo salva.
+        """
+        with self._lock_tabella:
+            voce = self._lock_cid.setdefault(cid, [threading.Lock(), 0])
+            voce[1] += 1
+        try:
+            with voce[0]:
+                percorso = self.ottieni(cid)
+                if percorso is not None:
+                    logger.info(f"[CACHE IPFS] Merkle Path {cid} letto dalla cache")
+                    return percorso
+                return self.salva(cid, scarica())
+        finally:
+            with self._lock_tabella:
+                voce[1] -= 1
+                if voce[1] == 0:
+                    del self._lock_cid[cid]
+
+    def rimuovi(self, cid: str) -> None:
+        for percorso in self._percorsi(cid):
+            try:
+                os.remove(percorso)
+            except FileNotFoundError:
+                pass
+
+    def _applica_limite(self, cid_salvato: str) -> None:
+        """
+        Elimina le voci usate meno di recente finché la cache supera dimensione_max.
+        La voce appena salvata non viene eliminata, anche se da sola supera il limite.
+        """
+        with self._lock_eliminazione:
+            voci = []
+            totale = 0
+            with os.scandir(self.cartella) as elenco:
+                for voce in elenco:
+                    if voce.name.endswith(ESTENSIONE_DATI) and voce.is_file():
+                        stato = voce.stat()
+                        voci.append((stato.st_mtime, stato.st_size, voce.name[:-len(ESTENSIONE_DATI)]))
+                        totale += stato.st_size
+            for _, dimensione, cid in sorted(voci):
+                if totale <= self.dimensione_max:
+                    break
+                if cid == cid_salvato:
+                    continue
+                try:
+                    self.rimuovi(cid)
+                except OSError as e:
+                    # es. file ancora mappato in memoria su sistemi che non ne consentono l'eliminazione
+                    logger.warning(f"[CACHE IPFS] Eliminazione della voce {cid} non riuscita: {e}")
+                    continue
+                totale -= dimensione
+                logger.info(f"[CACHE IPFS] Voce {cid} eliminata (limite di {self.dimensione_max} byte)")
+
+
+_cache_ipfs: CacheMerklePath | None = None
+_lock_cache = threading.Lock()
+
+
+def ottieni_cache_ipfs() -> CacheMerklePath | None:
+    """Restituisce la cache condivisa dal processo, o None se disattivata (CACHE_IPFS_ATTIVA)."""
+    global _cache_ipfs
+    if not CACHE_IPFS_ATTIVA:
+        return None
+    if _cache_ipfs is None:
+        with _lock_cache:
+            if _cache_ipfs is None:
+                _cache_ipfs = CacheMerklePath()
+    return _cache_ipfs
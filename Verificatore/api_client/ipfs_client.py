@@ -1,25 +1,89 @@
 import requests
 import gzip
-from io import BytesIO
+import zlib
+from typing import Iterator
 
-def ottieni_file_da_ipfs(cid: str) -> str:
+from Verificatore.config.costanti_verificatore import ENDPOINT_IPFS_FILEBASE, TIMEOUT_HTTP_VERIFICATORE, \
+    DIMENSIONE_BLOCCO_STREAMING
+
+# primi due byte di ogni file gzip
+MAGIC_GZIP = b"\x1f\x8b"
+
+
+def ottieni_bytes_da_ipfs(cid: str, sessione: requests.Session | None = None) -> bytes:
     """
-    Scarica un file da IPFS (tramite Filebase) e restituisce una stringa JSON.
-    Supporta file compressi (gzip) o normali.
+    Scarica un file da IPFS (tramite Filebase) e ne restituisce il contenuto in byte.
+    I file compressi (gzip) vengono decompressi, riconoscendoli dal loro magic number;
+    il contenuto può essere il JSON dei Merkle Path oppure il formato binario.
+    Se viene passata una sessione, la richiesta riusa le sue connessioni (verifica di più batch).
     """
-    url = f"https://ipfs.filebase.io/ipfs/{cid}"
-    response = requests.get(url)
+    url = f"{ENDPOINT_IPFS_FILEBASE}/{cid}"
+    response = (sessione or requests).get(url, timeout=TIMEOUT_HTTP_VERIFICATORE)
 
     if response.status_code != 200:
         raise ValueError(f"Errore nel download: {response.status_code}")
 
-    content_type = response.headers.get("Content-Type", "").lower()
     raw_bytes = response.content  # 🔥 Evita .text
     try:
-        if "gzip" in content_type or cid.endswith(".gz"):
-            with gzip.GzipFile(fileobj=BytesIO(raw_bytes)) as f:
-                return f.read().decode("utf-8")  # 🔥 qui abbiamo il JSON completo
-        else:
-            return raw_bytes.decode("utf-8")  # JSON non compresso
+        if raw_bytes[:2] == MAGIC_GZIP:
+            return gzip.decompress(raw_bytes)
+        return raw_bytes
     except Exception as e:
         raise ValueError(f"Errore nella lettura o decompressione del file: {e}")
+
+
+def itera_bytes_da_ipfs(cid: str, sessione: requests.Session | None = None,
+                        dimensione_blocco: int = DIMENSIONE_BLOCCO_STREAMING) -> Iterator[bytes]:
+    """
+    Scarica un file da IPFS in streaming e ne restituisce il contenuto a blocchi,
+    decompresso man mano (gzip riconosciuto dal magic number) senza tenere in memoria
+    né il file compresso né quello decompresso per intero.
+    """
+    url = f"{ENDPOINT_IPFS_FILEBASE}/{cid}"
+    with (sessione or requests).get(url, stream=True, timeout=TIMEOUT_HTTP_VERIFICATORE) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Errore nel download: {response.status_code}")
+
+        decompressore = None
+        inizio = b""
+        try:
+            for blocco in response.iter_content(dimensione_blocco):
+                if decompressore is None and inizio is not None:
+                    # servono i primi due byte per riconoscere il formato
+                    inizio += blocco
+                    if len(inizio) < len(MAGIC_GZIP):
+                        continue
+                    blocco, inizio = inizio, None
+                    if blocco[:2] == MAGIC_GZIP:
+                        # wbits 16 + MAX_WBITS: formato gzip (header e trailer)
+                        decompressore = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if decompressore is None:
+                    yield blocco
+                    continue
+                # max_length limita ogni blocco decompresso: il residuo resta in unconsumed_tail
+                while blocco:
+                    parte = decompressore.decompress(blocco, dimensione_blocco)
+                    if parte:
+                        yield parte
+                    blocco = decompressore.unconsumed_tail
+            if inizio:
+                yield inizio  # file più corto del magic number
+            if decompressore is not None:
+                resto = decompressore.flush()
+                if resto:
+                    yield resto
+                if not decompressore.eof:
+                    raise ValueError("file gzip troncato")
+        except zlib.error as e:
+            raise ValueError(f"Errore nella lettura o decompressione del file: {e}")
+
+
+def ottieni_file_da_ipfs(cid: str) -> str:
+    """
+    Scarica un file da IPFS (tramite Filebase) e restituisce una stringa JSON.
+    Supporta file compressi (gzip) o normali.
+    """
+    try:
+        return ottieni_bytes_da_ipfs(cid).decode("utf-8")  # 🔥 qui abbiamo il JSON completo
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Errore nella lettura o decompressione del file: {e}")
@@ -10,5 +10,29 @@ load_dotenv(PERCORSO_ENV_KEY)
 
 # ===
 ENDPOINT_CLOUD_PROVIDER = "http://localhost:8080/batch/mappa-id-hash"
+ENDPOINT_CLOUD_PROVIDER_MULTIPLO = "http://localhost:8080/batch/mappa-id-hash/multipla"
 ENDPOINT_IPFS_FILEBASE = "https://ipfs.filebase.io/ipfs"
-API_KEY_VERIFICATORE=os.getenv("API_KEY_VERIFICATORE")
\ No newline at end of file
+API_KEY_VERIFICATORE=os.getenv("API_KEY_VERIFICATORE")
+# mappe ID → hash richieste al cloud: "audit" (ricalcolate dalle righe salvate, default)
+# o "rapida" (hash salvati alla ricezione: non rileva modifiche successive alle righe)
+MODALITA_VERIFICA_CLOUD = os.getenv("MODALITA_VERIFICA_CLOUD", "audit")
+
+# === Verifica di più batch (main_verifica_multipla) ===
+# download concorrenti dal cloud provider e da IPFS (thread)
+CONCORRENZA_DOWNLOAD_VERIFICA = int(os.getenv("CONCORRENZA_DOWNLOAD_VERIFICA", "8"))
+# batch le cui mappe ID → hash sono richieste al cloud con una sola richiesta
+# (le mappe di un blocco sono tenute in memoria fino alla loro verifica)
+DIMENSIONE_BLOCCO_MAPPE = int(os.getenv("DIMENSIONE_BLOCCO_MAPPE", "100"))
+# processi che eseguono la verifica delle foglie (CPU)
+NUM_PROCESSI_VERIFICA = int(os.getenv("NUM_PROCESSI_VERIFICA", str(os.cpu_count() or 2)))
+# timeout (secondi) delle richieste HTTP del verificatore
+TIMEOUT_HTTP_VERIFICATORE = 30
+
+# === Cache locale dei file dei Merkle Path scaricati da IPFS (chiave: CID) ===
+CACHE_IPFS_ATTIVA = os.getenv("CACHE_IPFS_ATTIVA", "1") == "1"
+CARTELLA_CACHE_IPFS = os.getenv("CARTELLA_CACHE_IPFS", os.path.join(DIR_CORRENTE, "..", "cache_ipfs"))
+# dimensione massima dei file in cache (byte): oltre il limite si eliminano i meno usati di recente
+DIMENSIONE_MAX_CACHE_IPFS = int(os.getenv("DIMENSIONE_MAX_CACHE_IPFS", str(1024 * 1024 * 1024)))
+
+# dimensione (byte) dei blocchi letti durante lo scaricamento in streaming dei Merkle Path
+DIMENSIONE_BLOCCO_STREAMING = 64 * 1024
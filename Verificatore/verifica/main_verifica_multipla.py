@@ -0,0 +1,83 @@
+import argparse
+import logging
+import sys
+
+from Verificatore.config.costanti_verificatore import CONCORRENZA_DOWNLOAD_VERIFICA, NUM_PROCESSI_VERIFICA
+from Verificatore.verifica.verifica_multipla import esegui_verifica_multipla
+
+"""
+Verifica di più batch da riga di comando.
+Esempi:
+  python -m Verificatore.verifica.main_verifica_multipla --da 1 --a 500 --output esiti.jsonl
+  python -m Verificatore.verifica.main_verifica_multipla --file id_batch.txt --concorrenza 16 --processi 4
+Scrive una riga JSON per batch e una riga finale di riepilogo (stdout se --output non è indicato).
+"""
+
+
+def leggi_id_da_file(percorso: str) -> list[int]:
+    """Legge un ID batch per riga, ignorando righe vuote e commenti (#)."""
+    with open(percorso, encoding="utf-8") as file:
+        return [int(riga.split("#", 1)[0]) for riga in file if riga.split("#", 1)[0].strip()]
+
+
+def ottieni_lista_id(args: argparse.Namespace) -> list[int]:
+    lista_id = list(args.id or [])
+    if args.da is not None:
+        lista_id.extend(range(args.da, args.a + 1))
+    if args.file:
+        lista_id.extend(leggi_id_da_file(args.file))
+    # ogni batch viene verificato una sola volta, nell'ordine indicato
+    return list(dict.fromkeys(lista_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica dell'integrità di più batch in parallelo")
+    parser.add_argument("--id", type=int, nargs="+", help="ID dei batch da verificare")
+    parser.add_argument("--da", type=int, help="primo ID dell'intervallo (incluso)")
+    parser.add_argument("--a", type=int, help="ultimo ID dell'intervallo (incluso)")
+    parser.add_argument("--file", help="file con un ID batch per riga")
+    parser.add_argument("--concorrenza", type=int, default=CONCORRENZA_DOWNLOAD_VERIFICA,
+                        help="download concorrenti da cloud provider e IPFS")
+    parser.add_argument("--processi", type=int, default=NUM_PROCESSI_VERIFICA,
+                        help="processi per la verifica delle foglie")
+    parser.add_argument("--output", help="file JSON Lines degli esiti (default: stdout)")
+    parser.add_argument("--mappe-singole", action="store_true",
+                        help="richiede la mappa ID → hash di ogni batch separatamente (cloud senza endpoint multiplo)")
+    parser.add_argument("--log", default="WARNING", help="livello di log (default: WARNING)")
+    args = parser.parse_args()
+
+    if (args.da is None) != (args.a is None):
+        parser.error("--da e --a vanno indicati insieme")
+    if args.da is not None and args.a < args.da:
+        parser.error("intervallo vuoto: --a deve essere maggiore o uguale a --da")
+    if args.concorrenza < 1 or args.processi < 1:
+        parser.error("--concorrenza e --processi devono essere almeno 1")
+    lista_id = ottieni_lista_id(args)
+    if not lista_id:
+        parser.error("indicare i batch con --id, --da/--a o --file")
+
+    # il log va su stderr: stdout resta riservato agli esiti JSON Lines
+    logging.basicConfig(level=args.log.upper(), stream=sys.stderr,
+                        format="%(asctime)s | %(levelname)s | %(message)s")
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        riepilogo = esegui_verifica_multipla(lista_id, output, args.concorrenza, args.processi,
+                                             not args.mappe_singole)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"\n=== RIEPILOGO VERIFICA ===\n"
+          f"Batch verificati: {riepilogo['batch_verificati']} "
+          f"(integri {riepilogo['batch_integri']}, alterati {riepilogo['batch_alterati']}, "
+          f"in errore {riepilogo['batch_in_errore']})\n"
+          f"Foglie verificate: {riepilogo['foglie_verificate']}, anomalie: {riepilogo['anomalie_totali']}\n"
+          f"Durata: {riepilogo['durata_s']} s – {riepilogo['batch_al_secondo']} batch/s, "
+          f"{riepilogo['foglie_al_secondo']} foglie/s", file=sys.stderr)
+    # codice di uscita diverso da zero se almeno un batch non è integro
+    sys.exit(0 if riepilogo["batch_integri"] == riepilogo["batch_verificati"] else 1)
+
+
+if __name__ == "__main__":
+    main()
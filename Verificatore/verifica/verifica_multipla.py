@@ -0,0 +1,202 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, TextIO, TypedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from Verificatore.api_client.api_cloud import richiedi_mappe_id_hash_batch
+from Verificatore.config.costanti_verificatore import CONCORRENZA_DOWNLOAD_VERIFICA, NUM_PROCESSI_VERIFICA, \
+    DIMENSIONE_BLOCCO_MAPPE
+from Verificatore.verifica.verificatore import Verificatore, RisultatoVerifica, STATO_NESSUN_ERRORE, \
+    crea_risultato_vuoto, verifica_dati_scaricati
+
+logger = logging.getLogger(__name__)
+
+"""
+Verifica dell'integrità di più batch in parallelo.
+Le mappe ID → hash vengono richieste al cloud a blocchi di DIMENSIONE_BLOCCO_MAPPE batch
+(una richiesta e una query per blocco); ogni risposta viene letta per intero prima di iniziare
+le verifiche del blocco, così lato cloud connessione, transazione e cursore restano occupati solo
+per il tempo del trasferimento e non per quello della verifica. Se la richiesta in blocco non
+riesce, i batch restanti del blocco richiedono la propria mappa singolarmente.
+Le due fasi della verifica di un batch hanno colli di bottiglia diversi:
+- scaricamento (mappa ID → hash dal cloud provider, Merkle Path da IPFS): I/O, eseguito da un
+  pool di `concorrenza` thread che condividono una requests.Session (connessioni riutilizzate);
+  i Merkle Path già presenti nella cache locale (CacheMerklePath) non vengono riscaricati
+  e ai processi passa solo il percorso del file;
+- verifica delle foglie (lettura dei Merkle Path e hash): CPU, eseguita da un pool di `processi`
+  processi, senza contesa sul GIL.
+I batch scaricati e non ancora verificati sono al massimo 2 x processi: se la CPU è più lenta
+della rete, i download si fermano invece di accumulare file in memoria.
+Gli esiti vengono restituiti appena disponibili (non nell'ordine degli ID).
+"""
+
+
+class EsitoBatch(TypedDict):
+    id_batch: int
+    esito_globale: bool
+    stato_elaborazione: str
+    numero_foglie: int
+    numero_anomalie: int
+    anomalie: list[dict]
+    tempo_scaricamento_ms: float
+    tempo_verifica_ms: float
+
+
+def _crea_sessione(concorrenza: int) -> requests.Session:
+    """Sessione HTTP condivisa dai thread di download, con un pool di connessioni per host."""
+    sessione = requests.Session()
+    adattatore = HTTPAdapter(pool_connections=2, pool_maxsize=concorrenza)
+    sessione.mount("http://", adattatore)
+    sessione.mount("https://", adattatore)
+    return sessione
+
+
+def _sorgente_batch(lista_id: Iterable[int], sessione: requests.Session,
+                    mappe_in_blocco: bool) -> Iterator[tuple[int, dict[int, str] | None]]:
+    """Restituisce (id_batch, mappa ID → hash già ricevuta o None) per ogni batch da verificare."""
+    if not mappe_in_blocco:
+        for id_batch in lista_id:
+            yield id_batch, None
+        return
+    lista_id = list(lista_id)
+    for inizio in range(0, len(lista_id), DIMENSIONE_BLOCCO_MAPPE):
+        blocco = lista_id[inizio:inizio + DIMENSIONE_BLOCCO_MAPPE]
+        mappe: dict[int, dict[int, str]] = {}
+        try:
+            # risposta letta per intero: non resta aperta al ritmo delle verifiche
+            for id_batch, mappa in richiedi_mappe_id_hash_batch(blocco, sessione):
+                mappe[id_batch] = mappa
+        except Exception as e:
+            logger.warning(f"Richiesta in blocco delle mappe ID → hash non riuscita, "
+                           f"richieste per singolo batch: {e}")
+        for id_batch in blocco:
+            yield id_batch, mappe.pop(id_batch, None)
+
+
+def _scarica_batch(id_batch: int, mappa_id_hash: dict[int, str] | None,
+                   sessione: requests.Session) -> tuple[Verificatore, RisultatoVerifica, bool, float]:
+    """Fase di I/O di un batch (thread): restituisce verificatore, risultati, esito e durata."""
+    inizio = time.perf_counter()
+    verificatore = Verificatore(id_batch, sessione)
+    if mappa_id_hash:
+        verificatore.mappa_id_hash = mappa_id_hash
+    risultati = crea_risultato_vuoto()
+    scaricato = verificatore.scarica_input(risultati)
+    return verificatore, risultati, scaricato, (time.perf_counter() - inizio) * 1000
+
+
+def _crea_esito(id_batch: int, risultati: RisultatoVerifica, tempo_scaricamento_ms: float,
+                tempo_verifica_ms: float = 0.0) -> EsitoBatch:
+    """Riduce il risultato di una verifica a una riga di esito (le foglie integre sono solo contate)."""
+    dettagli = risultati["dettagli"]
+    return {
+        "id_batch": id_batch,
+        "esito_globale": risultati["esito_globale"],
+        "stato_elaborazione": risultati["stato_elaborazione"],
+        "numero_foglie": len(dettagli["integre"]) + len(dettagli["anomalie"]),
+        "numero_anomalie": risultati["numero_anomalie"],
+        "anomalie": dettagli["anomalie"],
+        "tempo_scaricamento_ms": round(tempo_scaricamento_ms, 2),
+        "tempo_verifica_ms": round(tempo_verifica_ms, 2),
+    }
+
+
+def verifica_batch_multipli(lista_id: Iterable[int], concorrenza: int = CONCORRENZA_DOWNLOAD_VERIFICA,
+                            processi: int = NUM_PROCESSI_VERIFICA,
+                            mappe_in_blocco: bool = True) -> Iterator[EsitoBatch]:
+    """
+    Verifica i batch indicati e restituisce l'esito di ciascuno appena disponibile.
+    Gli errori di un batch (rete, IPFS, file non valido) sono riportati nel suo esito
+    (stato_elaborazione) e non interrompono la verifica degli altri.
+    """
+    max_in_attesa_verifica = 2 * processi
+    in_scaricamento: dict[Future, int] = {}
+    in_verifica: dict[Future, tuple[int, float, float]] = {}
+
+    sessione = _crea_sessione(concorrenza)
+    da_verificare = _sorgente_batch(lista_id, sessione, mappe_in_blocco)
+    try:
+        with ThreadPoolExecutor(max_workers=concorrenza) as esecutore_io, \
+                ProcessPoolExecutor(max_workers=processi) as esecutore_cpu:
+
+            def riempi_scaricamenti() -> None:
+                while len(in_scaricamento) < concorrenza \
+                        and len(in_scaricamento) + len(in_verifica) < concorrenza + max_in_attesa_verifica:
+                    prossimo = next(da_verificare, None)
+                    if prossimo is None:
+                        return
+                    id_batch, mappa_id_hash = prossimo
+                    in_scaricamento[esecutore_io.submit(_scarica_batch, id_batch, mappa_id_hash, sessione)] = id_batch
+
+            riempi_scaricamenti()
+            while in_scaricamento or in_verifica:
+                completati, _ = wait([*in_scaricamento, *in_verifica], return_when=FIRST_COMPLETED)
+                for futuro in completati:
+                    if futuro in in_scaricamento:
+                        id_batch = in_scaricamento.pop(futuro)
+                        verificatore, risultati, scaricato, tempo_scaricamento = futuro.result()
+                        if not scaricato:
+                            yield _crea_esito(id_batch, risultati, tempo_scaricamento)
+                            continue
+                        futuro_verifica = esecutore_cpu.submit(
+                            verifica_dati_scaricati, id_batch, verificatore.mappa_id_hash,
+                            verificatore.merkle_root_immutabile, verificatore.contenuto_merkle_path,
+                            verificatore.percorso_merkle_path)
+                        in_verifica[futuro_verifica] = (id_batch, tempo_scaricamento, time.perf_counter())
+                    else:
+                        id_batch, tempo_scaricamento, inizio_verifica = in_verifica.pop(futuro)
+                        try:
+                            risultati = futuro.result()
+                        except Exception as e:
+                            logger.exception(f"[ERRORE] Verifica del batch {id_batch} non completata")
+                            risultati = crea_risultato_vuoto()
+                            risultati["stato_elaborazione"] = f"Errore durante la verifica: {e}"
+                        yield _crea_esito(id_batch, risultati, tempo_scaricamento,
+                                          (time.perf_counter() - inizio_verifica) * 1000)
+                riempi_scaricamenti()
+    finally:
+        da_verificare.close()
+        sessione.close()
+
+
+def esegui_verifica_multipla(lista_id: Iterable[int], output: TextIO,
+                             concorrenza: int = CONCORRENZA_DOWNLOAD_VERIFICA,
+                             processi: int = NUM_PROCESSI_VERIFICA, mappe_in_blocco: bool = True) -> dict:
+    """
+    Verifica i batch e scrive su `output` una riga JSON per batch (JSON Lines) appena verificato,
+    seguita da una riga di riepilogo con i totali e il throughput. Restituisce il riepilogo.
+    """
+    riepilogo = {
+        "tipo": "riepilogo",
+        "batch_verificati": 0,
+        "batch_integri": 0,
+        "batch_alterati": 0,
+        "batch_in_errore": 0,
+        "foglie_verificate": 0,
+        "anomalie_totali": 0,
+    }
+    inizio = time.perf_counter()
+    for esito in verifica_batch_multipli(lista_id, concorrenza, processi, mappe_in_blocco):
+        output.write(json.dumps({"tipo": "batch", **esito}, ensure_ascii=False) + "\n")
+        output.flush()
+        riepilogo["batch_verificati"] += 1
+        riepilogo["foglie_verificate"] += esito["numero_foglie"]
+        riepilogo["anomalie_totali"] += esito["numero_anomalie"]
+        if esito["esito_globale"]:
+            riepilogo["batch_integri"] += 1
+        elif esito["stato_elaborazione"] != STATO_NESSUN_ERRORE:
+            riepilogo["batch_in_errore"] += 1
+        else:
+            riepilogo["batch_alterati"] += 1
+
+    durata = time.perf_counter() - inizio
+    riepilogo["durata_s"] = round(durata, 3)
+    riepilogo["batch_al_secondo"] = round(riepilogo["batch_verificati"] / durata, 2) if durata else 0.0
+    riepilogo["foglie_al_secondo"] = round(riepilogo["foglie_verificate"] / durata, 1) if durata else 0.0
+    output.write(json.dumps(riepilogo, ensure_ascii=False) + "\n")
+    output.flush()
+    return riepilogo
@@ -1,15 +1,22 @@
 import logging
+import requests
 from Classi_comuni.entita.modelli_dati import DatiPayload
 from Verificatore.api_client.api_cloud import richiedi_mappa_id_hash_batch
-from Verificatore.api_client.ipfs_client import ottieni_file_da_ipfs
-from Verificatore.verifica.verificatore_utils import carica_paths_da_json_string
-from typing import TypedDict
+from Verificatore.api_client.ipfs_client import ottieni_bytes_da_ipfs, itera_bytes_da_ipfs
+from Verificatore.api_client.cache_ipfs import CacheMerklePath, ottieni_cache_ipfs
+from Verificatore.verifica.verificatore_utils import carica_paths_da_bytes, carica_paths_da_file, \
+    apri_paths_da_stream
+from typing import Dict, Iterable, Mapping, TypedDict
 from costanti_comuni import ID_BATCH_LOGICO
 from Classi_comuni.merkle_tree import PathCompatto, MerkleTree
+from Classi_comuni.albero_livelli import AlberoLivelli
 
 # Logger per messaggi informativi, di errore e di debug
 logger = logging.getLogger(__name__)
 
+# Stato di una verifica completata senza errori bloccanti
+STATO_NESSUN_ERRORE = "Nessun errore in fase di esecuzione"
+
 # TypedDict che definisce la struttura dell’output della verifica
 class DettagliVerifica(TypedDict):
     integre: list[dict]
@@ -28,7 +35,8 @@ class Verificatore:
     confrontando i dati hashati con quelli registrati tramite Merkle Root e Merkle Path.
     """
 
-    def __init__(self, id_batch: int) -> None:
+    def __init__(self, id_batch: int, sessione: requests.Session | None = None,
+                 cache: CacheMerklePath | None = None) -> None:
         # ID del batch da verificare
         self.id_batch = id_batch
 
@@ -42,14 +50,33 @@ class Verificatore:
         self.cid_merkle_path: str | None = None
 
         # Dizionario dei Merkle Path {id_misurazione: PathCompatto}
-        self.merkle_paths: dict[int, PathCompatto] = {}
+        # (AlberoLivelli se IPFS contiene i livelli dell'albero: path derivati su richiesta)
+        self.merkle_paths: Mapping[int, PathCompatto] = {}
+
+        # Contenuto del file dei Merkle Path scaricato da IPFS (già decompresso)
+        self.contenuto_merkle_path: bytes | None = None
+
+        # Percorso del file dei Merkle Path nella cache locale (alternativo al contenuto)
+        self.percorso_merkle_path: str | None = None
+
+        # ID delle foglie lette in streaming da IPFS (i path non vengono conservati)
+        self.id_foglie_streaming: list[int] | None = None
+
+        # Cache locale dei file IPFS per CID (None se disattivata)
+        self.cache = cache if cache is not None else ottieni_cache_ipfs()
+
+        # Sessione HTTP opzionale condivisa tra più verifiche (connessioni riutilizzate)
+        self.sessione = sessione
 
     def _recupera_dati(self) -> None:
         """
-        Recupera dal cloud provider la mappa ID → hash relativa al batch.
+        Recupera dal cloud provider la mappa ID → hash relativa al batch,
+        se non è già stata fornita (es. richiesta in blocco per più batch).
         """
+        if self.mappa_id_hash:
+            return
         logger.info(f"Recupero dei dati per il batch ID {self.id_batch}")
-        self.mappa_id_hash = richiedi_mappa_id_hash_batch(self.id_batch)
+        self.mappa_id_hash = richiedi_mappa_id_hash_batch(self.id_batch, self.sessione)
 
     def _recupera_root_e_cid(self) -> None:
         """
@@ -63,21 +90,44 @@ class Verificatore:
 
     def _scarica_merkle_path(self) -> None:
         """
-        Scarica il file JSON contenente i Merkle Path da IPFS.
+        Scarica da IPFS il file contenente i Merkle Path (formato binario o JSON).
         """
         if not self.cid_merkle_path:
             raise ValueError("CID IPFS non inizializzato")
 
         logger.info(f"Scaricamento Merkle Path da IPFS tramite CID {self.cid_merkle_path}")
-        json_string = ottieni_file_da_ipfs(self.cid_merkle_path)
-        self.merkle_paths = carica_paths_da_json_string(json_string)
+        if self.cache is None:
+            self.contenuto_merkle_path = ottieni_bytes_da_ipfs(self.cid_merkle_path, self.sessione)
+            return
+        # il contenuto di un CID non cambia: se è già in cache non serve la rete
+        cid = self.cid_merkle_path
+        self.percorso_merkle_path = self.cache.ottieni_o_scarica(
+            cid, lambda: ottieni_bytes_da_ipfs(cid, self.sessione))
+
+    def _leggi_merkle_path(self) -> None:
+        """
+        Interpreta il file dei Merkle Path scaricato (livelli dell'albero, binario o JSON).
+        """
+        if self.percorso_merkle_path is not None:
+            self.merkle_paths = carica_paths_da_file(self.percorso_merkle_path)
+            return
+        if self.contenuto_merkle_path is None:
+            raise ValueError("File dei Merkle Path non scaricato")
+
+        self.merkle_paths = carica_paths_da_bytes(self.contenuto_merkle_path)
+
+    def _id_foglie_ipfs(self) -> Iterable[int]:
+        """ID delle foglie presenti nel file IPFS."""
+        if self.id_foglie_streaming is not None:
+            return self.id_foglie_streaming
+        return self.merkle_paths.keys()
 
     def _verifica_struttura(self) -> bool:
         """
         Verifica che la struttura delle misurazioni ottenute dal cloud
         coincida con quella presente nel file IPFS (escludendo il nodo batch).
         """
-        id_misurazioni_ipfs = set(self.merkle_paths.keys())
+        id_misurazioni_ipfs = set(self._id_foglie_ipfs())
         id_misurazioni_cloud = set(self.mappa_id_hash.keys())
 
         if id_misurazioni_ipfs != id_misurazioni_cloud:
@@ -105,13 +155,22 @@ class Verificatore:
 
         self._verifica_foglie_con_path()
 
-    def _verifica_foglie_con_path(self) -> DettagliVerifica:
+    def _verifica_foglie_con_path(self, esiti: Dict[int, bool] | None = None) -> DettagliVerifica:
         """
         Verifica ogni foglia rispetto alla Merkle Root attesa usando i Merkle Path.
         Restituisce un dizionario con due liste: 'integre' e 'anomalie'.
+        Le foglie vengono verificate insieme: ogni nodo interno è calcolato una sola volta.
+        Se da IPFS sono stati scaricati i livelli dell'albero, le alterazioni vengono localizzate
+        per bisezione sui nodi memorizzati (AlberoLivelli.verifica_foglie), altrimenti con
+        MerkleTree.verifica_batch. I sottoalberi interamente alterati vengono riportati nel log.
+        Gli esiti già calcolati durante la lettura in streaming possono essere passati in `esiti`.
         """
         foglie_integre = []
         foglie_anomale = []
+        if esiti is None and isinstance(self.merkle_paths, AlberoLivelli):
+            esiti = self.merkle_paths.verifica_foglie(self.mappa_id_hash, self.merkle_root_immutabile)
+        elif esiti is None:
+            esiti = MerkleTree.verifica_batch(self.mappa_id_hash, self.merkle_paths, self.merkle_root_immutabile)
 
         for id_foglia, foglia_hash in self.mappa_id_hash.items():
             tipo = "batch" if id_foglia == 0 else "misurazione"
@@ -119,7 +178,8 @@ class Verificatore:
 
             #se l'id della foglia non compare nel merkle paths scaricato da IPFS
             #ALTERAZIONE STRUTTURA ID DELLA TUPLA
-            if id_foglia not in self.merkle_paths:
+            #(gli esiti contengono solo le foglie presenti sia nel cloud sia nel file IPFS)
+            if id_foglia not in esiti:
                 risultato = {
                     "id": id_mostrato,
                     "tipo": tipo,
@@ -130,8 +190,7 @@ class Verificatore:
                 logger.error(f"[{tipo.upper()}] ID {id_foglia}: Merkle Path mancante")
                 continue #passa alla prossima foglia
 
-            path = self.merkle_paths[id_foglia]
-            esito_operazione = MerkleTree.verifica_singola_foglia(foglia_hash, path, self.merkle_root_immutabile)
+            esito_operazione = esiti[id_foglia]
 
             risultato = {
                 "id": id_mostrato,
@@ -147,41 +206,28 @@ class Verificatore:
                 foglie_anomale.append(risultato)
                 logger.warning(f"[{tipo.upper()}] ID {id_foglia} → ✘ ALTERATO")
 
+        if foglie_anomale:
+            for sottoalbero in MerkleTree.individua_sottoalberi_anomali(esiti, sorted(self._id_foglie_ipfs())):
+                logger.warning(f"Sottoalbero alterato: livello {sottoalbero['livello']}, "
+                               f"ID {sottoalbero['primo_id']}–{sottoalbero['ultimo_id']}")
+
         return {
             "integre": foglie_integre,
             "anomalie": foglie_anomale
         }
 
-    def esegui_verifica_completa(self) -> RisultatoVerifica:
+    def _recupera_riferimenti(self, risultati: RisultatoVerifica) -> bool:
         """
-        Procedura principale di verifica dell’integrità di un batch:
-        - Recupera hash dal cloud
-        - Ottiene Merkle Root e CID da blockchain
-        - Scarica Merkle Path da IPFS
-        - Verifica la struttura e le singole foglie
-
-        Restituisce un dizionario con:
-        - esito_globale: True/False
-        - dettagli: lista di verifiche foglia per foglia
-        - errore: eventuale messaggio di errore bloccante
+        Recupera gli hash dal cloud, la Merkle Root e il CID.
+        In caso di errore lo registra in risultati["stato_elaborazione"] e restituisce False.
         """
-        risultati: RisultatoVerifica = {
-            "esito_globale": False,
-            "stato_elaborazione": "Nessun errore in fase di esecuzione",
-            "numero_anomalie" : 0,
-            "dettagli": {
-                "integre": [],
-                "anomalie": []
-            }
-        }
-
         # 1. Recupero dati hashati dal cloud
         try:
             self._recupera_dati()
         except Exception as e:
             logger.exception("[ERRORE] Errore nella richiesta HTTP al cloud provider")
             risultati["stato_elaborazione"] = f"Errore durante la richiesta dei dati al cloud: {e}"
-            return risultati
+            return False
 
         # 2. Recupero root e CID da blockchain (da implementare)
         try:
@@ -189,25 +235,140 @@ class Verificatore:
         except Exception as e:
             logger.exception("[ERRORE] Errore nel recupero della root e CID da blockchain")
             risultati["stato_elaborazione"] = f"Errore durante il recupero da blockchain: {e}"
-            return risultati
+            return False
+
+        return True
+
+    def scarica_input(self, risultati: RisultatoVerifica) -> bool:
+        """
+        Fase di I/O della verifica: recupera gli hash dal cloud, la Merkle Root e il CID
+        e scarica da IPFS il file dei Merkle Path.
+        In caso di errore lo registra in risultati["stato_elaborazione"] e restituisce False.
+        """
+        if not self._recupera_riferimenti(risultati):
+            return False
 
         # 3. Scaricamento Merkle Path da IPFS
         try:
             self._scarica_merkle_path()
+        except Exception as e:
+            logger.exception("[ERRORE] Errore nello scaricamento dei Merkle Path da IPFS")
+            risultati["stato_elaborazione"] = f"Errore durante lo scaricamento dei Merkle Path da IPFS: {e}"
+            return False
+
+        return True
+
+    def verifica_input(self, risultati: RisultatoVerifica) -> RisultatoVerifica:
+        """
+        Fase di calcolo della verifica, sui dati già scaricati: interpreta i Merkle Path,
+        verifica la struttura e le singole foglie e completa i risultati.
+        """
+        try:
+            self._leggi_merkle_path()
+        except Exception as e:
+            logger.exception("[ERRORE] Errore nella lettura dei Merkle Path scaricati da IPFS")
+            risultati["stato_elaborazione"] = f"Errore durante la lettura dei Merkle Path da IPFS: {e}"
+            return risultati
+
+        return self._completa_risultati(risultati)
+
+    def verifica_in_streaming(self, risultati: RisultatoVerifica) -> RisultatoVerifica:
+        """
+        Verifica senza scaricare prima l'intero file dei Merkle Path: i blocchi scaricati da IPFS
+        vengono decompressi e interpretati man mano e ogni foglia è verificata appena arriva il
+        suo path (MerkleTree.verifica_foglie_in_ordine), senza conservare i path in memoria.
+        Se IPFS contiene i livelli dell'albero, il file viene letto per intero e verificato per bisezione.
+        """
+        if not self._recupera_riferimenti(risultati):
+            return risultati
+
+        # 3. Scaricamento e verifica dei Merkle Path in streaming
+        esiti = None
+        try:
+            logger.info(f"Scaricamento in streaming dei Merkle Path da IPFS tramite CID {self.cid_merkle_path}")
+            sorgente = apri_paths_da_stream(itera_bytes_da_ipfs(self.cid_merkle_path, self.sessione))
+            if isinstance(sorgente, Mapping):
+                self.merkle_paths = sorgente
+            else:
+                self.id_foglie_streaming = []
+
+                def coppie_lette():
+                    for id_foglia, path in sorgente:
+                        self.id_foglie_streaming.append(id_foglia)
+                        yield id_foglia, path
+
+                esiti = dict(MerkleTree.verifica_foglie_in_ordine(
+                    self.mappa_id_hash, coppie_lette(), self.merkle_root_immutabile))
         except Exception as e:
             logger.exception("[ERRORE] Errore nello scaricamento dei Merkle Path da IPFS")
             risultati["stato_elaborazione"] = f"Errore durante lo scaricamento dei Merkle Path da IPFS: {e}"
             return risultati
 
+        return self._completa_risultati(risultati, esiti)
+
+    def _completa_risultati(self, risultati: RisultatoVerifica,
+                            esiti: Dict[int, bool] | None = None) -> RisultatoVerifica:
         # 4. Verifica coerenza tra struttura IPFS e hash cloud
         struttura_valida = self._verifica_struttura()
         if not struttura_valida:
             logger.warning("Verifica eseguita su batch con struttura manomessa")
 
         # 5. Verifica delle foglie rispetto alla Merkle Root
-        risultati["dettagli"] = self._verifica_foglie_con_path()
+        risultati["dettagli"] = self._verifica_foglie_con_path(esiti)
         risultati["numero_anomalie"] = len (risultati["dettagli"]["anomalie"])
         risultati["esito_globale"] = True if  risultati["numero_anomalie"] == 0 else False
         logger.info(f"Processo di verifica completato – Esito: {risultati['esito_globale']}")
 
         return risultati
+
+    def esegui_verifica_completa(self) -> RisultatoVerifica:
+        """
+        Procedura principale di verifica dell’integrità di un batch:
+        - Recupera hash dal cloud
+        - Ottiene Merkle Root e CID da blockchain
+        - Scarica Merkle Path da IPFS
+        - Verifica la struttura e le singole foglie
+
+        Restituisce un dizionario con:
+        - esito_globale: True/False
+        - dettagli: lista di verifiche foglia per foglia
+        - errore: eventuale messaggio di errore bloccante
+
+        Senza cache locale i Merkle Path vengono scaricati e verificati in streaming;
+        con la cache il file viene salvato (o letto se già presente) e poi verificato.
+        """
+        risultati = crea_risultato_vuoto()
+        if self.cache is None:
+            return self.verifica_in_streaming(risultati)
+        if not self.scarica_input(risultati):
+            return risultati
+        return self.verifica_input(risultati)
+
+
+def crea_risultato_vuoto() -> RisultatoVerifica:
+    """Risultato iniziale di una verifica, completato dalle fasi successive."""
+    return {
+        "esito_globale": False,
+        "stato_elaborazione": STATO_NESSUN_ERRORE,
+        "numero_anomalie" : 0,
+        "dettagli": {
+            "integre": [],
+            "anomalie": []
+        }
+    }
+
+
+def verifica_dati_scaricati(id_batch: int, mappa_id_hash: dict[int, str], merkle_root: str,
+                            contenuto_merkle_path: bytes | None,
+                            percorso_merkle_path: str | None = None) -> RisultatoVerifica:
+    """
+    Esegue la fase di calcolo della verifica su dati già scaricati (Verificatore.scarica_input):
+    il file dei Merkle Path è passato come contenuto o come percorso nella cache locale.
+    Funzione di modulo con argomenti serializzabili: può essere eseguita in un ProcessPoolExecutor.
+    """
+    verificatore = Verificatore(id_batch)
+    verificatore.mappa_id_hash = mappa_id_hash
+    verificatore.merkle_root_immutabile = merkle_root
+    verificatore.contenuto_merkle_path = contenuto_merkle_path
+    verificatore.percorso_merkle_path = percorso_merkle_path
+    return verificatore.verifica_input(crea_risultato_vuoto())
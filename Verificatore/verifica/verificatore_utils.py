@@ -1,8 +1,42 @@
 from Classi_comuni.entita.modelli_dati import DatiPayload
 from Classi_comuni.merkle_tree import MerkleTree, PathCompatto
 from Classi_comuni.config.costanti_comuni import ID_BATCH_LOGICO
+from Classi_comuni.formato_path_binario import e_formato_binario, leggi_paths_binario, itera_paths_binario
+from Classi_comuni.albero_livelli import AlberoLivelli, e_livelli_albero, MAGIC_LIVELLI_ALBERO
+import codecs
+import itertools
 import json
-from typing import Dict
+from typing import Dict, Mapping, Iterable, Iterator, Tuple
+
+def carica_paths_da_bytes(contenuto: bytes) -> Mapping[int, PathCompatto]:
+    """
+    Converte il file dei Merkle Path scaricato da IPFS in un dizionario di PathCompatto,
+    riconoscendo il formato dal contenuto:
+    - livelli dell'albero (magic b"MKTL"): i path sono derivati su richiesta (AlberoLivelli)
+    - formato binario dei path (magic b"MKPB")
+    - JSON (formato precedente, mantenuto come fallback)
+    """
+    if e_livelli_albero(contenuto):
+        return AlberoLivelli(contenuto)
+    if e_formato_binario(contenuto):
+        return leggi_paths_binario(contenuto)
+    try:
+        json_string = contenuto.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Formato del file dei Merkle Path non riconosciuto: {e}")
+    return carica_paths_da_json_string(json_string)
+
+def carica_paths_da_file(percorso: str) -> Mapping[int, PathCompatto]:
+    """
+    Come carica_paths_da_bytes, ma da un file locale (cache dei Merkle Path):
+    i livelli dell'albero vengono mappati in memoria (mmap) invece di essere letti.
+    """
+    with open(percorso, "rb") as file:
+        intestazione = file.read(4)
+        if e_livelli_albero(intestazione):
+            return AlberoLivelli.da_file(percorso)
+        file.seek(0)
+        return carica_paths_da_bytes(file.read())
 
 def carica_paths_da_json_string(json_string: str) -> Dict[int, PathCompatto]:
     """
@@ -41,4 +75,111 @@ def carica_paths_da_json_string(json_string: str) -> Dict[int, PathCompatto]:
 
     except (ValueError, KeyError, TypeError) as e:
         # Genera errore dettagliato in caso di formato inaspettato
-        raise ValueError(f"Errore nella deserializzazione dei Merkle Path da JSON: {e}")
\ No newline at end of file
+        raise ValueError(f"Errore nella deserializzazione dei Merkle Path da JSON: {e}")
+
+
+def _crea_path(valori: dict) -> PathCompatto:
+    path = PathCompatto()
+    path.set_direzione(valori["dir"])
+    path.set_hash_fratelli(valori["hash"])
+    return path
+
+def itera_paths_json(blocchi: Iterable[bytes]) -> Iterator[Tuple[int, PathCompatto]]:
+    """
+    Lettura incrementale del JSON dei Merkle Path: restituisce (id_foglia, PathCompatto)
+    per ogni voce appena il suo testo è stato ricevuto, senza costruire né la stringa
+    dell'intero file né il dizionario completo (stesso formato di carica_paths_da_json_string).
+    Ogni voce "id": {...} viene decodificata con JSONDecoder.raw_decode: se il testo ricevuto
+    finisce a metà di una voce, la voce viene riletta solo quando il testo in sospeso è almeno
+    raddoppiato, così anche con blocchi molto piccoli il lavoro resta lineare nella dimensione della voce.
+    """
+    decodificatore_utf8 = codecs.getincrementaldecoder("utf-8")()
+    decodificatore = json.JSONDecoder()
+    spazi = json.decoder.WHITESPACE
+    testo = ""
+    posizione = 0
+    # blocchi ricevuti ma non ancora aggiunti al testo (in attesa del completamento di una voce)
+    in_attesa: list[str] = []
+    lunghezza_in_attesa = 0
+    soglia_nuovo_tentativo = 0
+    # "{" atteso, poi chiave (o "}" se vuoto), poi "," o "}" dopo ogni voce
+    atteso = "apertura"
+    try:
+        for blocco in itertools.chain(blocchi, [None]):
+            ultimo = blocco is None
+            parte = decodificatore_utf8.decode(blocco or b"", final=ultimo)
+            in_attesa.append(parte)
+            lunghezza_in_attesa += len(parte)
+            if not ultimo and len(testo) - posizione + lunghezza_in_attesa < soglia_nuovo_tentativo:
+                continue
+            testo = testo[posizione:] + "".join(in_attesa)
+            in_attesa.clear()
+            lunghezza_in_attesa = 0
+            posizione = 0
+            soglia_nuovo_tentativo = 0
+            while True:
+                posizione = spazi.match(testo, posizione).end()
+                if posizione == len(testo):
+                    break
+                carattere = testo[posizione]
+                if atteso == "apertura":
+                    if carattere != "{":
+                        raise ValueError("'{' atteso all'inizio del file")
+                    posizione += 1
+                    atteso = "prima_voce"
+                elif atteso == "separatore" or (atteso == "prima_voce" and carattere == "}"):
+                    if carattere == "}":
+                        atteso = "fine"
+                    elif carattere != ",":
+                        raise ValueError(f"',' o '}}' atteso in posizione {posizione}")
+                    else:
+                        atteso = "voce"
+                    posizione += 1
+                elif atteso in ("prima_voce", "voce"):
+                    try:
+                        chiave, fine_chiave = decodificatore.raw_decode(testo, posizione)
+                        fine_chiave = spazi.match(testo, fine_chiave).end()
+                        if fine_chiave == len(testo):
+                            raise json.JSONDecodeError("voce incompleta", testo, fine_chiave)
+                        if testo[fine_chiave] != ":":
+                            raise ValueError(f"':' atteso in posizione {fine_chiave}")
+                        inizio_valore = spazi.match(testo, fine_chiave + 1).end()
+                        valori, fine_valore = decodificatore.raw_decode(testo, inizio_valore)
+                    except json.JSONDecodeError:
+                        if ultimo:
+                            raise
+                        # voce incompleta: nuovo tentativo quando il testo in sospeso sarà raddoppiato
+                        soglia_nuovo_tentativo = 2 * (len(testo) - posizione)
+                        break
+                    if not isinstance(chiave, str):
+                        raise ValueError("le chiavi devono essere stringhe")
+                    yield int(chiave), _crea_path(valori)
+                    posizione = fine_valore
+                    atteso = "separatore"
+                else:
+                    raise ValueError(f"contenuto inatteso dopo la fine del JSON in posizione {posizione}")
+        if atteso != "fine":
+            raise ValueError("file JSON troncato")
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Errore nella deserializzazione dei Merkle Path da JSON: {e}")
+
+def apri_paths_da_stream(blocchi: Iterable[bytes]) -> Mapping[int, PathCompatto] | Iterator[Tuple[int, PathCompatto]]:
+    """
+    Riconosce il formato dai primi byte del file dei Merkle Path scaricato in streaming:
+    - formato binario dei path o JSON: restituisce un iteratore di (id_foglia, PathCompatto)
+      che legge i blocchi man mano che arrivano;
+    - livelli dell'albero: i path derivano dai livelli superiori, che seguono le foglie nel file,
+      quindi il file viene letto per intero e restituito come AlberoLivelli.
+    """
+    iteratore = iter(blocchi)
+    inizio = b""
+    for blocco in iteratore:
+        inizio += blocco
+        if len(inizio) >= len(MAGIC_LIVELLI_ALBERO):
+            break
+    blocchi = itertools.chain([inizio], iteratore)
+    if e_livelli_albero(inizio):
+        return AlberoLivelli(b"".join(blocchi))
+    if e_formato_binario(inizio):
+        return itera_paths_binario(blocchi)
+    return itera_paths_json(blocchi)